@@ -0,0 +1,90 @@
+from datetime import timedelta
+from itertools import takewhile
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChatRoom, Message, MessageArchive
+
+# ห้องที่ปิดแล้ว = สินค้าขายแล้วหรือถูกปฏิเสธ (สินค้าที่ถูกลบ ห้องและข้อความถูกลบตามไปแล้ว)
+CLOSED_STATUSES = ('sold', 'rejected')
+# ย้ายข้อความที่เก่ากว่านี้ (วัน) ของห้องที่ปิดแล้ว
+ARCHIVE_AFTER_DAYS = 90
+# จำนวนข้อความต่อชุด = ต่อ transaction (lock สั้นๆ ต่อครั้ง และเป็นขนาดของ MessageArchive 1 แถว)
+BATCH_SIZE = 500
+
+
+def archive_cutoff(days=ARCHIVE_AFTER_DAYS):
+    return timezone.now() - timedelta(days=days)
+
+
+def closed_rooms(cutoff):
+    """id ของห้องที่ปิดแล้วและยังมีข้อความเก่ากว่า cutoff อยู่ในตาราง Message"""
+    return list(
+        ChatRoom.objects.filter(product__status__in=CLOSED_STATUSES, messages__timestamp__lt=cutoff)
+        .order_by('id').values_list('id', flat=True).distinct()
+    )
+
+
+def archive_batch(room_id, cutoff, batch_size=BATCH_SIZE):
+    """
+    ย้ายข้อความที่เก่าที่สุดของห้องไม่เกิน batch_size รายการไปเป็น MessageArchive 1 ชุด คืนค่าจำนวนที่ย้าย
+    ย้ายเฉพาะช่วงต้น (เรียงตาม id) ที่เก่ากว่า cutoff ข้อความที่ย้ายแล้วจึงเก่ากว่าข้อความที่เหลือในตารางเสมอ
+    (message_history อ่านตาราง Message ก่อนแล้วต่อด้วย archive ตาม id)
+    """
+    with transaction.atomic():
+        # lock แถวของห้องกันงานย้ายสองตัวทำช่วงเดียวกัน ห้องที่กำลังมีข้อความใหม่ (ถือ lock อยู่) ข้ามไปรอบหน้า
+        room = ChatRoom.objects.select_for_update(skip_locked=True).filter(id=room_id).first()
+        if room is None:
+            return 0
+        messages = Message.objects.filter(room_id=room_id).order_by('id')[:batch_size]
+        messages = list(takewhile(lambda message: message.timestamp < cutoff, messages))
+        if not messages:
+            return 0
+        MessageArchive.pack(room_id, messages).save()
+        Message.objects.filter(id__in=[message.id for message in messages]).delete()
+        ChatRoom.objects.filter(id=room_id).update(archived_until_id=messages[-1].id)
+    return len(messages)
+
+
+def archive_room(room_id, cutoff, batch_size=BATCH_SIZE):
+    moved = 0
+    while True:
+        count = archive_batch(room_id, cutoff, batch_size)
+        moved += count
+        if count < batch_size:
+            return moved
+
+
+def archived_messages(room, before_id, limit):
+    """
+    ข้อความที่ย้ายไปเก็บแล้วของห้อง ที่ id น้อยกว่า before_id (None = ทั้งหมด) เรียงใหม่ -> เก่า ไม่เกิน limit รายการ
+    อ่านทีละชุดจากชุดที่ใหม่ที่สุด คลายเฉพาะชุดที่ต้องใช้ (ปกติ 1 ชุดต่อหน้า)
+    """
+    segments = MessageArchive.objects.filter(room=room).order_by('-last_id')
+    messages = []
+    while len(messages) < limit:
+        segment = (segments.filter(first_id__lt=before_id) if before_id else segments).first()
+        if segment is None:
+            break
+        messages.extend(
+            message for message in reversed(segment.unpack()) if not before_id or message.id < before_id
+        )
+        before_id = segment.first_id
+    return messages[:limit]
+
+
+def archived_messages_after(room, after_id, limit):
+    """
+    ข้อความที่ย้ายไปเก็บแล้วของห้อง ที่ id มากกว่า after_id เรียงเก่า -> ใหม่ ไม่เกิน limit รายการ
+    (เลื่อนลงหลังกระโดดไปยังข้อความเก่าจากผลค้นหา) อ่านทีละชุดเหมือน archived_messages
+    """
+    segments = MessageArchive.objects.filter(room=room).order_by('last_id')
+    messages = []
+    while len(messages) < limit:
+        segment = segments.filter(last_id__gt=after_id).first()
+        if segment is None:
+            break
+        messages.extend(message for message in segment.unpack() if message.id > after_id)
+        after_id = segment.last_id
+    return messages[:limit]
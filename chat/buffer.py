@@ -0,0 +1,148 @@
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .models import ChatRoom, Message
+from .profiles import ProfileResolver
+from .serializers import message_payload, room_group_name
+
+logger = logging.getLogger(__name__)
+
+# บันทึกไม่เกิน FLUSH_SIZE ข้อความต่อ INSERT (ข้อความที่มาระหว่างบันทึกรวมเป็นชุดถัดไป)
+FLUSH_SIZE = 100
+
+# ชุดที่บันทึกไม่สำเร็จ (เช่น DB หลุด) ถูกใส่คืนหน้าคิวแล้วลองใหม่หลังรอ RETRY_DELAY วินาที ไม่เกิน WRITE_ATTEMPTS ครั้ง
+WRITE_ATTEMPTS = 3
+RETRY_DELAY = 1.0
+
+
+class MessageWriteBuffer:
+    """
+    บันทึกข้อความแชทแบบ group commit (1 ตัวต่อ process)
+    - consumer ฝากข้อความไว้แล้วกลับไปรับ frame ถัดไปทันที ไม่ต้องรอ INSERT
+    - task เบื้องหลังบันทึกข้อความที่ค้างอยู่ทั้งหมดด้วย bulk_create ครั้งละไม่เกิน FLUSH_SIZE
+      ข้อความที่มาระหว่างบันทึกรวมเป็นชุดถัดไป (โหลดน้อยบันทึกทันที โหลดมากได้ชุดใหญ่ขึ้นเอง)
+    - ส่งเข้ากลุ่มหลัง commit พร้อม id จริงจาก sequence: id เรียงตามลำดับที่บันทึกเหมือนข้อความจาก view
+      และข้อความที่ client ได้รับอยู่ใน DB แล้วเสมอ catch-up (id > last_id) / long-poll / ประวัติแชทจึงไม่ข้ามข้อความ
+    """
+
+    def __init__(self, flush_size=FLUSH_SIZE):
+        self.flush_size = flush_size
+        self._pending = []
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, message):
+        """
+        ฝากข้อความ (ยังไม่มี id) ไว้บันทึกแล้วส่งเข้ากลุ่มของห้อง
+        message.profiles = ProfileResolver ของการเชื่อมต่อที่ส่ง ใช้หารูปผู้ส่งใน payload
+        """
+        self._pending.append(message)
+        if not self._running():
+            self._task = asyncio.ensure_future(self._run())
+
+    def _running(self):
+        # task ของ event loop อื่นที่ปิดไปแล้ว (เช่นระหว่างทดสอบ) ไม่มีวันทำต่อ -> เริ่มใหม่ใน loop นี้
+        return (
+            self._task is not None and not self._task.done()
+            and self._task.get_loop() is asyncio.get_running_loop()
+        )
+
+    async def _run(self):
+        attempts = 0
+        while self._pending:
+            batch, self._pending = self._pending[:self.flush_size], self._pending[self.flush_size:]
+            try:
+                saved = await database_sync_to_async(self._write_with_avatars)(batch)
+            except Exception:
+                attempts += 1
+                if attempts >= WRITE_ATTEMPTS:
+                    logger.exception("บันทึกข้อความแชท %d รายการไม่สำเร็จ %d ครั้ง ทิ้งชุดนี้", len(batch), attempts)
+                    attempts = 0
+                    continue
+                logger.exception("บันทึกข้อความแชท %d รายการไม่สำเร็จ จะลองใหม่", len(batch))
+                self._pending[:0] = batch
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            attempts = 0
+            try:
+                await self._broadcast(saved)
+            except Exception:
+                logger.exception("ส่งข้อความแชท %d รายการเข้ากลุ่มไม่สำเร็จ", len(saved))
+
+    @staticmethod
+    async def _broadcast(messages):
+        channel_layer = get_channel_layer()
+        for message in messages:
+            await channel_layer.group_send(room_group_name(message.room_id), {
+                'type': 'chat_message',
+                'message_data': message_payload(message, sender_avatar=message.sender_avatar),
+            })
+
+    async def flush(self):
+        """รอจนข้อความที่ฝากไว้ถูกบันทึกและส่งครบ (consumer ปิด / จบ load test)"""
+        while self._pending or self._running():
+            if not self._running():
+                self._task = asyncio.ensure_future(self._run())
+            # ผู้เรียกถูกยกเลิก (เช่น disconnect หมดเวลา) ก็ไม่ยกเลิกงานบันทึกของข้อความอื่น
+            await asyncio.shield(self._task)
+
+    def flush_sync(self):
+        """บันทึกข้อความที่ค้างอยู่ (ใช้ตอน process ปิด ซึ่ง event loop อาจหยุดไปแล้ว จึงไม่ส่งเข้ากลุ่ม)"""
+        batch, self._pending = self._pending, []
+        if batch:
+            self._write(batch)
+
+    @classmethod
+    def _write_with_avatars(cls, batch):
+        """บันทึกชุดข้อความแล้วใส่ sender_avatar (resolver ละ 1 query สำหรับผู้ส่งที่ยังไม่รู้จัก)"""
+        saved = cls._write(batch)
+        # บันทึกแล้ว: หารูปไม่สำเร็จก็ยังต้องส่งข้อความ (ห้ามให้ _run บันทึกชุดนี้ซ้ำ)
+        fallback = ProfileResolver()
+        senders = {}
+        for message in saved:
+            senders.setdefault(getattr(message, 'profiles', None) or fallback, set()).add(message.sender_id)
+        try:
+            avatars = {resolver: resolver.avatars(user_ids) for resolver, user_ids in senders.items()}
+        except Exception:
+            logger.exception("โหลดรูปผู้ส่งของข้อความแชท %d รายการไม่สำเร็จ", len(saved))
+            avatars = {resolver: {} for resolver in senders}
+        for message in saved:
+            message.sender_avatar = avatars[getattr(message, 'profiles', None) or fallback].get(message.sender_id)
+        return saved
+
+    @staticmethod
+    def _write(batch):
+        """บันทึกชุดข้อความ คืนค่าข้อความที่บันทึกสำเร็จ (id ถูกกำหนดโดย INSERT)"""
+        try:
+            # bulk_create ไม่เรียก Message.save จึงต้องอัปเดตข้อมูลห้องเองใน transaction เดียวกัน
+            for message in batch:
+                message.index_content()
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+                ChatRoom.record_messages(batch)
+            return batch
+        except Exception:
+            logger.exception("bulk_create ข้อความแชท %d รายการไม่สำเร็จ บันทึกทีละรายการแทน", len(batch))
+        # เช่นห้องถูกลบไประหว่างรอ -> ข้อความของห้องนั้นบันทึกไม่ได้ แต่ข้อความอื่นยังต้องบันทึก
+        # (Message.save อัปเดตข้อมูลห้องให้เอง)
+        saved = []
+        for message in batch:
+            # bulk_create อาจกำหนด id / สถานะไว้แล้วก่อน transaction ล้มเหลว -> บันทึกเป็นข้อความใหม่อีกครั้ง
+            message.pk, message._state.adding = None, True
+            try:
+                message.save(force_insert=True)
+                saved.append(message)
+            except Exception:
+                logger.exception("บันทึกข้อความแชทของห้อง %s ไม่สำเร็จ", message.room_id)
+        return saved
+
+
+message_buffer = MessageWriteBuffer()
+atexit.register(message_buffer.flush_sync)
@@ -1,54 +1,296 @@
-import json
+import asyncio
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import ChatRoom, Message
-from django.contrib.auth.models import User
+from django.db.models import Q
+from django.utils import timezone
+from .buffer import message_buffer
+from .profiles import ProfileResolver
+from .metrics import gauges
+from .models import ChatRoom, Message, ReadCursor
+from .presence import (
+    TTLStore, presence_event, typing_event,
+    PRESENCE_TTL, PRESENCE_REFRESH, TYPING_TTL, TYPING_THROTTLE,
+)
+from .serializers import (
+    room_group_name, messages_after, parse_last_id, read_receipt_event,
+    negotiate_subprotocol, encode_json, encode_msgpack, decode_client_frame, MSGPACK_SUBPROTOCOL,
+)
+
+# msgpack: event ที่เกิดใกล้กัน (ภายใน BATCH_WINDOW วินาที) รวมส่งใน frame เดียว ไม่เกิน BATCH_SIZE รายการ
+BATCH_WINDOW = 0.01
+BATCH_SIZE = 50
+# event ที่ client ยังไม่ได้รับได้ไม่เกิน OUTBOX_LIMIT ต่อการเชื่อมต่อ (ค้างในคิว + ส่งแล้วแต่ client ยังไม่ตอบ pong)
+# เกินแล้ว: event ที่ทิ้งได้ (สถานะชั่วคราว เดี๋ยวมีค่าใหม่มาแทน) ถูกทิ้ง ส่วนข้อความ/read receipt ทิ้งไม่ได้
+# จึงตัดการเชื่อมต่อแทน (client ต่อใหม่แล้วดึงข้อความที่พลาดด้วย last_id) ห้องจึงไม่ต้องรอ client ที่ช้า
+OUTBOX_LIMIT = 200
+DROPPABLE = ('presence', 'typing')
+# client ที่เลือก subprotocol ได้ ping ทุก HEARTBEAT_INTERVAL วินาที (ตอบ pong) เงียบเกิน IDLE_TIMEOUT = ตัดทิ้ง
+# (client เดิมที่ไม่มี subprotocol ไม่รู้จัก ping: ใช้ ping ระดับ WebSocket ของ Daphne ตามเดิม และไม่มี OUTBOX_LIMIT ดู backlog)
+HEARTBEAT_INTERVAL = 25
+IDLE_TIMEOUT = 75
+CLOSE_IDLE = 4000
+CLOSE_SLOW = 4008
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.room_group_name = f'chat_{self.room_id}'
+        self.room_id = int(self.scope['url_route']['kwargs']['room_id'])
+        self.room_group_name = room_group_name(self.room_id)
+        self.user = self.scope.get('user')
 
-        # เข้ากลุ่มแชท
+        # เฉพาะผู้ซื้อ/ผู้ขายของห้องนี้เท่านั้น (ตรวจครั้งเดียวตอนเชื่อมต่อ ใช้ไปตลอดการเชื่อมต่อ)
+        self.room = await self.load_room()
+        if self.room is None:
+            await self.close()
+            return
+        # รูป/ชื่อของผู้ส่ง จำไว้ตลอดการเชื่อมต่อ (ล้างเองเมื่อโปรไฟล์เปลี่ยน ดู chat.profiles)
+        self.profiles = ProfileResolver()
+
+        # เข้ากลุ่มแชท (ก่อนดึงข้อความที่พลาดไป เพื่อไม่ให้มีข้อความหลุดระหว่างสองขั้นตอน)
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        # client ใหม่ขอ msgpack (frame แบบ binary รวมหลาย event) ผ่าน subprotocol, client เดิมได้ JSON ตามเดิม
+        self.subprotocol = negotiate_subprotocol(self.scope.get('subprotocols') or [])
+        self.batching = self.subprotocol == MSGPACK_SUBPROTOCOL
+        self.outbox = []
+        self.outbox_timer = None
+        self.heartbeat = self.subprotocol is not None
+        self.queued_seq = 0  # จำนวน event ที่ส่งเข้าคิวแล้ว (ping บอก client ว่าถึงลำดับไหน)
+        self.acked_seq = 0   # ลำดับล่าสุดที่ client ตอบ pong กลับมา
+        self.ping_seq = None
+        self.closing = False
+        self.last_seen = time.monotonic()
+        await self.accept(subprotocol=self.subprotocol)
+        gauges.connected(self)
+        await self.publish_gauges()
+        if self.heartbeat:
+            self.heartbeat_task = asyncio.ensure_future(self.heartbeat_loop())
+
+        # สถานะของอีกฝ่ายที่ได้ยินผ่าน channel layer (หมดอายุในหน่วยความจำ ไม่เขียน DB)
+        self.peers = TTLStore()
+        self.typing = TTLStore()
+        self.last_typing_sent = None
+        self.presence_changed = asyncio.Event()
+        # ประกาศว่าเข้ามาแล้ว และขอให้คนที่อยู่ในห้องตอบสถานะของตัวเองกลับมา
+        await self.channel_layer.group_send(self.room_group_name, presence_event(self.user.id, True, reply=True))
+        self.presence_task = asyncio.ensure_future(self.presence_loop())
+
+        # reconnect: ส่งข้อความที่พลาดไประหว่างหลุด (?last_id=<id ล่าสุดที่มี>)
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        last_id = parse_last_id(query.get('last_id', [0])[0])
+        if last_id:
+            for data in await database_sync_to_async(messages_after)(self.room_id, last_id, self.profiles):
+                await self.send_event(data)
 
     async def disconnect(self, close_code):
+        outbox_timer = getattr(self, 'outbox_timer', None)
+        if outbox_timer is not None:
+            outbox_timer.cancel()
+        heartbeat_task = getattr(self, 'heartbeat_task', None)
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+        if getattr(self, 'room', None) is not None:
+            gauges.disconnected(self)
+            await self.publish_gauges(force=not gauges.consumers)
+        presence_task = getattr(self, 'presence_task', None)
+        if presence_task is not None:
+            presence_task.cancel()
+            await self.channel_layer.group_send(self.room_group_name, presence_event(self.user.id, False))
+
         # ออกจากกลุ่ม
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        # บันทึกข้อความที่ยังค้างในบัฟเฟอร์
+        await message_buffer.flush()
 
     # รับข้อความจาก WebSocket (Frontend)
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-        sender_id = text_data_json['sender_id']
+    async def receive(self, text_data=None, bytes_data=None):
+        self.last_seen = time.monotonic()
+        text_data_json = decode_client_frame(text_data, bytes_data)
+        if text_data_json.get('type') == 'pong':
+            self.pong(parse_last_id(text_data_json.get('seq')))
+            return
+        # read receipt: {"type": "read", "last_id": <id ของข้อความล่าสุดที่เห็นแล้ว>}
+        if text_data_json.get('type') == 'read':
+            await self.mark_read(parse_last_id(text_data_json.get('last_id')))
+            return
+        if text_data_json.get('type') == 'typing':
+            await self.typing_started()
+            return
 
-        # บันทึกลงฐานข้อมูล
-        await self.save_message(sender_id, message)
+        message = str(text_data_json.get('message') or '').strip()
+        if not message:
+            return
 
-        # ส่งข้อความไปให้ทุกคนในกลุ่ม (รวมถึงตัวเอง)
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'sender_id': sender_id
-            }
-        )
+        # ผู้ส่ง = ผู้ใช้ที่ login อยู่ (ไม่เชื่อ sender_id จาก client)
+        saved = Message(room_id=self.room_id, sender_id=self.user.id, content=message, timestamp=timezone.now())
+        saved.profiles = self.profiles
+
+        # บันทึกเป็นชุดโดย task เบื้องหลัง แล้วส่งให้ทุกคนในกลุ่ม (รวมถึงตัวเอง) พร้อม id จริงหลัง commit
+        message_buffer.add(saved)
+        # ข้อความถัดไปที่เริ่มพิมพ์ส่ง typing ได้ทันที (client ซ่อน "กำลังพิมพ์" เมื่อได้รับข้อความแล้ว)
+        self.last_typing_sent = None
 
     # รับข้อความจากกลุ่ม แล้วส่งกลับไปหา Frontend
     async def chat_message(self, event):
+        self.typing.discard(event['message_data'].get('sender_id'))
         # ส่งต่อข้อมูล JSON ไปให้ Frontend (JavaScript)
-        await self.send(text_data=json.dumps(event['message_data']))
+        await self.send_event(event['message_data'])
+
+    async def send_event(self, data):
+        if self.closing:
+            return
+        if data.get('type') != 'ping' and self.backlog() >= OUTBOX_LIMIT:
+            if data.get('type') in DROPPABLE:
+                gauges.count('dropped_events')
+                return
+            await self.close_for('closed_slow', CLOSE_SLOW)
+            return
+        self.queued_seq += 1
+
+        if not self.batching:
+            await self.send(text_data=encode_json(data))
+        else:
+            self.outbox.append(data)
+            if len(self.outbox) >= BATCH_SIZE:
+                await self.flush_outbox()
+            elif self.outbox_timer is None or self.outbox_timer.done():
+                self.outbox_timer = asyncio.ensure_future(self._flush_outbox_later())
+
+        # ค้างครึ่งทางแล้ว: ขอ pong เพื่อรู้ว่า client รับทันหรือไม่ ก่อนถึง OUTBOX_LIMIT
+        if self.heartbeat and self.ping_seq is None and self.backlog() >= OUTBOX_LIMIT // 2:
+            await self.ping()
+
+    def backlog(self):
+        """
+        event ที่ client ยังไม่ได้รับ = ส่งแล้วแต่ยังไม่ยืนยันด้วย pong (+ ที่ค้างใน outbox ของ msgpack)
+        client เดิม (ไม่มี subprotocol) ไม่ตอบ pong จึงวัดไม่ได้: ได้ 0 เสมอ ไม่ถูกจำกัดด้วย OUTBOX_LIMIT
+        event ของ client กลุ่มนี้ค้างใน buffer ขาออกของ server (Daphne) ได้ไม่จำกัด ขอบเขตเดียวคือ capacity
+        ของ channel layer ต่อ channel และ ping ระดับ WebSocket ของ Daphne (นับแยกใน gauges เป็น unmetered_connections)
+        """
+        if self.heartbeat:
+            return self.queued_seq - self.acked_seq
+        return 0
+
+    async def close_for(self, counter, code):
+        self.closing = True
+        self.outbox = []
+        gauges.count(counter)
+        await self.close(code=code)
+
+    # --- heartbeat ---
+    async def ping(self):
+        # ping เป็น event ลำดับถัดไป: pong ที่มี seq นี้ = client ได้รับทุก event ก่อนหน้าแล้ว
+        self.ping_seq = self.queued_seq + 1
+        await self.send_event({'type': 'ping', 'seq': self.ping_seq})
+
+    def pong(self, seq):
+        self.acked_seq = min(max(self.acked_seq, seq), self.queued_seq)
+        if self.ping_seq is not None and seq >= self.ping_seq:
+            self.ping_seq = None
+
+    async def heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_seen > IDLE_TIMEOUT:
+                await self.close_for('closed_idle', CLOSE_IDLE)
+                return
+            if self.ping_seq is None:
+                await self.ping()
+            await self.publish_gauges()
+
+    async def publish_gauges(self, force=False):
+        if gauges.due(force):
+            await sync_to_async(gauges.publish)()
+
+    async def _flush_outbox_later(self):
+        await asyncio.sleep(BATCH_WINDOW)
+        await self.flush_outbox()
+
+    async def flush_outbox(self):
+        batch, self.outbox = self.outbox, []
+        if batch:
+            await self.send(bytes_data=encode_msgpack(batch))
+
+    # --- presence / typing ---
+    async def typing_started(self):
+        # คีย์ที่กดถี่ๆ รวมเป็น typing ครั้งเดียวต่อ TYPING_THROTTLE วินาที (ผู้รับต่ออายุ TYPING_TTL เอง)
+        now = self.typing.clock()
+        if self.last_typing_sent is not None and now - self.last_typing_sent < TYPING_THROTTLE:
+            return
+        self.last_typing_sent = now
+        await self.channel_layer.group_send(self.room_group_name, typing_event(self.user.id))
+
+    async def presence_update(self, event):
+        user_id = event['user_id']
+        if user_id == self.user.id:
+            return
+        if not event['online']:
+            self.typing.discard(user_id)
+            if self.peers.discard(user_id):
+                await self.send_event({'type': 'presence', 'user_id': user_id, 'online': False})
+            return
+
+        # ส่งให้ client เฉพาะตอนที่สถานะเปลี่ยน (การต่ออายุเป็นระยะไม่ต้องส่ง)
+        if self.peers.touch(user_id, PRESENCE_TTL):
+            await self.send_event({'type': 'presence', 'user_id': user_id, 'online': True})
+            self.presence_changed.set()
+        if event['reply']:
+            await self.channel_layer.group_send(self.room_group_name, presence_event(self.user.id, True))
+
+    async def typing_update(self, event):
+        user_id = event['user_id']
+        if user_id == self.user.id:
+            return
+        if self.typing.touch(user_id, TYPING_TTL):
+            await self.send_event({'type': 'typing', 'user_id': user_id, 'typing': True})
+            self.presence_changed.set()
+
+    async def presence_loop(self):
+        """ประกาศว่ายังออนไลน์ทุก PRESENCE_REFRESH วินาที และแจ้ง client เมื่อสถานะของอีกฝ่ายหมดอายุ"""
+        clock = self.peers.clock
+        next_refresh = clock() + PRESENCE_REFRESH
+        while True:
+            deadlines = [next_refresh, self.peers.next_expiry(), self.typing.next_expiry()]
+            timeout = max(min(d for d in deadlines if d is not None) - clock(), 0)
+            self.presence_changed.clear()
+            try:
+                # ตื่นก่อนกำหนดถ้ามี key ใหม่ที่อาจหมดอายุก่อน deadline เดิม
+                await asyncio.wait_for(self.presence_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            for user_id in self.typing.expire():
+                await self.send_event({'type': 'typing', 'user_id': user_id, 'typing': False})
+            for user_id in self.peers.expire():
+                await self.send_event({'type': 'presence', 'user_id': user_id, 'online': False})
+            if clock() >= next_refresh:
+                next_refresh = clock() + PRESENCE_REFRESH
+                await self.channel_layer.group_send(self.room_group_name, presence_event(self.user.id, True))
+
+    async def mark_read(self, last_id):
+        cursor = await database_sync_to_async(ReadCursor.mark_read)(self.user.id, self.room_id, last_id)
+        # แจ้งอีกฝ่ายเฉพาะตอนที่ตำแหน่งที่อ่านเลื่อนไปจริง
+        if cursor is not None:
+            await self.channel_layer.group_send(self.room_group_name, read_receipt_event(self.user.id, cursor.last_read_id))
+
+    async def read_receipt(self, event):
+        await self.send_event(event['receipt_data'])
+
+    async def image_ready(self, event):
+        await self.send_event(event['image_data'])
 
     @database_sync_to_async
-    def save_message(self, sender_id, message):
-        user = User.objects.get(id=sender_id)
-        room = ChatRoom.objects.get(id=self.room_id)
-        Message.objects.create(sender=user, room=room, content=message)
\ No newline at end of file
+    def load_room(self):
+        if self.user is None or not self.user.is_authenticated:
+            return None
+        return ChatRoom.objects.filter(
+            Q(buyer=self.user) | Q(seller=self.user), id=self.room_id
+        ).first()
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from asgiref.sync import SyncToAsync, async_to_sync
+from channels.layers import get_channel_layer
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import Message
+from .serializers import room_group_name, image_ready_event
+
+logger = logging.getLogger(__name__)
+
+# ขนาด (ด้านยาวสุด, px) ของรูปที่แสดงเมื่อกดดู / รูปย่อใน bubble แชท (ต้นฉบับเก็บไว้เปิดดูเมื่อขอเท่านั้น)
+DISPLAY_SIZE = 1280
+THUMB_SIZE = 320
+DISPLAY_QUALITY = 85
+THUMB_QUALITY = 70
+# จำนวน thread ที่ย่อรูป (Pillow ปล่อย GIL ระหว่าง decode/resize จึงทำงานขนานกันได้จริง)
+IMAGE_WORKERS = 2
+# เวลารอ (วินาที) ให้ event loop ของ server ส่ง image_ready เข้ากลุ่ม
+BROADCAST_TIMEOUT = 10
+
+executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='chat-image')
+
+
+def render_variants(file):
+    """ย่อรูปต้นฉบับเป็น (รูปขนาดแสดงผล, รูปย่อ) แบบ JPEG"""
+    with Image.open(file) as image:
+        # JPEG: ให้ decoder ลดขนาดระหว่าง decode (เร็วกว่าและใช้หน่วยความจำน้อยกว่า decode เต็มแล้วค่อยย่อ)
+        image.draft('RGB', (DISPLAY_SIZE, DISPLAY_SIZE))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    image.thumbnail((DISPLAY_SIZE, DISPLAY_SIZE), Image.LANCZOS)
+    display = _encode(image, DISPLAY_QUALITY)
+    # รูปย่อทำจากรูปขนาดแสดงผล (เล็กกว่าต้นฉบับมาก)
+    image.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.LANCZOS)
+    return display, _encode(image, THUMB_QUALITY)
+
+
+def _encode(image, quality):
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def process_message_image(message_id, loop=None):
+    """
+    ย่อรูปของข้อความ บันทึกลง storage แล้วแจ้งห้องด้วย event image_ready
+    ย่อไม่ได้ (ไฟล์เสีย / ไม่ใช่รูป) ก็ยังถือว่าเสร็จ: client แสดงรูปต้นฉบับแทน
+    loop = event loop ของ server ที่ใช้ส่ง event (ดู broadcast)
+    """
+    message = Message.objects.filter(id=message_id).exclude(image='').first()
+    if message is None or not message.image:
+        return
+    try:
+        with message.image.open('rb') as file:
+            display, thumb = render_variants(file)
+        stem = os.path.splitext(os.path.basename(message.image.name))[0]
+        message.image_display.save(f'{stem}.jpg', display, save=False)
+        message.image_thumb.save(f'{stem}.jpg', thumb, save=False)
+    except Exception:
+        logger.exception("ย่อรูปของข้อความแชท id=%s ไม่สำเร็จ ใช้รูปต้นฉบับแทน", message_id)
+        message.image_display = message.image_thumb = None
+    message.image_ready = True
+    # update แทน save: ไม่ต้องผ่าน Message.save และไม่ทับฟิลด์อื่นที่อาจเปลี่ยนระหว่างย่อรูป
+    Message.objects.filter(id=message_id).update(
+        image_display=message.image_display.name or '',
+        image_thumb=message.image_thumb.name or '',
+        image_ready=True,
+    )
+    broadcast(room_group_name(message.room_id), image_ready_event(message), loop)
+
+
+def broadcast(group, event, loop=None):
+    """
+    ส่ง event เข้ากลุ่มจาก thread ของ pool
+    channel layer (InMemory / ส่งภายใน process ของ PostgresChannelLayer) ใช้ queue ของ event loop ของ server
+    ซึ่งเรียกจาก thread อื่นไม่ได้ -> ส่งงานกลับไปทำใน loop นั้น
+    ไม่มี loop ของ server (WSGI / management command) ก็ส่งจาก loop ชั่วคราวตามเดิม
+    """
+    if loop is None or loop.is_closed():
+        async_to_sync(get_channel_layer().group_send)(group, event)
+        return
+    future = asyncio.run_coroutine_threadsafe(get_channel_layer().group_send(group, event), loop)
+    future.result(timeout=BROADCAST_TIMEOUT)
+
+
+def server_loop():
+    """
+    event loop ของ server ที่รันโค้ดนี้อยู่ (None ถ้าไม่มี)
+    view แบบ sync ใต้ ASGI รันใน thread ของ sync_to_async ซึ่ง asgiref จำ loop หลักไว้ (แบบเดียวกับ async_to_sync)
+    """
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    if getattr(SyncToAsync.threadlocal, 'main_event_loop_pid', None) != os.getpid():
+        return None
+    return getattr(SyncToAsync.threadlocal, 'main_event_loop', None)
+
+
+def _run(message_id, loop):
+    # thread ของ pool อยู่ตลอดอายุ process: ปิด connection ที่หมดอายุก่อน/หลังงาน เหมือนรอบของ request
+    close_old_connections()
+    try:
+        process_message_image(message_id, loop)
+    except Exception:
+        logger.exception("ประมวลผลรูปของข้อความแชท id=%s ไม่สำเร็จ", message_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_image_processing(message_id):
+    """
+    ส่งงานย่อรูปเข้า pool หลัง commit (worker ต้องเห็นแถวของข้อความแล้ว) ไม่ต้องรอผลใน request
+    จำ event loop ของ server ไว้ตอนนี้ เพื่อให้ worker ส่ง image_ready ผ่าน loop นั้น
+    """
+    loop = server_loop()
+    transaction.on_commit(lambda: executor.submit(_run, message_id, loop))
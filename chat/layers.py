@@ -0,0 +1,348 @@
+import asyncio
+import base64
+import logging
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.db import connections
+
+from .models import ChannelGroupMember, ChannelLayerMessage
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY รับ payload ได้ไม่เกิน 8000 bytes: ข้อความที่ยาวกว่านี้เก็บใน ChannelLayerMessage แล้วส่งแค่ id
+NOTIFY_LIMIT = 7500
+# ชื่อ channel ของ LISTEN/NOTIFY = LISTEN_PREFIX + รหัสของ process
+LISTEN_PREFIX = 'chat_layer_'
+# ลบสมาชิกกลุ่มที่หมดอายุ / ข้อความใหญ่ที่เก่าแล้ว ไม่เกิน 1 ครั้งต่อ CLEANUP_INTERVAL วินาทีต่อ process
+CLEANUP_INTERVAL = 60
+
+MEMBERS = ChannelGroupMember._meta.db_table
+STORED = ChannelLayerMessage._meta.db_table
+
+
+class PostgresChannelLayer(BaseChannelLayer):
+    """
+    channel layer ที่ใช้ PostgreSQL LISTEN/NOTIFY ส่ง event ข้าม process (ไม่ต้องมี Redis)
+    - channel ของแต่ละ process (new_channel) รอข้อความในคิวของ process นั้น ส่งภายใน process เดียวกันไม่ผ่าน DB
+    - สมาชิกของกลุ่มเก็บใน ChannelGroupMember: group_send = 1 query ที่ NOTIFY ทุก process ที่มีสมาชิก
+      แต่ละ process ส่งต่อให้ channel ของตัวเองในกลุ่มนั้น (สมาชิกที่อยู่ใน process นี้เก็บไว้ใน self.groups ด้วย)
+    - คิวของแต่ละ channel จำกัดขนาดตาม capacity: send ใน process เดียวกันได้ ChannelFull
+      ข้อความจาก process อื่นที่มาถึงตอนคิวเต็มถูกทิ้ง (เหมือน group_send ของ InMemoryChannelLayer)
+    รองรับเฉพาะ channel แบบ process-specific ('...!...') ซึ่ง consumer ใช้ ไม่รองรับ channel กลางของ worker
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, alias='default', expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.alias = alias
+        self.group_expiry = group_expiry
+        self.process = uuid.uuid4().hex[:12]
+        self.channels = {}
+        self.groups = {}
+        self.dropped = 0
+        # query ทั้งหมดผ่าน connection เดียวใน thread เดียว (connection ของ psycopg2 ไม่ใช้ข้าม thread พร้อมกัน)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-layer')
+        self._conn = None
+        self._listener = None
+        self._listener_loop = None
+        self._listener_lock = None
+        self._lock_loop = None
+        self._last_cleanup = 0
+        # notification ที่รอส่งต่อตามลำดับ (หลังข้อความใหญ่ที่ต้องดึงจากตารางก่อน) และ task ที่ไล่ส่ง
+        self._backlog = deque()
+        self._drainer = None
+
+    # --- Channel layer API ---
+
+    async def new_channel(self, prefix='specific'):
+        await self._listen()
+        return f'{prefix}.{self.process}!{uuid.uuid4().hex}'
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        owner = self._owner(channel)
+        if owner == self.process:
+            if not self._put(channel, deepcopy(message)):
+                raise ChannelFull(channel)
+            return
+        await self._notify(owner, 'c', channel, message)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        if self._owner(channel) != self.process:
+            raise ValueError(f"{channel} ไม่ใช่ channel ของ process นี้")
+        await self._listen()
+        self._clean_expired()
+        queue = self._queue(channel)
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires >= time.monotonic():
+                    return message
+        finally:
+            if queue.empty():
+                self.channels.pop(channel, None)
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        owner = self._owner(channel)
+        await self._db(
+            f'INSERT INTO {MEMBERS} (group_name, channel, process, expires_at) '
+            "VALUES (%s, %s, %s, now() + %s * interval '1 second') "
+            'ON CONFLICT (group_name, channel) DO UPDATE SET expires_at = EXCLUDED.expires_at',
+            [group, channel, owner, self.group_expiry],
+        )
+        if owner == self.process:
+            self.groups.setdefault(group, {})[channel] = time.monotonic() + self.group_expiry
+        else:
+            await self._notify(owner, 'a', group, channel)
+        await self._cleanup()
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        owner = self._owner(channel)
+        await self._db(f'DELETE FROM {MEMBERS} WHERE group_name = %s AND channel = %s', [group, channel])
+        if owner == self.process:
+            self._discard(group, channel)
+        else:
+            await self._notify(owner, 'd', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+        # สมาชิกใน process นี้ได้รับทันที ที่เหลือ NOTIFY ไปทีละ process ใน query เดียว
+        for channel in self._members(group):
+            self._put(channel, deepcopy(message))
+        payload, stored = self._payload('g', group, message)
+        members = (
+            f'SELECT DISTINCT process FROM {MEMBERS} '
+            'WHERE group_name = %s AND expires_at > now() AND process <> %s'
+        )
+        if stored is None:
+            await self._db(
+                f'SELECT pg_notify(%s || process, %s) FROM ({members}) members',
+                [LISTEN_PREFIX, payload, group, self.process],
+            )
+        else:
+            # เก็บข้อความใหญ่เฉพาะเมื่อมี process อื่นในกลุ่ม (ไม่มีก็ไม่มีใครมาอ่าน)
+            await self._db(
+                f'WITH members AS ({members}), '
+                f'stored AS (INSERT INTO {STORED} (data, created_at) '
+                'SELECT %s, now() WHERE EXISTS (SELECT 1 FROM members) RETURNING id) '
+                "SELECT pg_notify(%s || process, %s || stored.id) FROM members, stored",
+                [group, self.process, stored, LISTEN_PREFIX, payload],
+            )
+
+    async def flush(self):
+        self.channels = {}
+        self.groups = {}
+        await self._db(f'DELETE FROM {MEMBERS}')
+        await self._db(f'DELETE FROM {STORED}')
+
+    async def close(self):
+        """ปิด connection ของ layer (LISTEN และ query)"""
+        self._close_listener()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_conn)
+
+    # --- ส่งข้ามไป process อื่น ---
+
+    def _payload(self, kind, name, message):
+        """payload ของ NOTIFY '<kind>|<name>|<msgpack แบบ base64>' หรือ '...|@' + id ถ้าใหญ่เกิน (คืน bytes ที่ต้องเก็บ)"""
+        data = message if isinstance(message, str) else msgpack.packb(message, use_bin_type=True)
+        prefix = f'{kind}|{name}|'
+        body = data if isinstance(data, str) else base64.b64encode(data).decode()
+        if len(prefix) + len(body) <= NOTIFY_LIMIT:
+            return prefix + body, None
+        return prefix + '@', data
+
+    async def _notify(self, process, kind, name, message):
+        payload, stored = self._payload(kind, name, message)
+        if stored is None:
+            await self._db('SELECT pg_notify(%s, %s)', [LISTEN_PREFIX + process, payload])
+        else:
+            await self._db(
+                f'WITH stored AS (INSERT INTO {STORED} (data, created_at) VALUES (%s, now()) RETURNING id) '
+                'SELECT pg_notify(%s, %s || stored.id) FROM stored',
+                [stored, LISTEN_PREFIX + process, payload],
+            )
+
+    # --- รับจาก process อื่น (LISTEN) ---
+
+    async def _listen(self):
+        """เริ่ม LISTEN ของ process นี้บน event loop ปัจจุบัน (เริ่มใหม่ถ้า loop เปลี่ยน เช่น async_to_sync)"""
+        loop = asyncio.get_running_loop()
+        if self._listener is not None and self._listener_loop is loop:
+            return
+        if self._lock_loop is not loop:
+            self._listener_lock, self._lock_loop = asyncio.Lock(), loop
+        async with self._listener_lock:
+            if self._listener is not None and self._listener_loop is loop:
+                return
+            self._close_listener()
+            # คิวเดิมผูกกับ loop เก่า: ย้ายข้อความที่ค้างไปคิวใหม่
+            old, self.channels = self.channels, {}
+            for channel, queue in old.items():
+                while not queue.empty():
+                    self._queue(channel).put_nowait(queue.get_nowait())
+
+            listener = await loop.run_in_executor(None, self._connect)
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN {LISTEN_PREFIX}{self.process}')
+            loop.add_reader(listener.fileno(), self._on_notify)
+            self._listener, self._listener_loop = listener, loop
+
+    def _close_listener(self):
+        listener, self._listener = self._listener, None
+        if listener is None:
+            return
+        try:
+            self._listener_loop.remove_reader(listener.fileno())
+        except Exception:
+            pass  # loop เดิมปิดไปแล้ว
+        listener.close()
+
+    def _on_notify(self):
+        listener = self._listener
+        try:
+            listener.poll()
+        except Exception:
+            logger.exception("connection LISTEN ของ channel layer หลุด จะเริ่มใหม่ตอน receive ครั้งถัดไป")
+            self._close_listener()
+            return
+        while listener.notifies:
+            self._dispatch(listener.notifies.pop(0).payload)
+
+    def _dispatch(self, payload):
+        kind, name, body = payload.split('|', 2)
+        # ข้อความใหญ่ต้องดึงจากตารางก่อน: notification ที่ตามมาต่อคิวไว้หลังมัน ลำดับของแต่ละกลุ่ม/channel จึงตรงกับที่ส่ง
+        if self._backlog or body.startswith('@'):
+            self._backlog.append((kind, name, body))
+            loop = asyncio.get_running_loop()
+            if self._drainer is None or self._drainer.done() or self._drainer.get_loop() is not loop:
+                self._drainer = loop.create_task(self._drain())
+            return
+        self._apply(kind, name, body)
+
+    async def _drain(self):
+        while self._backlog:
+            kind, name, body = self._backlog[0]
+            if body.startswith('@'):
+                try:
+                    rows = await self._db(f'SELECT data FROM {STORED} WHERE id = %s', [int(body[1:])])
+                except Exception:
+                    logger.exception("ดึงข้อความใหญ่ id=%s ของ channel layer ไม่สำเร็จ ข้ามไป", body[1:])
+                    rows = None
+                if rows:
+                    self._deliver(kind, name, bytes(rows[0][0]))
+            else:
+                self._apply(kind, name, body)
+            # เอาออกหลังส่งแล้ว: ระหว่างรอ query notification ใหม่ยังต่อคิวอยู่ข้างหลัง
+            self._backlog.popleft()
+
+    def _apply(self, kind, name, body):
+        if kind == 'a':
+            self.groups.setdefault(name, {})[body] = time.monotonic() + self.group_expiry
+        elif kind == 'd':
+            self._discard(name, body)
+        else:
+            self._deliver(kind, name, base64.b64decode(body))
+
+    def _deliver(self, kind, name, data):
+        channels = [name] if kind == 'c' else self._members(name)
+        for channel in channels:
+            # ถอดแยกต่อ channel: ผู้รับแต่ละตัวได้ dict ของตัวเอง
+            if not self._put(channel, msgpack.unpackb(data, raw=False)):
+                logger.warning("คิวของ %s เต็ม (%d) ทิ้งข้อความ", channel, self.get_capacity(channel))
+
+    # --- คิว / กลุ่ม ใน process นี้ ---
+
+    @staticmethod
+    def _owner(channel):
+        # '<prefix>.<process>!<id>' -> process
+        return channel.partition('!')[0].rpartition('.')[2]
+
+    def _queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    def _put(self, channel, message):
+        try:
+            self._queue(channel).put_nowait((time.monotonic() + self.expiry, message))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def _members(self, group):
+        now = time.monotonic()
+        return [channel for channel, expires in self.groups.get(group, {}).items() if expires > now]
+
+    def _discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        for channel, queue in list(self.channels.items()):
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+            if queue.empty() and not queue._getters:
+                self.channels.pop(channel, None)
+
+    async def _cleanup(self):
+        now = time.monotonic()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        await self._db(f'DELETE FROM {MEMBERS} WHERE expires_at < now()')
+        await self._db(
+            f"DELETE FROM {STORED} WHERE created_at < now() - %s * interval '1 second'", [self.expiry]
+        )
+
+    # --- database ---
+
+    def _connect(self):
+        wrapper = connections[self.alias]
+        conn = wrapper.get_new_connection(wrapper.get_connection_params())
+        conn.autocommit = True
+        return conn
+
+    def _close_conn(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    def _execute(self, sql, params):
+        database = connections[self.alias].Database
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                with self._conn.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    return cursor.fetchall() if cursor.description else None
+            except (database.OperationalError, database.InterfaceError):
+                # connection หลุด (เช่น DB restart): ต่อใหม่แล้วลองอีกครั้ง
+                self._close_conn()
+                if attempt:
+                    raise
+
+    async def _db(self, sql, params=()):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._execute, sql, params)
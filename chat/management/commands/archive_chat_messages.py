@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from chat.archive import ARCHIVE_AFTER_DAYS, BATCH_SIZE, archive_cutoff, archive_room, closed_rooms
+
+
+class Command(BaseCommand):
+    help = (
+        "ย้ายข้อความแชทที่เก่ากว่า --days วันของห้องที่ปิดแล้ว (สินค้าขายแล้ว/ถูกปฏิเสธ) ไปเก็บใน MessageArchive "
+        "ทีละชุดไม่เกิน --batch-size ข้อความต่อ transaction (--every N = ทำซ้ำทุก N วินาทีจนกว่าจะหยุด)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--every', type=float, help="โหมดตั้งเวลา: ทำซ้ำทุกกี่วินาที")
+
+    def handle(self, *args, **options):
+        if not options['every']:
+            self._archive(options)
+            return
+        try:
+            while True:
+                self._archive(options)
+                # process อยู่นาน: ไม่ถือ connection ไว้ระหว่างรอรอบถัดไป
+                close_old_connections()
+                time.sleep(options['every'])
+        except KeyboardInterrupt:
+            pass
+
+    def _archive(self, options):
+        cutoff = archive_cutoff(options['days'])
+        start = time.perf_counter()
+        rooms = closed_rooms(cutoff)
+        moved = sum(archive_room(room_id, cutoff, options['batch_size']) for room_id in rooms)
+        self.stdout.write(
+            f"ย้ายข้อความ {moved:,} รายการจาก {len(rooms):,} ห้อง (เก่ากว่า {cutoff:%Y-%m-%d %H:%M}) "
+            f"ใน {time.perf_counter() - start:.2f} วินาที"
+        )
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.layers import PostgresChannelLayer
+
+
+class Command(BaseCommand):
+    help = (
+        "วัด throughput/latency ของ group_send: InMemoryChannelLayer เทียบกับ PostgresChannelLayer "
+        "(ผู้ส่งและผู้รับเป็นคนละ layer = จำลองคนละ process) และ RedisChannelLayer ถ้ามี channels_redis"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layer', nargs='+', choices=['memory', 'postgres', 'redis'], default=['memory', 'postgres'])
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--members', type=int, default=2, help="จำนวน channel ต่อกลุ่ม (ห้องแชท = 2)")
+        parser.add_argument('--messages', type=int, default=5000)
+        parser.add_argument('--redis-host', default=os.environ.get('REDIS_HOST') or 'localhost')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'layer':<12}{'msg/s':>10}{'deliver/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'lost':>8}")
+        for name in options['layer']:
+            sender, receiver = self._layers(name, options)
+            result = async_to_sync(self._run)(sender, receiver, options)
+            self.stdout.write(
+                f"{name:<12}{result['sent_per_s']:>10,.0f}{result['delivered_per_s']:>12,.0f}"
+                f"{result['p50']:>10.2f}{result['p95']:>10.2f}{result['p99']:>10.2f}{result['lost']:>8,}"
+            )
+
+    @staticmethod
+    def _layers(name, options):
+        if name == 'memory':
+            layer = InMemoryChannelLayer(capacity=options['messages'])
+            return layer, layer
+        if name == 'postgres':
+            return PostgresChannelLayer(capacity=options['messages']), PostgresChannelLayer(capacity=options['messages'])
+        try:
+            from channels_redis.core import RedisChannelLayer
+        except ImportError:
+            raise CommandError("--layer redis ต้องติดตั้ง channels_redis และมี Redis รันอยู่ที่ --redis-host")
+        hosts = [(options['redis_host'], 6379)]
+        capacity = options['messages']
+        return RedisChannelLayer(hosts=hosts, capacity=capacity), RedisChannelLayer(hosts=hosts, capacity=capacity)
+
+    async def _run(self, sender, receiver, options):
+        groups = [f'bench_{i}' for i in range(options['groups'])]
+        channels = []
+        for group in groups:
+            for _ in range(options['members']):
+                channel = await receiver.new_channel()
+                await receiver.group_add(group, channel)
+                channels.append(channel)
+
+        latencies = []
+        expected = options['messages'] * options['members']
+        done = asyncio.Event()
+
+        async def consume(channel):
+            while True:
+                message = await receiver.receive(channel)
+                latencies.append((time.perf_counter() - message['sent']) * 1000)
+                if len(latencies) >= expected:
+                    done.set()
+
+        consumers = [asyncio.ensure_future(consume(channel)) for channel in channels]
+        start = time.perf_counter()
+        for i in range(options['messages']):
+            await sender.group_send(groups[i % len(groups)], {'type': 'bench', 'sent': time.perf_counter()})
+        sent = time.perf_counter() - start
+        try:
+            await asyncio.wait_for(done.wait(), 30)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - start
+
+        for consumer in consumers:
+            consumer.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        for group, channel in zip((g for g in groups for _ in range(options['members'])), channels):
+            await receiver.group_discard(group, channel)
+        for layer in {sender, receiver}:
+            if hasattr(layer, 'close'):
+                await layer.close()
+
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else [0.0] * 99
+        return {
+            'sent_per_s': options['messages'] / sent,
+            'delivered_per_s': len(latencies) / elapsed,
+            'p50': cuts[49], 'p95': cuts[94], 'p99': cuts[98],
+            'lost': expected - len(latencies),
+        }
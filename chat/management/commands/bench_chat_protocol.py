@@ -0,0 +1,67 @@
+import json
+import random
+import time
+
+import msgpack
+from django.core.management.base import BaseCommand
+
+from chat.serializers import encode_json, encode_msgpack, fast_json
+
+SAMPLE_TEXTS = (
+    'สินค้ายังอยู่ไหมครับ?', 'ลดราคาได้ไหม?', 'นัดรับหน้าคณะวิศวะได้ไหมครับ', 'ok ครับ',
+    'ขอดูรูปเพิ่มเติมหน่อย', 'โอนแล้วนะครับ ส่งสลิปให้แล้ว', 'Is this still available?', '👍',
+)
+
+
+class Command(BaseCommand):
+    help = "เทียบขนาด (bytes/ข้อความ รวม header ของ frame) และเวลา encode ของ frame แชทแบบ JSON กับ msgpack (ชื่อฟิลด์ย่อ + รวมหลายข้อความ)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000)
+        parser.add_argument('--batch', type=int, nargs='+', default=[1, 10, 50])
+
+    def handle(self, *args, **options):
+        payloads = self._payloads(options['messages'])
+        rows = [
+            ('json (legacy)', 1, lambda batch: json.dumps(batch[0])),
+            ('json utf-8', 1, lambda batch: encode_json(batch[0])),
+            ('msgpack full keys', 1, lambda batch: msgpack.packb(batch[0])),
+        ]
+        if fast_json is not json:
+            rows.insert(2, ('ujson', 1, lambda batch: fast_json.dumps(batch[0], ensure_ascii=False)))
+        for size in options['batch']:
+            rows.append((f'msgpack x{size}', size, encode_msgpack))
+
+        self.stdout.write(f"{'format':<20}{'frames':>10}{'bytes/msg':>12}{'µs/msg':>10}")
+        for label, size, encode in rows:
+            batches = [payloads[i:i + size] for i in range(0, len(payloads), size)]
+            start = time.perf_counter()
+            frames = [encode(batch) for batch in batches]
+            elapsed = time.perf_counter() - start
+            total = sum(self._frame_size(frame) for frame in frames)
+            self.stdout.write(
+                f"{label:<20}{len(frames):>10,}{total / len(payloads):>12.1f}"
+                f"{elapsed / len(payloads) * 1e6:>10.2f}"
+            )
+
+    @staticmethod
+    def _frame_size(frame):
+        # รวม header ของ WebSocket frame (server -> client ไม่มี mask) ซึ่งจ่ายทุก frame
+        length = len(frame.encode() if isinstance(frame, str) else frame)
+        header = 2 if length < 126 else 4 if length < 65536 else 10
+        return header + length
+
+    @staticmethod
+    def _payloads(count):
+        rng = random.Random(0)
+        return [
+            {
+                'id': 1_000_000 + i,
+                'sender_id': rng.choice((17, 42)),
+                'content': rng.choice(SAMPLE_TEXTS),
+                'image_url': '/media/chat_images/photo.jpg' if rng.random() < 0.05 else None,
+                'timestamp': f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}',
+                'sender_avatar': '/media/avatars/user_42.jpg',
+            }
+            for i in range(count)
+        ]
@@ -0,0 +1,31 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.metrics import chat_connection_stats
+
+
+class Command(BaseCommand):
+    help = "แสดงจำนวนการเชื่อมต่อ WebSocket ของแชทและความยาวคิวขาออก รวมทุก process และแยกตาม process (chat/metrics.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help="พิมพ์เป็น JSON")
+
+    def handle(self, *args, **options):
+        totals, processes = chat_connection_stats()
+        if options['json']:
+            self.stdout.write(json.dumps({'totals': totals, 'processes': processes}))
+            return
+
+        for name, value in totals.items():
+            self.stdout.write(f"{name:<18}{value:>10,}")
+        if processes:
+            self.stdout.write('')
+            self.stdout.write(f"{'process':<30}{'conns':>8}{'peak':>8}{'queued':>8}{'max q':>8}{'age s':>8}")
+        now = time.time()
+        for process in processes:
+            self.stdout.write(
+                f"{process['process']:<30}{process['connections']:>8,}{process['peak_connections']:>8,}"
+                f"{process['queued_events']:>8,}{process['max_queue_depth']:>8,}{now - process['updated_at']:>8.0f}"
+            )
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers, get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.buffer import message_buffer
+from chat.layers import PostgresChannelLayer
+from chat.models import ChatRoom
+from chat.routing import websocket_urlpatterns
+from chat.serializers import (
+    JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL, decode_msgpack, encode_json, encode_msgpack,
+)
+from products.models import Product
+
+PREFIX = '__loadtest_chat__'
+
+
+class Command(BaseCommand):
+    help = (
+        "load test ของ ChatConsumer: จำลองผู้ซื้อ/ผู้ขายห้องละ 2 คน ผ่าน WebsocketCommunicator ใน process เดียวกัน "
+        "วัดเวลาเชื่อมต่อ, เวลาส่งถึงผู้รับ (p50/p95/p99), ข้อความ/วินาที และ RSS ต่อการเชื่อมต่อ "
+        "(สร้างห้อง/ผู้ใช้ชั่วคราวในฐานข้อมูลแล้วลบทิ้งเมื่อจบ)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=500)
+        parser.add_argument('--messages', type=int, default=10, help="จำนวนข้อความที่แต่ละ client ส่ง")
+        parser.add_argument('--interval', type=float, default=0.05, help="ระยะห่าง (วินาที) ระหว่างข้อความของ client เดียวกัน")
+        parser.add_argument('--concurrency', type=int, default=200, help="จำนวน client ที่เชื่อมต่อพร้อมกันสูงสุด")
+        parser.add_argument(
+            '--layer', nargs='+', choices=['memory', 'postgres', 'redis'], default=['memory'],
+            help="memory = InMemoryChannelLayer, postgres = PostgresChannelLayer (chat.layers) ใช้แทน Redis ในเครื่องได้ "
+                 "(ส่งข้าม process ผ่าน LISTEN/NOTIFY ของฐานข้อมูลเดียวกัน), redis = RedisChannelLayer "
+                 "ต้องมี Redis server จริง (หรือ server ที่รองรับ protocol ของ Redis) รันอยู่ที่ --redis-host",
+        )
+        parser.add_argument('--redis-host', default=os.environ.get('REDIS_HOST') or 'localhost')
+        parser.add_argument('--protocol', choices=['json', 'msgpack'], default='json')
+        parser.add_argument('--timeout', type=float, default=60, help="เวลารอข้อความที่ยังส่งไม่ถึงหลังส่งครบ")
+        parser.add_argument('--json', action='store_true', help="พิมพ์ผลเป็น JSON (บรรทัดละ 1 รอบ) แทนตาราง")
+        parser.add_argument('--output', help="ต่อท้ายผลลงไฟล์ JSONL ไว้เทียบย้อนหลัง")
+
+    def handle(self, *args, **options):
+        layers = [(name, self._make_layer(name, options)) for name in options['layer']]
+        rooms = self._create_rooms(options['rooms'])
+        results = []
+        try:
+            for name, layer in layers:
+                previous = channel_layers.set(DEFAULT_CHANNEL_LAYER, layer)
+                try:
+                    result = async_to_sync(self._run)(rooms, options)
+                finally:
+                    if previous is None:
+                        channel_layers.backends.pop(DEFAULT_CHANNEL_LAYER, None)
+                    else:
+                        channel_layers.set(DEFAULT_CHANNEL_LAYER, previous)
+                result['layer'] = name
+                results.append(result)
+        finally:
+            self._delete_rooms()
+
+        for result in results:
+            if options['json']:
+                self.stdout.write(json.dumps(result))
+            else:
+                self._write_table(result)
+        if options['output']:
+            with open(options['output'], 'a') as output:
+                for result in results:
+                    output.write(json.dumps(result) + '\n')
+
+    @staticmethod
+    def _make_layer(name, options):
+        if name == 'memory':
+            # ขนาดคิวเผื่อ client หลายพันตัว (ค่าเริ่มต้น 100 ต่อ channel ทำให้ group_send ทิ้งข้อความเมื่อคิวเต็ม)
+            return InMemoryChannelLayer(capacity=1000)
+        if name == 'postgres':
+            return PostgresChannelLayer(capacity=1000)
+        try:
+            from channels_redis.core import RedisChannelLayer
+        except ImportError:
+            raise CommandError("--layer redis ต้องติดตั้ง channels_redis (ไม่มี Redis ใช้ --layer postgres แทนได้)")
+        # ตรวจก่อนสร้างห้อง: ไม่มี Redis รันอยู่ RedisChannelLayer จะค้างรอจนหมดเวลาระหว่างทดสอบ
+        try:
+            socket.create_connection((options['redis_host'], 6379), timeout=2).close()
+        except OSError:
+            raise CommandError(
+                f"--layer redis เชื่อมต่อ Redis ที่ {options['redis_host']}:6379 ไม่ได้ (ไม่มี Redis ใช้ --layer postgres แทนได้)"
+            )
+        return RedisChannelLayer(hosts=[(options['redis_host'], 6379)], capacity=1000)
+
+    @staticmethod
+    def _create_rooms(count):
+        rooms = []
+        for i in range(count):
+            # ไม่ใช้ create_user: hash รหัสผ่านทีละคนช้ากว่าส่วนอื่นทั้งหมด
+            buyer = User(username=f'{PREFIX}b{i}')
+            seller = User(username=f'{PREFIX}s{i}')
+            for user in (buyer, seller):
+                user.set_unusable_password()
+                user.save()
+            product = Product.objects.create(
+                name=f'{PREFIX}{i}', description='load test', price=1, seller=seller, status='sold',
+            )
+            rooms.append(ChatRoom.objects.create(product=product, buyer=buyer, seller=seller))
+        return rooms
+
+    @staticmethod
+    def _delete_rooms():
+        # ห้อง/ข้อความ/read cursor ถูกลบตามสินค้าและผู้ใช้ (CASCADE)
+        Product.objects.filter(name__startswith=PREFIX).delete()
+        User.objects.filter(username__startswith=PREFIX).delete()
+
+    async def _run(self, rooms, options):
+        subprotocol = MSGPACK_SUBPROTOCOL if options['protocol'] == 'msgpack' else JSON_SUBPROTOCOL
+        application = URLRouter(websocket_urlpatterns)
+        clients = [(room, user) for room in rooms for user in (room.buyer, room.seller)]
+        connect_ms = []
+        sent_at = {}
+        fanout_ms = []
+        expected = len(clients) * options['messages'] * 2  # ทุกข้อความถึงทั้งผู้ส่งและอีกฝ่าย
+        all_delivered = asyncio.Event()
+        slots = asyncio.Semaphore(options['concurrency'])
+
+        async def connect(room, user):
+            communicator = WebsocketCommunicator(
+                application, f'/ws/chat/{room.id}/', subprotocols=[subprotocol]
+            )
+            communicator.scope['user'] = user
+            async with slots:
+                start = time.perf_counter()
+                connected, _ = await communicator.connect(timeout=options['timeout'])
+                connect_ms.append((time.perf_counter() - start) * 1000)
+            if not connected:
+                raise CommandError(f"เชื่อมต่อห้อง {room.id} ไม่สำเร็จ")
+            return communicator
+
+        async def send(communicator, frame):
+            if subprotocol == MSGPACK_SUBPROTOCOL:
+                await communicator.send_to(bytes_data=encode_msgpack([frame]))
+            else:
+                await communicator.send_to(text_data=encode_json(frame))
+
+        async def read(communicator):
+            # อ่านจาก output_queue ตรงๆ: receive_output ที่หมดเวลาจะยกเลิก consumer ไปด้วย
+            while True:
+                output = await communicator.output_queue.get()
+                if output['type'] != 'websocket.send':
+                    return
+                received = time.perf_counter()
+                if output.get('bytes') is not None:
+                    events = decode_msgpack(output['bytes'])
+                else:
+                    events = [json.loads(output['text'])]
+                for event in events:
+                    if event.get('type') == 'ping':
+                        # ตอบเหมือน client จริง ไม่งั้น consumer ตัดการเชื่อมต่อเมื่อค้างถึง OUTBOX_LIMIT
+                        await send(communicator, {'type': 'pong', 'seq': event['seq']})
+                        continue
+                    sent = sent_at.get(event.get('content')) if 'type' not in event else None
+                    if sent is not None:
+                        fanout_ms.append((received - sent) * 1000)
+                if len(fanout_ms) >= expected:
+                    all_delivered.set()
+
+        async def chat(index, communicator):
+            for seq in range(options['messages']):
+                content = f'{index}:{seq}'
+                frame = {'message': content}
+                sent_at[content] = time.perf_counter()
+                await send(communicator, frame)
+                await asyncio.sleep(options['interval'])
+
+        rss_before = _rss_kb()
+        communicators = await asyncio.gather(*(connect(room, user) for room, user in clients))
+        rss_connected = _rss_kb()
+        readers = [asyncio.ensure_future(read(communicator)) for communicator in communicators]
+
+        start = time.perf_counter()
+        await asyncio.gather(*(chat(index, communicator) for index, communicator in enumerate(communicators)))
+        try:
+            await asyncio.wait_for(all_delivered.wait(), options['timeout'])
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - start
+        rss_peak = _rss_kb()
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*(communicator.disconnect(timeout=options['timeout']) for communicator in communicators))
+        await message_buffer.flush()
+        layer = get_channel_layer()
+        if hasattr(layer, 'close'):
+            # PostgresChannelLayer: ปิด LISTEN ใน event loop ของรอบนี้ก่อน loop ถูกปิด
+            await layer.close()
+
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'protocol': options['protocol'],
+            'rooms': len(rooms),
+            'connections': len(communicators),
+            'messages_sent': len(sent_at),
+            'deliveries': len(fanout_ms),
+            'deliveries_missing': expected - len(fanout_ms),
+            'duration_s': round(elapsed, 3),
+            'deliveries_per_s': round(len(fanout_ms) / elapsed, 1),
+            'connect_ms': _summary(connect_ms),
+            'fanout_ms': _summary(fanout_ms),
+            # client (WebsocketCommunicator) อยู่ใน process เดียวกัน ค่านี้จึงรวมฝั่ง client ด้วย (เป็นค่าสูงสุดต่อการเชื่อมต่อ)
+            'rss_per_connection_kb': round((rss_connected - rss_before) / len(communicators), 1),
+            'rss_peak_mb': round(rss_peak / 1024, 1),
+        }
+
+    def _write_table(self, result):
+        self.stdout.write(
+            f"layer={result['layer']} protocol={result['protocol']} rooms={result['rooms']:,} "
+            f"connections={result['connections']:,}"
+        )
+        self.stdout.write(f"{'':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+        for label in ('connect_ms', 'fanout_ms'):
+            summary = result[label]
+            self.stdout.write(
+                f"{label:<12}{summary['p50']:>10.2f}{summary['p95']:>10.2f}{summary['p99']:>10.2f}{summary['max']:>10.2f}"
+            )
+        self.stdout.write(
+            f"ข้อความ {result['messages_sent']:,} ส่งถึง {result['deliveries']:,} ครั้ง "
+            f"(ขาด {result['deliveries_missing']:,}) ใน {result['duration_s']} วินาที = {result['deliveries_per_s']:,}/วินาที"
+        )
+        self.stdout.write(
+            f"RSS {result['rss_per_connection_kb']} KB/การเชื่อมต่อ, สูงสุด {result['rss_peak_mb']} MB\n"
+        )
+
+
+def _summary(values):
+    if not values:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    if len(values) < 2:
+        values = values * 2
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {
+        'p50': round(cuts[49], 3), 'p95': round(cuts[94], 3), 'p99': round(cuts[98], 3),
+        'max': round(max(values), 3),
+    }
+
+
+def _rss_kb():
+    """RSS ปัจจุบันของ process (KB) จาก /proc ถ้ามี ไม่งั้นใช้ค่าสูงสุดจาก getrusage"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,89 @@
+import os
+import socket
+import time
+import weakref
+
+from django.core.cache import cache
+
+# ค่าของแต่ละ process เก็บใน cache (Redis ถ้ามี) เพื่อรวมดูทุก worker ได้จากที่เดียว
+GAUGES_KEY_PREFIX = 'chat:gauges:'
+PROCESSES_KEY = 'chat:gauges:processes'
+# ส่งค่าขึ้น cache ไม่เกิน 1 ครั้งต่อ PUBLISH_INTERVAL วินาทีต่อ process
+PUBLISH_INTERVAL = 5
+# process ที่ไม่ได้ส่งค่ามานานกว่านี้ (หยุดไปแล้ว) หายไปจากผลรวมเอง
+GAUGES_TIMEOUT = 60
+COUNTERS = ('dropped_events', 'closed_slow', 'closed_idle')
+
+
+class ConnectionGauges:
+    """
+    ตัววัดการเชื่อมต่อ WebSocket ของแชทใน process นี้ (1 ตัวต่อ process)
+    - connections / peak_connections: จำนวนการเชื่อมต่อตอนนี้ / สูงสุดตั้งแต่เริ่ม process
+    - queued_events / max_queue_depth: event ที่ค้างส่งรวมทุกการเชื่อมต่อ / ของการเชื่อมต่อที่ค้างมากที่สุด
+    - unmetered_connections: client เดิม (ไม่ตอบ pong) ที่วัดคิวไม่ได้ ไม่นับใน queued_events (ดู ChatConsumer.backlog)
+    - dropped_events / closed_slow / closed_idle: event ที่ทิ้งเพราะคิวเต็ม / ตัดเพราะ client ช้า / ตัดเพราะเงียบ
+    """
+
+    def __init__(self):
+        self.process = f'{socket.gethostname()}:{os.getpid()}'
+        self.consumers = weakref.WeakSet()
+        self.peak_connections = 0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._published = float('-inf')
+
+    def connected(self, consumer):
+        self.consumers.add(consumer)
+        self.peak_connections = max(self.peak_connections, len(self.consumers))
+
+    def disconnected(self, consumer):
+        self.consumers.discard(consumer)
+
+    def count(self, counter):
+        self.counters[counter] += 1
+
+    def snapshot(self):
+        consumers = list(self.consumers)
+        depths = [consumer.backlog() for consumer in consumers]
+        return {
+            'process': self.process,
+            'connections': len(depths),
+            'peak_connections': self.peak_connections,
+            'queued_events': sum(depths),
+            'max_queue_depth': max(depths, default=0),
+            'unmetered_connections': sum(1 for consumer in consumers if not consumer.heartbeat),
+            **self.counters,
+            'updated_at': time.time(),
+        }
+
+    def due(self, force=False):
+        """ถึงเวลาส่งค่าขึ้น cache หรือยัง (ไม่เกิน 1 ครั้งต่อ PUBLISH_INTERVAL เว้นแต่ force)"""
+        return force or time.monotonic() - self._published >= PUBLISH_INTERVAL
+
+    def publish(self):
+        self._published = time.monotonic()
+        cache.set(GAUGES_KEY_PREFIX + self.process, self.snapshot(), GAUGES_TIMEOUT)
+        processes = cache.get(PROCESSES_KEY) or []
+        if self.process not in processes:
+            cache.set(PROCESSES_KEY, processes + [self.process], None)
+
+
+gauges = ConnectionGauges()
+
+
+def chat_connection_stats():
+    """ผลรวมของทุก process ที่ยังส่งค่าอยู่ และค่าของแต่ละ process -> (totals, processes)"""
+    names = cache.get(PROCESSES_KEY) or []
+    values = cache.get_many([GAUGES_KEY_PREFIX + name for name in names])
+    processes = [values[GAUGES_KEY_PREFIX + name] for name in names if GAUGES_KEY_PREFIX + name in values]
+    if len(processes) != len(names):
+        cache.set(PROCESSES_KEY, [process['process'] for process in processes], None)
+    totals = {
+        'processes': len(processes),
+        'connections': sum(process['connections'] for process in processes),
+        'queued_events': sum(process['queued_events'] for process in processes),
+        'max_queue_depth': max((process['max_queue_depth'] for process in processes), default=0),
+        'unmetered_connections': sum(process.get('unmetered_connections', 0) for process in processes),
+    }
+    for counter in COUNTERS:
+        totals[counter] = sum(process[counter] for process in processes)
+    return totals, processes
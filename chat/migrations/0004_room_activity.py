@@ -0,0 +1,67 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Left
+
+
+def backfill_room_activity(apps, schema_editor):
+    # ห้องที่มีอยู่แล้ว: คำนวณข้อความล่าสุด / จำนวนข้อความจากตาราง Message ด้วย UPDATE เดียว
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    last = Message.objects.filter(room=OuterRef('pk')).order_by('-id')
+    count = Message.objects.filter(room=OuterRef('pk')).order_by().values('room').annotate(n=Count('id')).values('n')
+    ChatRoom.objects.update(
+        last_message_id=Subquery(last.values('id')[:1]),
+        last_message_at=Subquery(last.values('timestamp')[:1]),
+        last_message_preview=Coalesce(Subquery(last.annotate(preview=Left('content', 100)).values('preview')[:1]), Value('')),
+        last_message_sender_id=Subquery(last.values('sender_id')[:1]),
+        message_count=Coalesce(Subquery(count), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_profile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_preview',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_room_activity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='chat_message_room_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'timestamp'], name='chat_message_room_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_cursors(apps, schema_editor):
+    # ห้องที่มีอยู่แล้ว: ถือว่าอ่านประวัติเดิมครบแล้ว (เริ่มนับยังไม่อ่านจากข้อความถัดไป)
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ReadCursor = apps.get_model('chat', 'ReadCursor')
+    cursors = []
+    for room in ChatRoom.objects.values('id', 'buyer_id', 'seller_id', 'last_message_id').iterator():
+        for user_id in (room['buyer_id'], room['seller_id']):
+            cursors.append(ReadCursor(room_id=room['id'], user_id=user_id, last_read_id=room['last_message_id'] or 0))
+    ReadCursor.objects.bulk_create(cursors, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_room_activity'),
+        ('products', '0021_userprofile_unread_messages'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_id', models.BigIntegerField(default=0)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_cursors', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('room', 'user')},
+            },
+        ),
+        migrations.RunPython(create_cursors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_readcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='image_display',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='chat_images/display/'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_ready',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_thumb',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='chat_images/thumbs/'),
+        ),
+    ]
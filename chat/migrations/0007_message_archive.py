@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='archived_until_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_id', models.BigIntegerField()),
+                ('last_id', models.BigIntegerField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archives', to='chat.chatroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'last_id'], name='chat_archive_room_last_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelLayerMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChannelGroupMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group_name', models.CharField(max_length=100)),
+                ('channel', models.CharField(max_length=100)),
+                ('process', models.CharField(max_length=32)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('group_name', 'channel')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:16
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_channel_layer_tables'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='messagearchive',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='chat_message_search_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='messagearchive',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='chat_archive_search_gin'),
+        ),
+    ]
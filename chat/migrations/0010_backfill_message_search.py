@@ -0,0 +1,102 @@
+# Generated by Django 5.2.6 on 2026-10-17 22:05
+
+import re
+import zlib
+
+import msgpack
+from django.db import migrations
+
+# แถวต่อ 1 UPDATE (แต่ละชุด commit แยกกัน: ไม่ถือ lock ทั้งตารางตลอด backfill)
+BATCH_SIZE = 1000
+
+# ตัดคำแบบเดียวกับ products.search ณ ตอนสร้าง migration นี้ (คัดลอกมา: migration ต้องไม่ขึ้นกับโค้ดที่เปลี่ยนภายหลัง)
+THAI_RUN_RE = re.compile(r'[\u0E00-\u0E7F]+')
+TOKEN_RE = re.compile(r'[\u0E00-\u0E7F]+|[^\W_\u0E00-\u0E7F]+')
+MAX_POSITION = 16383
+MAX_POSITIONS_PER_LEXEME = 256
+
+
+def tokenize(text):
+    groups = []
+    for run in TOKEN_RE.findall((text or '').lower()):
+        if THAI_RUN_RE.fullmatch(run) and len(run) > 1:
+            groups.append([run[i:i + 2] for i in range(len(run) - 1)])
+        else:
+            groups.append([run])
+    return groups
+
+
+def build_document(text):
+    # = products.search.build_document(text, '') ที่ Message.index_content ใช้
+    positions = {}
+    position = 0
+    for group in tokenize(text):
+        for token in group:
+            position += 1
+            slots = positions.setdefault(token, [])
+            if position <= MAX_POSITION and len(slots) < MAX_POSITIONS_PER_LEXEME:
+                slots.append(f'{position}A')
+        position += 1
+    return ' '.join(
+        f"'{token}':{','.join(slots)}" if slots else f"'{token}'"
+        for token, slots in positions.items()
+    )
+
+
+def build_lexemes(texts):
+    lexemes = dict.fromkeys(token for text in texts for group in tokenize(text) for token in group)
+    return ' '.join(f"'{token}'" for token in lexemes)
+
+
+def update_batches(schema_editor, model, column, documents):
+    """
+    ไล่แถวตาม id ทีละ BATCH_SIZE แล้วเขียน search_vector ของทั้งชุดด้วย UPDATE ... FROM (VALUES ...) เดียว
+    documents(values) แปลง (pk, column) ของชุดเป็น [(pk, tsvector literal)]
+    """
+    quote = schema_editor.quote_name
+    last_pk = 0
+    while True:
+        rows = list(
+            model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', column)[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        values = documents(rows)
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {quote(model._meta.db_table)} AS t SET search_vector = v.document::tsvector "
+                f"FROM (VALUES {', '.join(['(%s, %s)'] * len(values))}) AS v(id, document) "
+                f"WHERE t.id = v.id",
+                [param for row in values for param in row],
+            )
+        last_pk = rows[-1][0]
+
+
+def populate_search_vector(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    update_batches(
+        schema_editor, Message, 'content',
+        lambda rows: [(pk, build_document(content)) for pk, content in rows],
+    )
+
+    # ชุดที่ย้ายไปเก็บแล้ว: content อยู่ตำแหน่งที่ 3 ของแต่ละแถว (ดู MessageArchive.pack)
+    MessageArchive = apps.get_model('chat', 'MessageArchive')
+    update_batches(
+        schema_editor, MessageArchive, 'data',
+        lambda rows: [
+            (pk, build_lexemes(row[2] for row in msgpack.unpackb(zlib.decompress(data)))) for pk, data in rows
+        ],
+    )
+
+
+class Migration(migrations.Migration):
+    # แต่ละชุดของ backfill commit เอง ไม่รวมเป็น transaction เดียวทั้งตาราง
+    atomic = False
+
+    dependencies = [
+        ('chat', '0009_message_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_search_vector, migrations.RunPython.noop),
+    ]
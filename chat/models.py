@@ -1,8 +1,50 @@
-from django.db import models
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import msgpack
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
-from products.models import Product
+from products.models import Product, UserProfile
+from products.search import build_lexemes, document_expression
+
+from .profiles import avatar_url, bump_profiles_version, display_name
+
+# ความยาวของข้อความตัวอย่างที่เก็บไว้ใน ChatRoom (แสดงในหน้า inbox)
+PREVIEW_LENGTH = 100
+# MessageArchive เก็บเวลาเป็นจำนวน microsecond นับจาก EPOCH (จำนวนเต็ม ไม่คลาดเคลื่อนแบบ float)
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class ChatRoomQuerySet(models.QuerySet):
+    def for_inbox(self, user):
+        """
+        ห้องแชทของ user สำหรับหน้า inbox ใน query เดียว เรียงตามกิจกรรมล่าสุด
+        - ข้อความล่าสุด / จำนวนข้อความ: คอลัมน์ที่เก็บไว้ใน ChatRoom (ไม่ต้องสแกน Message)
+        - queue_rank: ลำดับคิวของห้องในสินค้าเดียวกัน (แทน queue_sequence ที่ query ทีละห้อง)
+        - unread_count: ตัวนับใน ReadCursor ของ user ในห้องนั้น
+        - ผู้ซื้อ/ผู้ขาย/โปรไฟล์/สินค้า มาด้วย select_related
+        """
+        unread = ReadCursor.objects.filter(room=OuterRef('pk'), user=user).values('unread_count')[:1]
+        earlier_rooms = ChatRoom.objects.filter(
+            product=OuterRef('product'), created_at__lt=OuterRef('created_at')
+        ).order_by().values('product').annotate(count=Count('id')).values('count')
+
+        return self.filter(Q(buyer=user) | Q(seller=user)).select_related(
+            'product',
+            'buyer__profile', 'buyer__chat_profile',
+            'seller__profile', 'seller__chat_profile',
+        ).annotate(
+            queue_rank=Coalesce(Subquery(earlier_rooms, output_field=IntegerField()), Value(0)) + 1,
+            unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0)),
+            last_activity=Coalesce(F('last_message_at'), F('created_at')),
+        ).order_by('-last_activity', '-id')
+
 
 class ChatRoom(models.Model):
     # --- ส่วนเดิม (ห้ามลบ) ---
@@ -11,42 +53,70 @@ class ChatRoom(models.Model):
     seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='seller_chats')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # ข้อมูลข้อความล่าสุดของห้อง (denormalized) อัปเดตใน transaction เดียวกับการบันทึกข้อความ
+    # ผ่าน ChatRoom.record_messages (Message.save และ MessageWriteBuffer เรียกให้)
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    last_message_sender = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    message_count = models.PositiveIntegerField(default=0)
+    # ข้อความที่ id <= ค่านี้ถูกย้ายไปเก็บใน MessageArchive แล้ว (None = ยังไม่เคยย้าย ไม่ต้อง query ตาราง archive)
+    archived_until_id = models.BigIntegerField(null=True, blank=True)
+
+    objects = ChatRoomQuerySet.as_manager()
+
     class Meta:
         unique_together = ('product', 'buyer')
 
     def __str__(self):
         return f"Chat: {self.product.name} ({self.buyer} -> {self.seller})"
 
+    @classmethod
+    def record_messages(cls, messages):
+        """
+        อัปเดตข้อความล่าสุด / จำนวนข้อความของห้อง จากข้อความที่เพิ่งบันทึก (1 UPDATE ต่อห้อง)
+        ต้องเรียกใน transaction เดียวกับการ INSERT ข้อความ
+        ข้อความล่าสุดเทียบด้วย id จึงถูกต้องแม้หลาย process บันทึกห้องเดียวกันสลับลำดับกัน
+        """
+        by_room = {}
+        for message in messages:
+            by_room.setdefault(message.room_id, []).append(message)
+
+        # เรียงตาม id เสมอ (ห้อง / cursor / โปรไฟล์) เพื่อไม่ให้ batch ที่ทำพร้อมกัน lock สลับลำดับกัน
+        for room_id, room_messages in sorted(by_room.items()):
+            last = max(room_messages, key=lambda message: message.id)
+            newer = Q(last_message_id__isnull=True) | Q(last_message_id__lt=last.id)
+
+            def latest(field, value):
+                model_field = cls._meta.get_field(field)
+                # ForeignKey เก็บค่าเป็น id จึงใช้ชนิดของคอลัมน์ปลายทางแทน
+                output_field = getattr(model_field, 'target_field', model_field)
+                return Case(
+                    When(newer, then=Value(value, output_field=output_field)),
+                    default=F(field),
+                    output_field=output_field,
+                )
+
+            cls.objects.filter(id=room_id).update(
+                message_count=F('message_count') + len(room_messages),
+                last_message_id=latest('last_message_id', last.id),
+                last_message_at=latest('last_message_at', last.timestamp),
+                last_message_preview=latest('last_message_preview', last.content[:PREVIEW_LENGTH]),
+                last_message_sender_id=latest('last_message_sender_id', last.sender_id),
+            )
+        ReadCursor.count_unread(by_room)
+
     # --- ✅ ส่วนที่เพิ่มใหม่ (Helpers สำหรับดึงรูปและชื่อจริง) ---
     
     def get_user_avatar(self, user):
-        """ฟังก์ชันช่วยดึงรูปโปรไฟล์ (เช็คจาก Profile หลักก่อน)"""
-        try:
-            # 1. ลองดึงจาก Profile หลัก (รูปไก่) ในแอป products (ใช้ชื่อฟิลด์ avatar)
-            if hasattr(user, 'profile') and user.profile.avatar:
-                return user.profile.avatar.url
-            
-            # 2. ถ้าไม่มี ลองดึงจาก Chat Profile (ใช้ชื่อฟิลด์ image)
-            if hasattr(user, 'chat_profile') and user.chat_profile.image:
-                return user.chat_profile.image.url
-                
-        except Exception:
-            pass
-        return None
+        """ฟังก์ชันช่วยดึงรูปโปรไฟล์ (เช็คจาก Profile หลักก่อน) ดู chat.profiles"""
+        return avatar_url(user)
 
     def get_user_display_name(self, user):
-        """ฟังก์ชันช่วยดึงชื่อที่ควรแสดง (ชื่อจริง -> ชื่อเล่น -> username)"""
-        # 1. ลองดึงชื่อจริง-นามสกุล
-        full_name = user.get_full_name()
-        if full_name:
-            return full_name
-            
-        # 2. ลองดึง Display Name จาก Profile หลัก
-        if hasattr(user, 'profile') and user.profile.display_name:
-            return user.profile.display_name
-            
-        # 3. ถ้าไม่มี ให้ใช้ Username
-        return user.username
+        """ฟังก์ชันช่วยดึงชื่อที่ควรแสดง (ชื่อจริง -> ชื่อเล่น -> username) ดู chat.profiles"""
+        return display_name(user)
 
     # Property สำหรับเรียกใช้ง่ายๆ ใน Template
     @property
@@ -68,6 +138,9 @@ class ChatRoom(models.Model):
     @property
     def queue_sequence(self):
         """คืนค่าลำดับคิวของแชทนี้ (เทียบกับแชทอื่นในสินค้าเดียวกัน)"""
+        # หน้า inbox คำนวณมาให้แล้วใน ChatRoomQuerySet.for_inbox
+        if hasattr(self, 'queue_rank'):
+            return self.queue_rank
         # นับจำนวนห้องแชทของสินค้านี้ ที่สร้าง "ก่อน" ห้องนี้
         q_count = ChatRoom.objects.filter(
             product=self.product, 
@@ -81,16 +154,218 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField(blank=True)
     image = models.ImageField(upload_to='chat_images/', blank=True, null=True)
+    # รูปที่ย่อแล้วโดย chat.images (ทำใน worker หลังบันทึกข้อความ) image เก็บต้นฉบับไว้เปิดดูเมื่อขอเท่านั้น
+    image_display = models.ImageField(upload_to='chat_images/display/', blank=True, null=True, editable=False)
+    image_thumb = models.ImageField(upload_to='chat_images/thumbs/', blank=True, null=True, editable=False)
+    image_ready = models.BooleanField(default=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # ดัชนีค้นหาข้อความ (chat.search) ตัดคำแบบเดียวกับการค้นหาสินค้า ใส่ตอน INSERT (ข้อความแก้ไขไม่ได้)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # ประวัติแชท / catch-up / long-poll (WHERE room_id = ? ORDER BY id)
+            models.Index(fields=['room', 'id'], name='chat_message_room_id_idx'),
+            models.Index(fields=['room', 'timestamp'], name='chat_message_room_ts_idx'),
+            GinIndex(fields=['search_vector'], name='chat_message_search_gin'),
+        ]
 
     def __str__(self):
         return f"{self.sender}: {self.content[:20]}"
 
+    def save(self, *args, **kwargs):
+        # ข้อความใหม่: บันทึกพร้อมอัปเดตข้อมูลข้อความล่าสุดของห้องใน transaction เดียวกัน
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        self.index_content()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            ChatRoom.record_messages([self])
+
+    def index_content(self):
+        """ใส่ search_vector จาก content ก่อน INSERT (Message.save และ bulk_create ของ MessageWriteBuffer)"""
+        if connection.vendor == 'postgresql':
+            self.search_vector = document_expression(self.content, '')
+
+    @property
+    def image_pending(self):
+        """มีรูปแต่ยังย่อไม่เสร็จ (client แสดงตัวแทนรูปไว้จนกว่าจะได้ event image_ready)"""
+        return bool(self.image) and not self.image_ready
+
+    @property
+    def display_image_url(self):
+        if not self.image or not self.image_ready:
+            return None
+        return (self.image_display or self.image).url
+
+    @property
+    def thumb_image_url(self):
+        if not self.image or not self.image_ready:
+            return None
+        return (self.image_thumb or self.image_display or self.image).url
+
     # ✅ เพิ่มส่วนนี้เข้าไปครับ
     @property
     def sender_avatar_url(self):
-        # เรียกใช้ฟังก์ชันจาก ChatRoom ที่คุณเขียนไว้แล้ว
-        return self.room.get_user_avatar(self.sender)
+        # ทีละข้อความ: หลายข้อความใช้ ProfileResolver (chat.profiles) แทน
+        return avatar_url(self.sender)
+
+class ReadCursor(models.Model):
+    """
+    ตำแหน่งที่อ่านถึงของผู้ใช้ 1 คนในห้อง 1 ห้อง (id ของข้อความล่าสุดที่อ่านแล้ว)
+    พร้อมจำนวนข้อความจากอีกฝ่ายที่ยังไม่อ่าน ซึ่งเพิ่มขึ้นตอนบันทึกข้อความและลดลงตอนได้ read receipt
+    ยอดรวมทุกห้องเก็บไว้ที่ UserProfile.unread_messages (อ่านได้ทันทีโดยไม่ต้องรวม)
+    """
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_cursors')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_read_cursors')
+    last_read_id = models.BigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('room', 'user')
+
+    def __str__(self):
+        return f"{self.user} @ room {self.room_id}: {self.last_read_id} ({self.unread_count} unread)"
+
+    @staticmethod
+    def adjust_total(user_id, delta):
+        if delta:
+            UserProfile.objects.filter(user_id=user_id).update(
+                unread_messages=Greatest(F('unread_messages') + delta, 0)
+            )
+
+    @classmethod
+    def count_unread(cls, messages_by_room):
+        """
+        เพิ่มตัวนับของผู้รับ จากข้อความที่เพิ่งบันทึก {room_id: [messages]} (เรียกจาก ChatRoom.record_messages)
+        ข้อความที่ผู้รับอ่านไปแล้ว (id <= last_read_id เช่นได้รับทาง WebSocket ก่อนบันทึกลง DB) ไม่นับ
+        """
+        totals = {}
+        cursors = cls.objects.select_for_update().filter(room_id__in=messages_by_room).order_by('id')
+        for cursor in cursors:
+            unread = sum(
+                1 for message in messages_by_room[cursor.room_id]
+                if message.sender_id != cursor.user_id and message.id > cursor.last_read_id
+            )
+            if unread:
+                cls.objects.filter(id=cursor.id).update(unread_count=F('unread_count') + unread)
+                totals[cursor.user_id] = totals.get(cursor.user_id, 0) + unread
+        for user_id, unread in sorted(totals.items()):
+            cls.adjust_total(user_id, unread)
+
+    @classmethod
+    def mark_read(cls, user_id, room_id, last_id):
+        """
+        read receipt: อ่านถึงข้อความ last_id แล้ว คืนค่า cursor ถ้าเลื่อนไปข้างหน้า (None ถ้าไม่เปลี่ยน)
+        นับข้อความที่ยังเหลือใหม่จาก DB (ช่วงสั้นๆ หลัง last_id ตาม index (room, id)) ตัวนับจึงแก้ตัวเองได้
+        last_id จาก client เกินข้อความล่าสุดของห้องได้ -> ปัดลงเป็นข้อความล่าสุด (ไม่ข้ามข้อความที่ยังไม่มา)
+        """
+        with transaction.atomic():
+            # lock เฉพาะ cursor (ห้องแค่อ่าน last_message_id) ลำดับ lock จึงไม่ชนกับ record_messages
+            cursor = (
+                cls.objects.select_for_update(of=('self',)).select_related('room')
+                .filter(room_id=room_id, user_id=user_id).first()
+            )
+            if cursor is None:
+                return None
+            last_id = min(last_id, cursor.room.last_message_id or 0)
+            if last_id <= cursor.last_read_id:
+                return None
+            remaining = Message.objects.filter(room_id=room_id, id__gt=last_id).exclude(sender_id=user_id).count()
+            cls.objects.filter(id=cursor.id).update(last_read_id=last_id, unread_count=remaining)
+            cls.adjust_total(user_id, remaining - cursor.unread_count)
+        cursor.last_read_id, cursor.unread_count = last_id, remaining
+        return cursor
+
+
+@receiver(post_save, sender=ChatRoom)
+def create_read_cursors(sender, instance, created, **kwargs):
+    if created:
+        ReadCursor.objects.bulk_create([
+            ReadCursor(room=instance, user_id=instance.buyer_id),
+            ReadCursor(room=instance, user_id=instance.seller_id),
+        ], ignore_conflicts=True)
+
+
+@receiver(post_delete, sender=ReadCursor)
+def remove_unread_from_total(sender, instance, **kwargs):
+    # ลบห้อง (cascade) -> ข้อความที่ยังไม่อ่านของห้องนั้นไม่นับในยอดรวมอีก
+    ReadCursor.adjust_total(instance.user_id, -instance.unread_count)
+
+
+class MessageArchive(models.Model):
+    """
+    ข้อความเก่าของห้องที่ปิดแล้ว (ดู chat.archive) 1 แถวต่อชุดข้อความที่ย้ายออกจาก Message
+    เก็บเป็น msgpack บีบอัดด้วย zlib ในคอลัมน์เดียว ประวัติแชทคลายออกเฉพาะชุดที่ต้องแสดง
+    ชุดของห้องหนึ่งต่อกันตาม id เสมอ (first_id ของชุดใหม่ > last_id ของชุดก่อน)
+    """
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archives')
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    # lexeme ของทุกข้อความในชุด (ไม่มีตำแหน่ง) ใช้กรองชุดที่อาจมีคำค้น แล้วค่อยตรวจทีละข้อความ (chat.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'last_id'], name='chat_archive_room_last_idx'),
+            GinIndex(fields=['search_vector'], name='chat_archive_search_gin'),
+        ]
+
+    def __str__(self):
+        return f"Archive room {self.room_id}: {self.first_id}-{self.last_id} ({self.message_count})"
+
+    @classmethod
+    def pack(cls, room_id, messages):
+        """สร้างชุดจากข้อความของห้องเดียว (เรียงตาม id) ยังไม่บันทึก"""
+        rows = [
+            (
+                message.id, message.sender_id, message.content, message.image.name or '',
+                message.image_display.name or '', message.image_thumb.name or '',
+                (message.timestamp - EPOCH) // timedelta(microseconds=1),
+            )
+            for message in messages
+        ]
+        return cls(
+            room_id=room_id, first_id=rows[0][0], last_id=rows[-1][0], message_count=len(rows),
+            data=zlib.compress(msgpack.packb(rows)),
+            search_vector=build_lexemes(message.content for message in messages),
+        )
+
+    def unpack(self):
+        """ข้อความในชุดเป็น Message ที่ไม่ได้อยู่ใน DB (ใช้กับ message_payload / template ได้เหมือนข้อความปกติ)"""
+        return [
+            Message(
+                id=message_id, room_id=self.room_id, sender_id=sender_id, content=content,
+                image=image or None, image_display=image_display or None, image_thumb=image_thumb or None,
+                timestamp=EPOCH + timedelta(microseconds=micros),
+            )
+            for message_id, sender_id, content, image, image_display, image_thumb, micros
+            in msgpack.unpackb(zlib.decompress(self.data))
+        ]
+
+
+class ChannelGroupMember(models.Model):
+    """
+    สมาชิกของกลุ่มใน PostgresChannelLayer (chat.layers) ใช้หาว่าต้อง NOTIFY process ไหนบ้างตอน group_send
+    process = รหัสของ layer ที่เป็นเจ้าของ channel (แต่ละ process ฟัง NOTIFY ของตัวเอง)
+    """
+    group_name = models.CharField(max_length=100)
+    channel = models.CharField(max_length=100)
+    process = models.CharField(max_length=32)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('group_name', 'channel')
+
+
+class ChannelLayerMessage(models.Model):
+    """ข้อความของ PostgresChannelLayer ที่ใหญ่เกิน payload ของ NOTIFY (ส่งแค่ id ไปแทน) ลบทิ้งเมื่อหมดอายุ"""
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
 
 # --- ส่วนเดิม (Profile ของ Chat - เก็บไว้ตามคำขอ ห้ามลบ) ---
 class Profile(models.Model):
@@ -109,4 +384,38 @@ def create_profile(sender, instance, created, **kwargs):
 def save_profile(sender, instance, **kwargs):
     # ตรวจสอบก่อนว่ามี chat_profile หรือไม่ เพื่อป้องกัน Error
     if hasattr(instance, 'chat_profile'):
-        instance.chat_profile.save()
\ No newline at end of file
+        instance.chat_profile.save()
+
+# รูป/ชื่อในแชทมาจาก UserProfile, chat.Profile และชื่อของ User -> ล้างค่าที่ ProfileResolver จำไว้
+# (หลัง commit เหมือนเวอร์ชันของแคตตาล็อก: ผู้อ่านระหว่าง transaction จะไม่จำค่าเก่าไว้กับเวอร์ชันใหม่)
+PROFILE_USER_FIELDS = {'first_name', 'last_name', 'username'}
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_delete, sender=Profile)
+def bump_profiles_on_change(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'avatar', 'display_name', 'image'} & set(update_fields):
+        return
+    transaction.on_commit(bump_profiles_version)
+
+
+@receiver(post_init, sender=Profile)
+def remember_chat_profile_image(sender, instance, **kwargs):
+    instance._original_image = instance.image.name
+
+
+@receiver(post_save, sender=Profile)
+def bump_profiles_on_chat_image_change(sender, instance, created, **kwargs):
+    # save_profile บันทึก chat.Profile ทุกครั้งที่บันทึก User (รวมถึง login) จึงล้างเฉพาะเมื่อรูปเปลี่ยนจริง
+    if not created and instance.image.name != instance._original_image:
+        transaction.on_commit(bump_profiles_version)
+    instance._original_image = instance.image.name
+
+
+@receiver(post_save, sender=User)
+def bump_profiles_on_user_change(sender, instance, created, update_fields=None, **kwargs):
+    # login บันทึกแค่ last_login: ไม่ต้องล้าง
+    if created or (update_fields is not None and not PROFILE_USER_FIELDS & set(update_fields)):
+        return
+    transaction.on_commit(bump_profiles_version)
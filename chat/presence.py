@@ -0,0 +1,58 @@
+import time
+
+# ไม่ได้ยินจากอีกฝ่ายนานเกินนี้ (วินาที) ถือว่าออฟไลน์ (ไม่มีการเขียน DB: หมดอายุในหน่วยความจำเท่านั้น)
+PRESENCE_TTL = 30
+# consumer ประกาศว่ายังออนไลน์อยู่ทุกๆ PRESENCE_REFRESH วินาที (ต้องน้อยกว่า PRESENCE_TTL)
+PRESENCE_REFRESH = 10
+# สถานะ "กำลังพิมพ์" หายไปเองถ้าไม่มีการพิมพ์ต่อภายใน TYPING_TTL วินาที
+TYPING_TTL = 5
+# ส่ง typing ให้ห้องได้ไม่เกิน 1 ครั้งต่อ TYPING_THROTTLE วินาทีต่อผู้ใช้ (คีย์ที่กดระหว่างนั้นรวมเป็นครั้งเดียว)
+TYPING_THROTTLE = 2
+
+
+class TTLStore:
+    """
+    dict ในหน่วยความจำที่แต่ละ key มีเวลาหมดอายุ (ใช้ monotonic clock)
+    ค่าใน store มาจาก event ของ channel layer จึงเห็นผู้ใช้ที่ต่ออยู่กับ process อื่นด้วย
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._expires = {}
+
+    def __contains__(self, key):
+        expires = self._expires.get(key)
+        return expires is not None and expires > self.clock()
+
+    def touch(self, key, ttl):
+        """ต่ออายุ key คืนค่า True ถ้า key เพิ่งกลับมามีชีวิต (ก่อนหน้านี้ไม่มีหรือหมดอายุแล้ว)"""
+        alive = key in self
+        self._expires[key] = self.clock() + ttl
+        return not alive
+
+    def discard(self, key):
+        """ลบ key คืนค่า True ถ้า key ยังไม่หมดอายุตอนถูกลบ"""
+        alive = key in self
+        self._expires.pop(key, None)
+        return alive
+
+    def expire(self):
+        """ลบ key ที่หมดอายุแล้ว และคืนค่า list ของ key เหล่านั้น"""
+        now = self.clock()
+        expired = [key for key, expires in self._expires.items() if expires <= now]
+        for key in expired:
+            del self._expires[key]
+        return expired
+
+    def next_expiry(self):
+        """เวลา (ตาม clock) ที่ key ถัดไปจะหมดอายุ หรือ None ถ้า store ว่าง"""
+        return min(self._expires.values(), default=None)
+
+
+def presence_event(user_id, online, reply=False):
+    """event ของ channel layer: user_id ออนไลน์/ออฟไลน์ (reply=True ขอให้คนอื่นในห้องประกาศสถานะกลับมา)"""
+    return {'type': 'presence_update', 'user_id': user_id, 'online': online, 'reply': reply}
+
+
+def typing_event(user_id):
+    return {'type': 'typing_update', 'user_id': user_id}
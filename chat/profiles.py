@@ -0,0 +1,89 @@
+from django.contrib.auth.models import User
+
+from products.cache import bump_version, get_version
+
+# เวอร์ชันของรูป/ชื่อที่แสดงในแชท เพิ่มขึ้นเมื่อ UserProfile / chat.Profile / ชื่อของ User เปลี่ยน (ดู chat.models)
+# ProfileResolver ที่จำค่าของเวอร์ชันเก่าไว้จะโหลดใหม่เอง
+PROFILES_VERSION_KEY = 'chat:profiles:version'
+
+
+def profiles_version():
+    return get_version(PROFILES_VERSION_KEY)
+
+
+def bump_profiles_version():
+    return bump_version(PROFILES_VERSION_KEY)
+
+
+def avatar_url(user):
+    """รูปโปรไฟล์ของ user: Profile หลัก (products) ก่อน แล้วจึง chat.Profile (None ถ้าไม่มีทั้งคู่)"""
+    profile = getattr(user, 'profile', None)
+    if profile is not None and profile.avatar:
+        return profile.avatar.url
+    chat_profile = getattr(user, 'chat_profile', None)
+    if chat_profile is not None and chat_profile.image:
+        return chat_profile.image.url
+    return None
+
+
+def display_name(user):
+    """ชื่อที่ควรแสดง: ชื่อจริง-นามสกุล -> display_name ของ Profile หลัก -> username"""
+    full_name = user.get_full_name()
+    if full_name:
+        return full_name
+    profile = getattr(user, 'profile', None)
+    if profile is not None and profile.display_name:
+        return profile.display_name
+    return user.username
+
+
+class ProfileResolver:
+    """
+    รูปและชื่อของผู้ใช้หลายคนด้วย query เดียว จำไว้ตลอดอายุของ resolver (1 request / 1 การเชื่อมต่อ WebSocket)
+    ทุกครั้งที่ขอจะตรวจ profiles_version ก่อน (อ่าน cache 1 ครั้ง) ถ้าเปลี่ยนก็ล้างค่าที่จำไว้ทั้งหมด
+    """
+
+    def __init__(self):
+        self._profiles = {}  # {user_id: (avatar_url, display_name)}
+        self._version = None
+
+    def _check_version(self):
+        version = profiles_version()
+        if version != self._version:
+            self._profiles, self._version = {}, version
+
+    def prime(self, users):
+        """จำค่าจาก User ที่โหลดมาแล้ว (ควรมาพร้อม select_related('profile', 'chat_profile')) โดยไม่ query"""
+        self._check_version()
+        for user in users:
+            if user.id not in self._profiles:
+                self._profiles[user.id] = (avatar_url(user), display_name(user))
+
+    def get(self, user_ids):
+        """{user_id: (avatar_url, display_name)} ของผู้ใช้ที่มีอยู่ ผู้ใช้ที่ยังไม่รู้จักโหลดพร้อมกันใน query เดียว"""
+        self._check_version()
+        user_ids = set(user_ids)
+        missing = user_ids - self._profiles.keys()
+        if missing:
+            users = User.objects.filter(id__in=missing).select_related('profile', 'chat_profile')
+            for user in users:
+                self._profiles[user.id] = (avatar_url(user), display_name(user))
+        return {user_id: self._profiles[user_id] for user_id in user_ids if user_id in self._profiles}
+
+    def avatars(self, user_ids):
+        return {user_id: avatar for user_id, (avatar, name) in self.get(user_ids).items()}
+
+    def avatar(self, user_id):
+        return self.avatars([user_id]).get(user_id)
+
+    def name(self, user_id):
+        profile = self.get([user_id]).get(user_id)
+        return profile[1] if profile else ''
+
+
+def request_profiles(request):
+    """ProfileResolver ของ request นี้ (สร้างครั้งแรกที่ขอ ใช้ร่วมกันทุกส่วนของ request)"""
+    resolver = getattr(request, '_chat_profiles', None)
+    if resolver is None:
+        resolver = request._chat_profiles = ProfileResolver()
+    return resolver
@@ -0,0 +1,97 @@
+from django.db import connection
+from django.db.models import Q
+
+from products.search import THAI_RUN_RE, TOKEN_RE, LexemeQuery, build_query
+
+from .models import ChatRoom, Message, MessageArchive
+
+# จำนวนผลค้นหาต่อหน้า (หน้าถัดไปใช้ ?before=<id ของผลสุดท้าย>)
+SEARCH_PAGE_SIZE = 20
+# จำนวนตัวอักษรรอบคำที่พบ ที่แสดงเป็นข้อความตัวอย่าง
+SNIPPET_RADIUS = 40
+
+
+def match_span(content, terms):
+    """
+    ตำแหน่ง (start, end) ของคำค้นคำแรกใน content หรือ None ถ้าไม่พบครบทุกคำ
+    ใช้กติกาเดียวกับ tsquery ของ products.search: คำไทยต้องอยู่ติดกันในคำเดียว คำอื่นค้นแบบขึ้นต้นด้วย
+    (ตรวจข้อความใน MessageArchive ซึ่ง GIN index กรองได้แค่ระดับชุด และหาตำแหน่งของ snippet)
+    """
+    lowered = (content or '').lower()
+    words = list(TOKEN_RE.finditer(lowered))
+    first = None
+    for term in terms:
+        thai = THAI_RUN_RE.fullmatch(term)
+        for word in words:
+            if thai:
+                offset = word.group().find(term) if THAI_RUN_RE.fullmatch(word.group()) else -1
+            else:
+                offset = 0 if word.group().startswith(term) else -1
+            if offset >= 0:
+                break
+        else:
+            return None
+        if first is None:
+            start = word.start() + offset
+            first = (start, start + len(term))
+    return first
+
+
+def snippet(content, span):
+    """แบ่งข้อความรอบคำที่พบเป็น (ก่อน, คำที่พบ, หลัง) ให้ template ไฮไลต์โดยไม่ต้องใส่ HTML เอง"""
+    if span is None:
+        return '', '', content[:SNIPPET_RADIUS * 2]
+    start, end = span
+    before = content[max(start - SNIPPET_RADIUS, 0):start]
+    after = content[end:end + SNIPPET_RADIUS]
+    if start > SNIPPET_RADIUS:
+        before = '…' + before
+    if end + SNIPPET_RADIUS < len(content):
+        after += '…'
+    return before, content[start:end], after
+
+
+def search_messages(user, text, before_id=None, limit=SEARCH_PAGE_SIZE):
+    """
+    ค้นข้อความแชทในห้องที่ user เป็นผู้ซื้อหรือผู้ขาย เรียงใหม่ -> เก่า (id น้อยกว่า before_id ถ้าระบุ)
+    - ตาราง Message: GIN index ของ search_vector (ตัดคำแบบเดียวกับการค้นหาสินค้า)
+    - MessageArchive: GIN index กรองชุดที่มีทุก token แล้วคลายเฉพาะชุดนั้นมาตรวจทีละข้อความ
+    คืนค่า (messages, has_more) แต่ละข้อความมี room (พร้อมสินค้า) และ snippet ติดมาด้วย
+    """
+    terms = TOKEN_RE.findall((text or '').lower())
+    if not terms:
+        return [], False
+
+    rooms = ChatRoom.objects.filter(Q(buyer=user) | Q(seller=user)).values('id')
+    messages = Message.objects.filter(room__in=rooms)
+    segments = MessageArchive.objects.filter(room__in=rooms)
+    if before_id:
+        messages = messages.filter(id__lt=before_id)
+        segments = segments.filter(first_id__lt=before_id)
+    if connection.vendor == 'postgresql':
+        messages = messages.filter(search_vector=LexemeQuery(build_query(text)))
+        segments = segments.filter(search_vector=LexemeQuery(build_query(text, phrase=False)))
+    else:
+        messages = messages.filter(content__icontains=text)
+
+    hits = list(messages.order_by('-id')[:limit + 1])
+    # ชุดเรียงตาม last_id: หยุดเมื่อชุดถัดไปเก่ากว่าผลลำดับที่ limit + 1 ทั้งหมด (ไม่มีทางติดหน้านี้)
+    for segment in segments.order_by('-last_id').iterator(chunk_size=10):
+        if len(hits) > limit and segment.last_id < hits[limit].id:
+            break
+        hits.extend(
+            message for message in segment.unpack()
+            if (not before_id or message.id < before_id) and match_span(message.content, terms)
+        )
+        hits.sort(key=lambda message: message.id, reverse=True)
+        del hits[limit + 1:]
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    rooms = ChatRoom.objects.select_related('product', 'buyer__profile', 'seller__profile').in_bulk(
+        {message.room_id for message in hits}
+    )
+    for message in hits:
+        message.room = rooms[message.room_id]
+        message.snippet = snippet(message.content, match_span(message.content, terms))
+    return hits, has_more
@@ -0,0 +1,222 @@
+import json
+
+import msgpack
+from django.utils import timezone
+
+from .archive import archived_messages, archived_messages_after
+from .models import Message
+from .profiles import ProfileResolver
+
+try:
+    import ujson as fast_json
+except ImportError:  # ujson อยู่ใน requirements.txt แต่ถ้าไม่มีก็ใช้ json ปกติได้ (ผลลัพธ์เหมือนกัน)
+    fast_json = json
+
+# จำนวนข้อความสูงสุดที่ส่งให้ client ตอน reconnect (ที่เหลือให้โหลดจากหน้าแชทใหม่)
+CATCH_UP_LIMIT = 200
+# จำนวนข้อความต่อหน้าของประวัติแชท (หน้าห้องแสดงหน้าล่าสุด เลื่อนขึ้นเพื่อโหลดหน้าก่อนหน้า)
+HISTORY_PAGE_SIZE = 50
+# id ของข้อความเป็น bigint: ค่าที่เกินนี้ไม่มีข้อความไหนตรง และทำให้ query ล้มด้วย DataError
+MAX_MESSAGE_ID = 2 ** 63 - 1
+UNSET = object()
+
+# --- รูปแบบ frame ของ WebSocket (เลือกด้วย subprotocol ตอนเชื่อมต่อ) ---
+# - ไม่ระบุ / JSON_SUBPROTOCOL: text frame ละ 1 event เป็น JSON ชื่อฟิลด์เต็ม (client เดิม)
+# - MSGPACK_SUBPROTOCOL: binary frame เป็น msgpack array ของ event หลายรายการ ใช้ชื่อฟิลด์แบบย่อ (FIELD_CODES)
+JSON_SUBPROTOCOL = 'chat.json.v1'
+MSGPACK_SUBPROTOCOL = 'chat.msgpack.v1'
+SUBPROTOCOLS = (MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL)  # เรียงตามที่ server อยากใช้
+FIELD_CODES = {
+    'type': 'y',
+    'id': 'i',
+    'sender_id': 's',
+    'content': 'c',
+    'image_url': 'm',
+    'timestamp': 't',
+    'sender_avatar': 'a',
+    'user_id': 'u',
+    'last_id': 'l',
+    'online': 'o',
+    'typing': 'p',
+    'message': 'g',
+    'thumb_url': 'h',
+    'original_url': 'r',
+    'seq': 'q',
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+
+def room_group_name(room_id):
+    return f'chat_{room_id}'
+
+
+def message_payload(message, sender_avatar=UNSET):
+    """
+    ข้อมูลข้อความ 1 รายการที่ส่งให้ client (WebSocket / long-poll ใช้รูปแบบเดียวกัน)
+    ส่ง sender_avatar มาด้วยถ้ารู้อยู่แล้ว เพื่อไม่ต้อง query โปรไฟล์ของผู้ส่ง
+    """
+    if sender_avatar is UNSET:
+        sender_avatar = message.sender_avatar_url
+    data = {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'content': message.content,
+        'image_url': message.display_image_url,
+        'timestamp': timezone.localtime(message.timestamp).strftime('%H:%M'),
+        'sender_avatar': sender_avatar,
+    }
+    if message.image:
+        # image_url เป็น None ระหว่างย่อรูป (ได้ url จริงภายหลังทาง image_ready_event)
+        data.update(image_urls(message))
+    return data
+
+
+def image_urls(message):
+    return {
+        'image_url': message.display_image_url,
+        'thumb_url': message.thumb_image_url,
+        'original_url': message.image.url,
+    }
+
+
+def image_ready_event(message):
+    """event ของ channel layer: รูปของข้อความย่อเสร็จแล้ว (ส่งต่อให้ client เป็น {'type': 'image', ...})"""
+    return {
+        'type': 'image_ready',
+        'image_data': {'type': 'image', 'id': message.id, **image_urls(message)},
+    }
+
+
+def read_receipt_event(user_id, last_id):
+    """event ของ channel layer: user_id อ่านถึงข้อความ last_id แล้ว (ส่งต่อให้ client เป็น {'type': 'read', ...})"""
+    return {
+        'type': 'read_receipt',
+        'receipt_data': {'type': 'read', 'user_id': user_id, 'last_id': last_id},
+    }
+
+
+def messages_after(room_id, last_id, profiles=None):
+    """
+    ข้อความที่ client ยังไม่ได้รับ (id มากกว่า last_id) ด้วย query เดียว
+    รูปผู้ส่งมากับ query เดียวกัน และจำไว้ใน profiles (ProfileResolver ของ request / การเชื่อมต่อ)
+    """
+    messages = list(Message.objects.filter(room_id=room_id, id__gt=last_id).select_related(
+        'sender__profile', 'sender__chat_profile'
+    ).order_by('id')[:CATCH_UP_LIMIT])
+    profiles = profiles or ProfileResolver()
+    profiles.prime(message.sender for message in messages)
+    avatars = profiles.avatars({message.sender_id for message in messages})
+    return [message_payload(message, sender_avatar=avatars.get(message.sender_id)) for message in messages]
+
+
+def parse_last_id(value):
+    """id ข้อความจาก client (query string / frame) ค่าที่ไม่ใช่ id ที่เป็นไปได้ถือเป็น 0"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+    return value if 0 < value <= MAX_MESSAGE_ID else 0
+
+
+def participant_avatars(room, profiles=None):
+    """
+    รูปโปรไฟล์ของผู้ซื้อ/ผู้ขายในห้อง {user_id: url}
+    ผู้ส่งทุกข้อความเป็นหนึ่งในสองคนนี้ จึงหาครั้งเดียวต่อห้องแทนการหาทีละข้อความ
+    (ห้องควรมาพร้อม select_related โปรไฟล์ของทั้งสองฝ่าย จึงไม่ต้อง query เพิ่ม)
+    """
+    profiles = profiles or ProfileResolver()
+    profiles.prime((room.buyer, room.seller))
+    return profiles.avatars((room.buyer_id, room.seller_id))
+
+
+def message_history(room, before_id=None, limit=None, profiles=None):
+    """
+    ข้อความหน้าหนึ่งของห้อง (เก่า -> ใหม่) ที่ id น้อยกว่า before_id (ไม่ระบุ = หน้าล่าสุด)
+    รวมข้อความที่ย้ายไปเก็บใน MessageArchive แล้ว (chat.archive) โดยอ่านเฉพาะเมื่อเลื่อนถึงช่วงนั้น
+    คืนค่า (messages, has_more) โดย has_more บอกว่ายังมีข้อความที่เก่ากว่านี้อีกหรือไม่
+    แต่ละข้อความมี sender_avatar ติดมาด้วย (ไม่ต้อง query โปรไฟล์ทีละข้อความ)
+    """
+    limit = limit or HISTORY_PAGE_SIZE
+    messages = Message.objects.filter(room=room)
+    if before_id:
+        messages = messages.filter(id__lt=before_id)
+    messages = list(messages.order_by('-id')[:limit + 1])
+    if len(messages) <= limit and room.archived_until_id:
+        # ข้อความในตารางหมดแล้ว ต่อด้วยข้อความที่ย้ายไปเก็บ (เก่ากว่าทุกข้อความที่เหลือในตาราง)
+        oldest = messages[-1].id if messages else before_id
+        messages += archived_messages(room, oldest, limit + 1 - len(messages))
+    has_more = len(messages) > limit
+    messages = messages[:limit][::-1]
+
+    avatars = participant_avatars(room, profiles)
+    for message in messages:
+        message.sender_avatar = avatars.get(message.sender_id)
+    return messages, has_more
+
+
+def message_history_after(room, after_id, limit=None, profiles=None):
+    """
+    ข้อความหน้าหนึ่งของห้อง (เก่า -> ใหม่) ที่ id มากกว่า after_id (เลื่อนลงหลังกระโดดไปยังข้อความจากผลค้นหา)
+    คืนค่า (messages, has_more) โดย has_more บอกว่ายังมีข้อความที่ใหม่กว่านี้อีกหรือไม่
+    """
+    limit = limit or HISTORY_PAGE_SIZE
+    messages = []
+    if room.archived_until_id and after_id < room.archived_until_id:
+        messages = archived_messages_after(room, after_id, limit + 1)
+    if len(messages) <= limit:
+        # ข้อความในตารางใหม่กว่าข้อความที่ย้ายไปเก็บทุกข้อความ จึงต่อท้ายได้เลย
+        messages += Message.objects.filter(room=room, id__gt=after_id).order_by('id')[:limit + 1 - len(messages)]
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    avatars = participant_avatars(room, profiles)
+    for message in messages:
+        message.sender_avatar = avatars.get(message.sender_id)
+    return messages, has_more
+
+
+def negotiate_subprotocol(offered):
+    """subprotocol ที่จะใช้จากรายการที่ client เสนอมา (None = client เดิมที่ไม่ได้ระบุ ใช้ JSON)"""
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in offered:
+            return subprotocol
+    return None
+
+
+def compact(data):
+    return {FIELD_CODES.get(key, key): value for key, value in data.items()}
+
+
+def expand(data):
+    return {FIELD_NAMES.get(key, key): value for key, value in data.items()}
+
+
+def encode_json(data):
+    return fast_json.dumps(data, ensure_ascii=False)
+
+
+def encode_msgpack(events):
+    """events หลายรายการใน binary frame เดียว"""
+    return msgpack.packb([compact(event) for event in events])
+
+
+def decode_msgpack(frame):
+    return [expand(event) for event in msgpack.unpackb(frame)]
+
+
+def decode_client_frame(text_data=None, bytes_data=None):
+    """
+    frame จาก client: JSON (text) หรือ msgpack (binary, event เดียวหรือ array ก็ได้) -> dict ชื่อฟิลด์เต็ม
+    frame ที่ถอดไม่ได้คืน {} (consumer ข้ามไป ไม่ปิดการเชื่อมต่อ)
+    """
+    try:
+        if bytes_data is not None:
+            data = msgpack.unpackb(bytes_data)
+            if isinstance(data, list):
+                data = data[0] if data else {}
+            return expand(data) if isinstance(data, dict) else {}
+        data = json.loads(text_data or '{}')
+    # ValueError ครอบคลุม JSONDecodeError, UnicodeDecodeError และข้อผิดพลาดของ msgpack ทั้งหมด
+    except (ValueError, RecursionError):
+        return {}
+    return data if isinstance(data, dict) else {}
@@ -0,0 +1,94 @@
+// ตัวถอด msgpack สำหรับ frame ของแชท (chat.msgpack.v1) เก็บไว้ใน static ของเราเอง ไม่โหลดจาก CDN
+// รองรับชนิดที่ server ส่ง (msgpack.packb ของ Python): nil, bool, int, float, str, bin, array, map
+// ใช้แบบเดียวกับ @msgpack/msgpack: window.MessagePack.decode(Uint8Array)
+(function () {
+    'use strict';
+
+    const textDecoder = new TextDecoder();
+
+    function decode(bytes) {
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let offset = 0;
+
+        function take(length) {
+            if (offset + length > bytes.length) throw new RangeError('msgpack: frame สั้นเกินไป');
+            const start = offset;
+            offset += length;
+            return start;
+        }
+
+        function uint64(at) {
+            return view.getUint32(at) * 2 ** 32 + view.getUint32(at + 4);
+        }
+
+        function int64(at) {
+            return view.getInt32(at) * 2 ** 32 + view.getUint32(at + 4);
+        }
+
+        function str(length) {
+            const start = take(length);
+            return textDecoder.decode(bytes.subarray(start, start + length));
+        }
+
+        function bin(length) {
+            const start = take(length);
+            return bytes.slice(start, start + length);
+        }
+
+        function array(length) {
+            const items = new Array(length);
+            for (let i = 0; i < length; i++) items[i] = value();
+            return items;
+        }
+
+        function map(length) {
+            const data = {};
+            for (let i = 0; i < length; i++) {
+                const key = value();
+                data[key] = value();
+            }
+            return data;
+        }
+
+        function value() {
+            const type = bytes[take(1)];
+            if (type <= 0x7f) return type;
+            if (type >= 0xe0) return type - 0x100;
+            if (type >= 0xa0 && type <= 0xbf) return str(type & 0x1f);
+            if (type >= 0x90 && type <= 0x9f) return array(type & 0x0f);
+            if (type >= 0x80 && type <= 0x8f) return map(type & 0x0f);
+            switch (type) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return bin(view.getUint8(take(1)));
+                case 0xc5: return bin(view.getUint16(take(2)));
+                case 0xc6: return bin(view.getUint32(take(4)));
+                case 0xca: return view.getFloat32(take(4));
+                case 0xcb: return view.getFloat64(take(8));
+                case 0xcc: return view.getUint8(take(1));
+                case 0xcd: return view.getUint16(take(2));
+                case 0xce: return view.getUint32(take(4));
+                case 0xcf: return uint64(take(8));
+                case 0xd0: return view.getInt8(take(1));
+                case 0xd1: return view.getInt16(take(2));
+                case 0xd2: return view.getInt32(take(4));
+                case 0xd3: return int64(take(8));
+                case 0xd9: return str(view.getUint8(take(1)));
+                case 0xda: return str(view.getUint16(take(2)));
+                case 0xdb: return str(view.getUint32(take(4)));
+                case 0xdc: return array(view.getUint16(take(2)));
+                case 0xdd: return array(view.getUint32(take(4)));
+                case 0xde: return map(view.getUint16(take(2)));
+                case 0xdf: return map(view.getUint32(take(4)));
+            }
+            throw new TypeError(`msgpack: ไม่รองรับชนิด 0x${type.toString(16)}`);
+        }
+
+        const result = value();
+        if (offset !== bytes.length) throw new RangeError('msgpack: มีข้อมูลเกินท้าย frame');
+        return result;
+    }
+
+    window.MessagePack = { decode: decode };
+})();
@@ -1,8 +1,45 @@
-from django.test import TestCase
+import asyncio
+import json
+import tempfile
+import threading
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock
+
+import msgpack
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 from products.models import Product
-from .models import ChatRoom, Message, Profile
+from . import images
+from .archive import archive_room, closed_rooms
+from .buffer import MessageWriteBuffer
+from .images import DISPLAY_SIZE, THUMB_SIZE, broadcast, process_message_image
+from .layers import STORED, PostgresChannelLayer
+from .metrics import GAUGES_KEY_PREFIX, ConnectionGauges, chat_connection_stats, gauges
+from .models import PREVIEW_LENGTH, ChannelLayerMessage, ChatRoom, Message, MessageArchive, Profile, ReadCursor
+from .presence import TTLStore, presence_event
+from .profiles import ProfileResolver
+from .routing import websocket_urlpatterns
+from .search import search_messages
+from .serializers import (
+    JSON_SUBPROTOCOL, MAX_MESSAGE_ID, MSGPACK_SUBPROTOCOL, decode_client_frame, decode_msgpack,
+    encode_msgpack, message_history, message_payload, negotiate_subprotocol, parse_last_id, room_group_name,
+)
 
 
 class ChatRoomModelTest(TestCase):
@@ -23,7 +60,6 @@ class ChatRoomModelTest(TestCase):
 
     def test_unique_together(self):
         """Same buyer+product should not create duplicate room."""
-        from django.db import IntegrityError
         with self.assertRaises(IntegrityError):
             ChatRoom.objects.create(
                 product=self.product, buyer=self.buyer, seller=self.seller,
@@ -99,6 +135,57 @@ class ChatProfileSignalTest(TestCase):
         self.assertIsNotNone(user.chat_profile)
 
 
+class ProfileResolverTest(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"u{i}", password="p") for i in range(3)]
+        self.users[0].first_name = "Somchai"
+        self.users[0].save()
+        self.users[1].profile.avatar = "avatars/u1.jpg"
+        self.users[1].profile.save()
+
+    def test_one_query_then_memoized(self):
+        resolver = ProfileResolver()
+        ids = [user.id for user in self.users]
+        with self.assertNumQueries(1):
+            profiles = resolver.get(ids)
+        self.assertEqual(profiles[self.users[0].id][1], "Somchai")
+        self.assertEqual(profiles[self.users[1].id][0], "/media/avatars/u1.jpg")
+        self.assertEqual(profiles[self.users[2].id], ("/media/default.jpg", "u2"))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.avatar(self.users[1].id), "/media/avatars/u1.jpg")
+            self.assertEqual(resolver.name(self.users[2].id), "u2")
+
+    def test_invalidated_after_profile_change(self):
+        resolver = ProfileResolver()
+        user = self.users[1]
+        resolver.get([user.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            user.profile.avatar = "avatars/new.jpg"
+            user.profile.save()
+        self.assertEqual(resolver.avatar(user.id), "/media/avatars/new.jpg")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.chat_profile.image = "profile_pics/chat.jpg"
+            user.chat_profile.save()
+            user.profile.avatar = None
+            user.profile.save()
+        self.assertEqual(resolver.avatar(user.id), "/media/profile_pics/chat.jpg")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.first_name = "Malee"
+            user.save()
+        self.assertEqual(resolver.name(user.id), "Malee")
+
+    def test_login_does_not_invalidate(self):
+        resolver = ProfileResolver()
+        resolver.get([self.users[0].id])
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.force_login(self.users[0])
+        self.assertEqual(callbacks, [])
+        with self.assertNumQueries(0):
+            resolver.name(self.users[0].id)
+
+
 class ChatAuthRequiredViewsTest(TestCase):
     """Chat views should redirect anonymous users to login."""
 
@@ -116,3 +203,1164 @@ class ChatAuthRequiredViewsTest(TestCase):
         response = self.client.get(reverse("start_chat", kwargs={"product_id": 1}))
         self.assertEqual(response.status_code, 302)
         self.assertIn("login", response.url.lower())
+
+
+class ChatPushDeliveryTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username="buyer", password="p")
+        self.seller = User.objects.create_user(username="seller", password="p")
+        self.other = User.objects.create_user(username="other", password="p")
+        self.product = Product.objects.create(
+            name="Item", description="d", price=100,
+            seller=self.seller, status="active",
+        )
+        self.room = ChatRoom.objects.create(
+            product=self.product, buyer=self.buyer, seller=self.seller,
+        )
+
+    def test_long_poll_returns_backlog_immediately(self):
+        first = Message.objects.create(room=self.room, sender=self.buyer, content="one")
+        Message.objects.create(room=self.room, sender=self.seller, content="two")
+        self.client.force_login(self.buyer)
+        with self.assertNumQueries(4):
+            # session + user + สิทธิ์เข้าห้อง + ข้อความ (query เดียว)
+            response = self.client.get(
+                reverse("get_new_messages", kwargs={"room_id": self.room.id}), {"last_id": first.id}
+            )
+        self.assertEqual([m["content"] for m in response.json()["messages"]], ["two"])
+
+    def test_long_poll_forbidden_for_non_participant(self):
+        self.client.force_login(self.other)
+        response = self.client.get(reverse("get_new_messages", kwargs={"room_id": self.room.id}))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_long_poll_waits_on_channel_layer(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.buyer)
+
+        async def push():
+            await asyncio.sleep(0.2)
+            await get_channel_layer().group_send(room_group_name(self.room.id), {
+                "type": "chat_message",
+                "message_data": {"id": 10**9, "content": "pushed"},
+            })
+
+        response, _ = await asyncio.gather(
+            client.get(reverse("get_new_messages", kwargs={"room_id": self.room.id}), {"last_id": 0}),
+            push(),
+        )
+        self.assertEqual(response.json()["messages"], [{"id": 10**9, "content": "pushed"}])
+
+    def test_long_poll_times_out_empty(self):
+        self.client.force_login(self.buyer)
+        with mock.patch("chat.views.LONG_POLL_TIMEOUT", 0.05):
+            response = self.client.get(reverse("get_new_messages", kwargs={"room_id": self.room.id}))
+        self.assertEqual(response.json(), {"messages": []})
+
+
+class ChatInboxTest(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="seller", password="p")
+        self.product = Product.objects.create(
+            name="Item", description="d", price=100,
+            seller=self.seller, status="active",
+        )
+        self.buyers = [User.objects.create_user(username=f"buyer{i}", password="p") for i in range(3)]
+        self.rooms = [
+            ChatRoom.objects.create(product=self.product, buyer=buyer, seller=self.seller)
+            for buyer in self.buyers
+        ]
+
+    def test_annotations(self):
+        first, second, _ = self.rooms
+        Message.objects.create(room=first, sender=self.buyers[0], content="hi")
+        Message.objects.create(room=first, sender=self.seller, content="hello")
+        Message.objects.create(room=first, sender=self.buyers[0], content="still there?")
+        Message.objects.create(room=first, sender=self.buyers[0], content="?")
+        Message.objects.create(room=second, sender=self.buyers[1], content="")
+
+        rooms = {room.id: room for room in ChatRoom.objects.for_inbox(self.seller)}
+        self.assertEqual([rooms[room.id].queue_rank for room in self.rooms], [1, 2, 3])
+        self.assertEqual([rooms[room.id].unread_count for room in self.rooms], [3, 1, 0])
+        self.assertEqual(rooms[first.id].last_message_preview, "?")
+        self.assertEqual(rooms[first.id].message_count, 4)
+        self.assertEqual(rooms[first.id].last_message_sender_id, self.buyers[0].id)
+        self.assertIsNone(rooms[self.rooms[2].id].last_message_id)
+
+        buyer_rooms = list(ChatRoom.objects.for_inbox(self.buyers[1]))
+        self.assertEqual([room.id for room in buyer_rooms], [second.id])
+        # ลำดับคิวนับรวมห้องของผู้ซื้อคนอื่นด้วย แม้ผู้ซื้อจะไม่เห็นห้องเหล่านั้น
+        self.assertEqual(buyer_rooms[0].queue_rank, 2)
+        self.assertEqual(buyer_rooms[0].unread_count, 0)
+
+    def test_ordered_by_last_activity(self):
+        first, second, third = self.rooms
+        Message.objects.create(room=first, sender=self.buyers[0], content="old")
+        Message.objects.create(room=second, sender=self.buyers[1], content="new")
+        # ห้องที่ยังไม่มีข้อความใช้เวลาที่สร้างห้อง
+        ChatRoom.objects.filter(id=third.id).update(created_at=timezone.now() - timedelta(days=1))
+        rooms = list(ChatRoom.objects.for_inbox(self.seller))
+        self.assertEqual([room.id for room in rooms], [second.id, first.id, third.id])
+
+    def test_inbox_query_count_is_constant(self):
+        for room in self.rooms:
+            Message.objects.create(room=room, sender=room.buyer, content="hi")
+        self.client.force_login(self.seller)
+        # session + user + โปรไฟล์ใน navbar (ตัวนับแจ้งเตือน/แชท) + ห้องแชททั้งหมด (ไม่ขึ้นกับจำนวนห้อง)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("chat_list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "คิวแรก")
+        self.assertContains(response, "คิวที่ 3")
+
+        for i in range(3, 10):
+            buyer = User.objects.create_user(username=f"buyer{i}", password="p")
+            room = ChatRoom.objects.create(product=self.product, buyer=buyer, seller=self.seller)
+            Message.objects.create(room=room, sender=buyer, content="hi")
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("chat_list"))
+        self.assertContains(response, "คิวที่ 10")
+
+
+class ChatHistoryTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username="buyer", password="p")
+        self.seller = User.objects.create_user(username="seller", password="p")
+        self.other = User.objects.create_user(username="other", password="p")
+        self.product = Product.objects.create(
+            name="Item", description="d", price=100,
+            seller=self.seller, status="active",
+        )
+        self.room = ChatRoom.objects.create(
+            product=self.product, buyer=self.buyer, seller=self.seller,
+        )
+        self.messages = [
+            Message.objects.create(
+                room=self.room, sender=self.buyer if i % 2 else self.seller, content=f"m{i}"
+            )
+            for i in range(12)
+        ]
+
+    def test_room_renders_latest_page_only(self):
+        self.client.force_login(self.buyer)
+        url = reverse("chat_room", kwargs={"room_id": self.room.id})
+        with mock.patch("chat.serializers.HISTORY_PAGE_SIZE", 5):
+            self.client.get(url)  # ครั้งแรกบันทึกว่าอ่านแล้ว
+            # session + user + navbar (โปรไฟล์) + ห้อง/ผู้ใช้/โปรไฟล์ + read cursor + ข้อความ
+            # (ไม่ขึ้นกับจำนวนข้อความหรือผู้ส่ง)
+            with self.assertNumQueries(6):
+                response = self.client.get(url)
+        ids = [m.id for m in response.context["chat_messages"]]
+        self.assertEqual(ids, [m.id for m in self.messages[-5:]])
+        self.assertTrue(response.context["has_more"])
+        self.assertNotContains(response, ">m6<")
+        self.assertContains(response, ">m11<")
+        # ตัวถอด msgpack มาจาก static ของเราเอง ไม่ใช่ CDN
+        self.assertContains(response, "chat/msgpack-decode")
+        self.assertNotContains(response, "@msgpack/msgpack")
+
+    def test_history_pages_backward(self):
+        self.client.force_login(self.seller)
+        url = reverse("chat_history", kwargs={"room_id": self.room.id})
+        with self.assertNumQueries(4):
+            # session + user + ห้อง/โปรไฟล์ (query เดียว) + ข้อความ
+            data = self.client.get(url, {"before": self.messages[7].id}).json()
+        self.assertEqual([m["content"] for m in data["messages"]], [f"m{i}" for i in range(7)])
+        self.assertFalse(data["has_more"])
+        self.assertEqual(
+            {m["sender_avatar"] for m in data["messages"]},
+            {self.room.get_user_avatar(self.buyer), self.room.get_user_avatar(self.seller)},
+        )
+
+    def test_history_has_more(self):
+        messages, has_more = message_history(self.room, before_id=self.messages[10].id, limit=4)
+        self.assertEqual([m.content for m in messages], ["m6", "m7", "m8", "m9"])
+        self.assertTrue(has_more)
+        messages, has_more = message_history(self.room, limit=12)
+        self.assertEqual(len(messages), 12)
+        self.assertFalse(has_more)
+
+    def test_history_forbidden_for_non_participant(self):
+        self.client.force_login(self.other)
+        response = self.client.get(reverse("chat_history", kwargs={"room_id": self.room.id}))
+        self.assertEqual(response.status_code, 403)
+
+
+class ChatRoomActivityTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username="buyer", password="p")
+        self.seller = User.objects.create_user(username="seller", password="p")
+        self.product = Product.objects.create(
+            name="Item", description="d", price=100,
+            seller=self.seller, status="active",
+        )
+        self.room = ChatRoom.objects.create(
+            product=self.product, buyer=self.buyer, seller=self.seller,
+        )
+
+    def test_create_updates_room(self):
+        Message.objects.create(room=self.room, sender=self.buyer, content="hi")
+        last = Message.objects.create(room=self.room, sender=self.seller, content="x" * 500)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 2)
+        self.assertEqual(self.room.last_message_id, last.id)
+        self.assertEqual(self.room.last_message_at, last.timestamp)
+        self.assertEqual(self.room.last_message_preview, "x" * PREVIEW_LENGTH)
+        self.assertEqual(self.room.last_message_sender_id, self.seller.id)
+
+    def test_view_post_updates_room(self):
+        self.client.force_login(self.buyer)
+        self.client.post(reverse("chat_room", kwargs={"room_id": self.room.id}), {"content": "สนใจครับ"})
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.message_count, self.room.last_message_preview), (1, "สนใจครับ"))
+
+    def test_buffered_batch_updates_room_once(self):
+        batch = [
+            Message(room=self.room, sender=self.buyer, content="a"),
+            Message(room=self.room, sender=self.seller, content="b"),
+            Message(room=self.room, sender=self.buyer, content="c"),
+        ]
+        with self.assertNumQueries(9):
+            # ใน transaction เดียวกัน: INSERT ชุดเดียว + UPDATE ห้อง + lock cursor ของห้อง
+            # + UPDATE ตัวนับของผู้รับแต่ละฝ่าย (cursor + โปรไฟล์) + SAVEPOINT/RELEASE
+            saved = MessageWriteBuffer._write(batch)
+        ids = [message.id for message in saved]
+        self.assertEqual(ids, sorted(ids))
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.message_count, self.room.last_message_preview), (3, "c"))
+
+        # batch ที่มาช้ากว่า (id เก่ากว่า) ไม่ทับข้อความล่าสุด แต่ยังนับจำนวน
+        older = Message(id=ids[0] - 1, room=self.room, sender=self.seller, content="late")
+        ChatRoom.record_messages([older])
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.message_count, self.room.last_message_id), (4, ids[2]))
+
+    def test_inbox_does_not_scan_messages_for_sorting(self):
+        Message.objects.create(room=self.room, sender=self.buyer, content="hi")
+        sql = str(ChatRoom.objects.for_inbox(self.seller).query)
+        self.assertIn('COALESCE("chat_chatroom"."last_message_at", "chat_chatroom"."created_at") AS "last_activity"', sql)
+
+
+class ReadCursorTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username="buyer", password="p")
+        self.seller = User.objects.create_user(username="seller", password="p")
+        self.product = Product.objects.create(
+            name="Item", description="d", price=100,
+            seller=self.seller, status="active",
+        )
+        self.room = ChatRoom.objects.create(
+            product=self.product, buyer=self.buyer, seller=self.seller,
+        )
+
+    def unread(self, user):
+        cursor = ReadCursor.objects.get(room=self.room, user=user)
+        total = User.objects.get(id=user.id).profile.unread_messages
+        return cursor.unread_count, total
+
+    def test_cursors_created_with_room(self):
+        self.assertEqual(
+            set(self.room.read_cursors.values_list("user_id", flat=True)), {self.buyer.id, self.seller.id}
+        )
+
+    def test_messages_increment_recipient_only(self):
+        Message.objects.create(room=self.room, sender=self.buyer, content="a")
+        Message.objects.create(room=self.room, sender=self.buyer, content="b")
+        Message.objects.create(room=self.room, sender=self.seller, content="c")
+        self.assertEqual(self.unread(self.seller), (2, 2))
+        self.assertEqual(self.unread(self.buyer), (1, 1))
+
+    def test_total_spans_rooms(self):
+        other_product = Product.objects.create(
+            name="Other", description="d", price=50, seller=self.seller, status="active",
+        )
+        other_room = ChatRoom.objects.create(product=other_product, buyer=self.buyer, seller=self.seller)
+        Message.objects.create(room=self.room, sender=self.buyer, content="a")
+        Message.objects.create(room=other_room, sender=self.buyer, content="b")
+        self.assertEqual(User.objects.get(id=self.seller.id).profile.unread_messages, 2)
+
+        # ลบห้อง -> ยอดรวมลดลงตามข้อความที่ยังไม่อ่านของห้องนั้น
+        other_room.delete()
+        self.assertEqual(User.objects.get(id=self.seller.id).profile.unread_messages, 1)
+
+    def test_mark_read(self):
+        first = Message.objects.create(room=self.room, sender=self.buyer, content="a")
+        Message.objects.create(room=self.room, sender=self.buyer, content="b")
+        cursor = ReadCursor.mark_read(self.seller.id, self.room.id, first.id)
+        self.assertEqual((cursor.last_read_id, cursor.unread_count), (first.id, 1))
+        self.assertEqual(self.unread(self.seller), (1, 1))
+        # receipt ที่เก่ากว่าตำแหน่งปัจจุบันไม่เปลี่ยนอะไร
+        self.assertIsNone(ReadCursor.mark_read(self.seller.id, self.room.id, first.id))
+
+    def test_mark_read_clamps_to_last_message(self):
+        last = Message.objects.create(room=self.room, sender=self.buyer, content="a")
+        cursor = ReadCursor.mark_read(self.seller.id, self.room.id, last.id + 1000)
+        self.assertEqual((cursor.last_read_id, cursor.unread_count), (last.id, 0))
+        # ข้อความที่มาทีหลังยังนับเป็นยังไม่อ่าน
+        Message.objects.create(room=self.room, sender=self.buyer, content="b")
+        self.assertEqual(self.unread(self.seller), (1, 1))
+
+    def test_profile_save_keeps_counter(self):
+        Message.objects.create(room=self.room, sender=self.buyer, content="a")
+        profile = self.seller.profile  # ค่าในหน่วยความจำยังเป็น 0
+        Message.objects.create(room=self.room, sender=self.buyer, content="b")
+        profile.bio = "hello"
+        profile.save()
+        self.assertEqual(self.unread(self.seller), (2, 2))
+
+    def test_opening_room_marks_read(self):
+        Message.objects.create(room=self.room, sender=self.buyer, content="a")
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse("chat_room", kwargs={"room_id": self.room.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.unread(self.seller), (0, 0))
+
+    def test_header_badge(self):
+        Message.objects.create(room=self.room, sender=self.buyer, content="a")
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse("chat_list"))
+        self.assertContains(response, "💬 แชท")
+        self.assertEqual(response.context["request"].user.profile.unread_messages, 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ChatImageProcessingTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username="buyer", password="p")
+        self.seller = User.objects.create_user(username="seller", password="p")
+        self.product = Product.objects.create(
+            name="Item", description="d", price=100,
+            seller=self.seller, status="active",
+        )
+        self.room = ChatRoom.objects.create(
+            product=self.product, buyer=self.buyer, seller=self.seller,
+        )
+
+    @staticmethod
+    def upload(size=(2400, 1800)):
+        buffer = BytesIO()
+        Image.new("RGB", size, "red").save(buffer, "JPEG")
+        return SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+    def test_post_returns_before_resize(self):
+        self.client.force_login(self.buyer)
+        with mock.patch("chat.images.executor") as executor, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("chat_room", kwargs={"room_id": self.room.id}), {"image": self.upload()},
+                headers={"x-requested-with": "XMLHttpRequest"},
+            )
+        self.assertEqual(response.json(), {"status": "success"})
+        message = Message.objects.get()
+        self.assertTrue(message.image_pending)
+        executor.submit.assert_called_once()
+        self.assertEqual(executor.submit.call_args.args[1], message.id)
+
+        data = message_payload(message)
+        self.assertIsNone(data["image_url"])
+        self.assertEqual(data["original_url"], message.image.url)
+
+    def test_process_resizes_and_broadcasts(self):
+        message = Message.objects.create(
+            room=self.room, sender=self.buyer, image=self.upload(), image_ready=False,
+        )
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(room_group_name(self.room.id), channel)
+
+        process_message_image(message.id)
+
+        message.refresh_from_db()
+        self.assertFalse(message.image_pending)
+        with Image.open(message.image_display) as display, Image.open(message.image_thumb) as thumb:
+            self.assertEqual(max(display.size), DISPLAY_SIZE)
+            self.assertEqual(max(thumb.size), THUMB_SIZE)
+        with Image.open(message.image) as original:
+            self.assertEqual(original.size, (2400, 1800))
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event["image_data"], {
+            "type": "image", "id": message.id, "image_url": message.image_display.url,
+            "thumb_url": message.image_thumb.url, "original_url": message.image.url,
+        })
+
+    def test_worker_broadcasts_through_server_loop(self):
+        layer = get_channel_layer()
+        group_send = layer.group_send
+        threads = []
+
+        async def record_thread(*args):
+            threads.append(threading.current_thread())
+            await group_send(*args)
+
+        async def send_from_worker():
+            # เหมือน pool ของจริง: worker อยู่ใน thread อื่น ส่วน group_send ต้องกลับมาทำใน loop นี้
+            channel = await layer.new_channel()
+            await layer.group_add("images", channel)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, broadcast, "images", {"type": "image_ready"}, loop)
+            return await layer.receive(channel), threading.current_thread()
+
+        with mock.patch.object(layer, "group_send", record_thread):
+            event, loop_thread = async_to_sync(send_from_worker)()
+        self.assertEqual(event, {"type": "image_ready"})
+        self.assertEqual(threads, [loop_thread])
+
+    def test_schedule_remembers_server_loop(self):
+        async def run_view():
+            # view แบบ sync ใต้ ASGI: thread ของ sync_to_async ไม่มี loop ที่รันอยู่ แต่ต้องจำ loop ของ server ได้
+            await sync_to_async(images.schedule_image_processing)(1)
+            return asyncio.get_running_loop()
+
+        with mock.patch.object(images.executor, "submit") as submit, \
+                self.captureOnCommitCallbacks(execute=True):
+            server = async_to_sync(run_view)()
+        submit.assert_called_once_with(images._run, 1, server)
+
+    def test_unreadable_image_falls_back_to_original(self):
+        message = Message.objects.create(
+            room=self.room, sender=self.buyer, image_ready=False,
+            image=SimpleUploadedFile("broken.jpg", b"not an image", content_type="image/jpeg"),
+        )
+        with self.assertLogs("chat.images", "ERROR"):
+            process_message_image(message.id)
+        message.refresh_from_db()
+        self.assertFalse(message.image_pending)
+        self.assertEqual(message.display_image_url, message.image.url)
+        self.assertEqual(message.thumb_image_url, message.image.url)
+
+
+class ChatArchiveTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username="buyer", password="p")
+        self.seller = User.objects.create_user(username="seller", password="p")
+        self.product = Product.objects.create(
+            name="Item", description="d", price=100,
+            seller=self.seller, status="sold",
+        )
+        self.room = ChatRoom.objects.create(
+            product=self.product, buyer=self.buyer, seller=self.seller,
+        )
+        self.messages = [
+            Message.objects.create(
+                room=self.room, sender=self.buyer if i % 2 else self.seller, content=f"m{i}"
+            )
+            for i in range(15)
+        ]
+        # 12 ข้อความแรกเก่ากว่า 1 ปี
+        old = timezone.now() - timedelta(days=365)
+        Message.objects.filter(id__in=[m.id for m in self.messages[:12]]).update(timestamp=old)
+        Message.objects.filter(id=self.messages[3].id).update(image="chat_images/a.jpg", image_thumb="chat_images/thumbs/a.jpg")
+        self.cutoff = timezone.now() - timedelta(days=90)
+
+    def test_moves_oldest_messages_in_batches(self):
+        self.assertEqual(closed_rooms(self.cutoff), [self.room.id])
+        self.assertEqual(archive_room(self.room.id, self.cutoff, batch_size=5), 12)
+
+        self.assertEqual(
+            list(MessageArchive.objects.order_by("first_id").values_list("message_count", flat=True)), [5, 5, 2]
+        )
+        self.assertEqual(
+            list(Message.objects.order_by("id").values_list("content", flat=True)), ["m12", "m13", "m14"]
+        )
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.archived_until_id, self.messages[11].id)
+        self.assertEqual(self.room.message_count, 15)
+        self.assertEqual(closed_rooms(self.cutoff), [])
+
+    def test_open_room_is_not_archived(self):
+        self.product.status = "active"
+        self.product.save()
+        self.assertEqual(closed_rooms(self.cutoff), [])
+
+    def test_archive_round_trip(self):
+        stored = list(Message.objects.order_by("id")[:12])
+        archive_room(self.room.id, self.cutoff)
+        restored = MessageArchive.objects.get().unpack()
+        self.assertEqual(
+            [(m.id, m.sender_id, m.content, m.timestamp) for m in restored],
+            [(m.id, m.sender_id, m.content, m.timestamp) for m in stored],
+        )
+        self.assertEqual(restored[3].image.name, "chat_images/a.jpg")
+        self.assertEqual(restored[3].thumb_image_url, "/media/chat_images/thumbs/a.jpg")
+        self.assertFalse(restored[0].image)
+
+    def test_history_reads_through_archive(self):
+        archive_room(self.room.id, self.cutoff, batch_size=5)
+        self.client.force_login(self.buyer)
+        url = reverse("chat_history", kwargs={"room_id": self.room.id})
+        pages = []
+        before = None
+        with mock.patch("chat.serializers.HISTORY_PAGE_SIZE", 4):
+            while True:
+                data = self.client.get(url, {"before": before} if before else {}).json()
+                pages.append([m["content"] for m in data["messages"]])
+                if not data["has_more"]:
+                    break
+                before = data["messages"][0]["id"]
+        self.assertEqual(pages, [
+            ["m11", "m12", "m13", "m14"], ["m7", "m8", "m9", "m10"], ["m3", "m4", "m5", "m6"], ["m0", "m1", "m2"],
+        ])
+
+
+class ChatSearchTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username="buyer", password="p")
+        self.seller = User.objects.create_user(username="seller", password="p")
+        self.other = User.objects.create_user(username="other", password="p")
+        self.product = Product.objects.create(
+            name="Calculus", description="d", price=100, seller=self.seller, status="sold",
+        )
+        self.room = ChatRoom.objects.create(product=self.product, buyer=self.buyer, seller=self.seller)
+        self.other_room = ChatRoom.objects.create(product=self.product, buyer=self.other, seller=self.seller)
+        contents = ["สวัสดีครับ", "หนังสือเล่มนี้ยังอยู่ไหม", "ลดราคาได้ไหมครับ iPhone", "ได้ครับ", "นัดรับที่หอสมุด"]
+        self.messages = [
+            Message.objects.create(room=self.room, sender=self.buyer if i % 2 else self.seller, content=content)
+            for i, content in enumerate(contents)
+        ]
+        Message.objects.create(room=self.other_room, sender=self.other, content="หนังสือมีรอยไหม")
+
+    def search(self, user, q, **params):
+        self.client.force_login(user)
+        response = self.client.get(reverse("chat_search"), {"q": q, **params})
+        return [message.content for message in response.context["results"]], response
+
+    def test_search_limited_to_own_rooms(self):
+        self.assertEqual(self.search(self.buyer, "หนังสือ")[0], ["หนังสือเล่มนี้ยังอยู่ไหม"])
+        self.assertEqual(self.search(self.seller, "หนังสือ")[0], ["หนังสือมีรอยไหม", "หนังสือเล่มนี้ยังอยู่ไหม"])
+        self.assertEqual(self.search(self.other, "ลดราคา")[0], [])
+        self.assertEqual(self.search(self.buyer, "iphone")[0], ["ลดราคาได้ไหมครับ iPhone"])
+        self.assertEqual(self.search(self.buyer, "หนังลด")[0], [])
+
+    def test_result_links_into_room(self):
+        results, response = self.search(self.buyer, "ราคา")
+        self.assertContains(response, f'?around={self.messages[2].id}')
+        self.assertContains(response, '<mark class="bg-yellow-200 rounded px-0.5">ราคา</mark>', html=False)
+        self.assertContains(response, "Calculus")
+
+    def test_buffered_messages_are_indexed(self):
+        message = Message(room=self.room, sender=self.buyer, content="ขอดูรูปเพิ่ม", timestamp=timezone.now())
+        MessageWriteBuffer._write([message])
+        self.assertEqual(self.search(self.buyer, "ดูรูป")[0], ["ขอดูรูปเพิ่ม"])
+
+    def test_migration_backfill_matches_live_index(self):
+        backfill = import_module("chat.migrations.0010_backfill_message_search")
+        Message.objects.filter(id=self.messages[0].id).update(timestamp=timezone.now() - timedelta(days=365))
+        archive_room(self.room.id, timezone.now() - timedelta(days=90))
+        expected = {
+            model: dict(model.objects.values_list("id", "search_vector")) for model in (Message, MessageArchive)
+        }
+        Message.objects.update(search_vector=None)
+        MessageArchive.objects.update(search_vector=None)
+
+        with mock.patch.object(backfill, "BATCH_SIZE", 2), connection.schema_editor() as schema_editor:
+            backfill.populate_search_vector(apps, schema_editor)
+        for model, vectors in expected.items():
+            self.assertEqual(dict(model.objects.values_list("id", "search_vector")), vectors)
+
+    def test_search_includes_archived_messages(self):
+        Message.objects.filter(id__in=[m.id for m in self.messages[:3]]).update(
+            timestamp=timezone.now() - timedelta(days=365)
+        )
+        archive_room(self.room.id, timezone.now() - timedelta(days=90), batch_size=2)
+        Message.objects.create(room=self.room, sender=self.seller, content="ครับ ลดให้ได้")
+
+        self.assertEqual(self.search(self.buyer, "หนังสือ")[0], ["หนังสือเล่มนี้ยังอยู่ไหม"])
+        # bigram ครบทุกตัวในชุดเดียวกัน แต่ไม่ติดกันในข้อความเดียว -> ไม่ใช่ผลลัพธ์
+        self.assertEqual(self.search(self.buyer, "สวัสดีหนัง")[0], [])
+        first, has_more = search_messages(self.buyer, "ครับ", limit=2)
+        self.assertTrue(has_more)
+        rest, has_more = search_messages(self.buyer, "ครับ", before_id=first[-1].id, limit=2)
+        self.assertFalse(has_more)
+        self.assertEqual(
+            [m.content for m in first + rest],
+            ["ครับ ลดให้ได้", "ได้ครับ", "ลดราคาได้ไหมครับ iPhone", "สวัสดีครับ"],
+        )
+        self.assertEqual(first[-1].room, self.room)
+
+    def test_jump_to_message_and_page_forward(self):
+        Message.objects.filter(id__in=[m.id for m in self.messages[:3]]).update(
+            timestamp=timezone.now() - timedelta(days=365)
+        )
+        archive_room(self.room.id, timezone.now() - timedelta(days=90), batch_size=2)
+        self.client.force_login(self.buyer)
+        target = self.messages[1]
+        with mock.patch("chat.serializers.HISTORY_PAGE_SIZE", 2):
+            response = self.client.get(reverse("chat_room", kwargs={"room_id": self.room.id}), {"around": target.id})
+            self.assertEqual(
+                [m.content for m in response.context["chat_messages"]],
+                ["สวัสดีครับ", "หนังสือเล่มนี้ยังอยู่ไหม", "ลดราคาได้ไหมครับ iPhone", "ได้ครับ"],
+            )
+            self.assertTrue(response.context["has_newer"])
+            self.assertEqual(response.context["jump_to"], target.id)
+
+            url = reverse("chat_history", kwargs={"room_id": self.room.id})
+            data = self.client.get(url, {"after": self.messages[3].id}).json()
+        self.assertEqual([m["content"] for m in data["messages"]], ["นัดรับที่หอสมุด"])
+        self.assertFalse(data["has_more"])
+
+        response = self.client.get(reverse("chat_room", kwargs={"room_id": self.room.id}))
+        self.assertFalse(response.context["has_newer"])
+
+
+class PostgresChannelLayerTest(TransactionTestCase):
+    """สอง layer = สอง process (คนละรหัส process คนละ connection LISTEN)"""
+
+    def layers(self):
+        return PostgresChannelLayer(), PostgresChannelLayer()
+
+    async def test_group_send_reaches_other_process(self):
+        here, there = self.layers()
+        try:
+            local = await here.new_channel()
+            remote = await there.new_channel()
+            await here.group_add("chat_1", local)
+            await there.group_add("chat_1", remote)
+            await here.group_send("chat_1", {"type": "chat.message", "text": "hi"})
+            self.assertEqual(await asyncio.wait_for(here.receive(local), 1), {"type": "chat.message", "text": "hi"})
+            self.assertEqual(await asyncio.wait_for(there.receive(remote), 5), {"type": "chat.message", "text": "hi"})
+
+            await there.group_discard("chat_1", remote)
+            await here.group_send("chat_1", {"type": "chat.message", "text": "again"})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(there.receive(remote), 0.5)
+        finally:
+            await here.close()
+            await there.close()
+
+    async def test_large_group_message_keeps_order(self):
+        here, there = self.layers()
+        try:
+            remote = await there.new_channel()
+            await there.group_add("chat_1", remote)
+            # notification ของข้อความใหญ่ (ต้องดึงจากตาราง) มาพร้อมกับข้อความเล็กที่ส่งตามหลัง
+            big, data = there._payload("g", "chat_1", {"type": "big", "text": "ก" * 5000})
+            rows = await there._db(f"INSERT INTO {STORED} (data, created_at) VALUES (%s, now()) RETURNING id", [data])
+            there._dispatch(f"{big}{rows[0][0]}")
+            for i in range(3):
+                there._dispatch(there._payload("g", "chat_1", {"type": f"small{i}"})[0])
+            received = [(await asyncio.wait_for(there.receive(remote), 5))["type"] for _ in range(4)]
+            self.assertEqual(received, ["big", "small0", "small1", "small2"])
+        finally:
+            await here.close()
+            await there.close()
+
+    async def test_large_group_message_not_stored_without_remote_members(self):
+        here, there = self.layers()
+        try:
+            local = await here.new_channel()
+            await here.group_add("chat_1", local)
+            await here.group_send("chat_1", {"type": "big", "text": "ก" * 5000})
+            self.assertEqual((await here.receive(local))["type"], "big")
+            self.assertEqual(await database_sync_to_async(ChannelLayerMessage.objects.count)(), 0)
+        finally:
+            await here.close()
+            await there.close()
+
+    async def test_send_to_channel_of_other_process(self):
+        here, there = self.layers()
+        try:
+            remote = await there.new_channel()
+            big = "ก" * 5000  # ใหญ่เกิน payload ของ NOTIFY -> เก็บในตารางแล้วส่ง id
+            await here.send(remote, {"type": "small"})
+            await here.send(remote, {"type": "big", "text": big})
+            self.assertEqual(await asyncio.wait_for(there.receive(remote), 5), {"type": "small"})
+            self.assertEqual(await asyncio.wait_for(there.receive(remote), 5), {"type": "big", "text": big})
+        finally:
+            await here.close()
+            await there.close()
+
+    async def test_capacity_limits_local_queue(self):
+        layer = PostgresChannelLayer(capacity=2)
+        try:
+            channel = await layer.new_channel()
+            await layer.send(channel, {"type": "a"})
+            await layer.send(channel, {"type": "b"})
+            with self.assertRaises(ChannelFull):
+                await layer.send(channel, {"type": "c"})
+            self.assertEqual(await layer.receive(channel), {"type": "a"})
+        finally:
+            await layer.close()
+
+
+class TTLStoreTest(SimpleTestCase):
+    def test_touch_discard_expire(self):
+        now = [100.0]
+        store = TTLStore(clock=lambda: now[0])
+        self.assertTrue(store.touch("a", 5))
+        self.assertFalse(store.touch("a", 5))
+        store.touch("b", 10)
+        self.assertEqual(store.next_expiry(), 105.0)
+        now[0] = 106.0
+        self.assertNotIn("a", store)
+        self.assertEqual(store.expire(), ["a"])
+        self.assertTrue(store.discard("b"))
+        self.assertFalse(store.discard("b"))
+        self.assertIsNone(store.next_expiry())
+
+
+class FrameCodecTest(SimpleTestCase):
+    def test_negotiate(self):
+        self.assertEqual(negotiate_subprotocol([JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL]), MSGPACK_SUBPROTOCOL)
+        self.assertEqual(negotiate_subprotocol([JSON_SUBPROTOCOL]), JSON_SUBPROTOCOL)
+        self.assertIsNone(negotiate_subprotocol([]))
+
+    def test_msgpack_round_trip_is_smaller_than_json(self):
+        events = [
+            {"id": 10 + i, "sender_id": 7, "content": "สินค้ายังอยู่ไหม", "image_url": None,
+             "timestamp": "12:30", "sender_avatar": "/media/a.jpg"}
+            for i in range(5)
+        ]
+        frame = encode_msgpack(events)
+        self.assertEqual(decode_msgpack(frame), events)
+        self.assertLess(len(frame), sum(len(json.dumps(e).encode()) for e in events) / 2)
+
+    def test_parse_last_id_rejects_out_of_range(self):
+        self.assertEqual(parse_last_id("42"), 42)
+        self.assertEqual(parse_last_id(MAX_MESSAGE_ID), MAX_MESSAGE_ID)
+        for value in (10 ** 30, -5, "x", None, float("inf")):
+            self.assertEqual(parse_last_id(value), 0)
+
+    def test_decode_client_frame(self):
+        self.assertEqual(decode_client_frame('{"type": "read", "last_id": 5}'), {"type": "read", "last_id": 5})
+        self.assertEqual(decode_client_frame(bytes_data=msgpack.packb({"y": "read", "l": 5})), {"type": "read", "last_id": 5})
+        self.assertEqual(decode_client_frame("[1, 2]"), {})
+
+    def test_decode_client_frame_ignores_malformed(self):
+        for text in ("{", "not json", "[" * 100000):
+            self.assertEqual(decode_client_frame(text), {})
+        for data in (b"\xc1", b"\x92\x01", b"\x81\x91\x01\x01", b"\x01\x02", b"\xa2\xff\xfe"):
+            self.assertEqual(decode_client_frame(bytes_data=data), {})
+
+
+class ChatConsumerTest(TransactionTestCase):
+    # database_sync_to_async ปิด connection หลังใช้งาน จึงรันใน transaction ของ TestCase ไม่ได้
+    def setUp(self):
+        self.buyer = User.objects.create_user(username="buyer", password="p")
+        self.seller = User.objects.create_user(username="seller", password="p")
+        self.other = User.objects.create_user(username="other", password="p")
+        self.product = Product.objects.create(
+            name="Item", description="d", price=100,
+            seller=self.seller, status="active",
+        )
+        self.room = ChatRoom.objects.create(
+            product=self.product, buyer=self.buyer, seller=self.seller,
+        )
+
+    def communicator(self, user, last_id=None, subprotocols=None):
+        path = f"/ws/chat/{self.room.id}/"
+        if last_id is not None:
+            path += f"?last_id={last_id}"
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path, subprotocols=subprotocols)
+        communicator.scope["user"] = user
+        return communicator
+
+    async def connect_both(self):
+        """ผู้ซื้อเข้าห้องก่อน แล้วผู้ขายตามมา (ทั้งสองฝ่ายได้รับสถานะออนไลน์ของกันและกัน)"""
+        buyer = self.communicator(self.buyer)
+        seller = self.communicator(self.seller)
+        await buyer.connect()
+        await seller.connect()
+        online = {"type": "presence", "online": True}
+        self.assertEqual(await buyer.receive_json_from(), {**online, "user_id": self.seller.id})
+        self.assertEqual(await seller.receive_json_from(), {**online, "user_id": self.buyer.id})
+        return buyer, seller
+
+    async def test_non_participant_rejected(self):
+        connected, _ = await self.communicator(self.other).connect()
+        self.assertFalse(connected)
+
+    async def test_reconnect_catches_up_after_last_id(self):
+        create = sync_to_async(Message.objects.create)
+        first = await create(room=self.room, sender=self.buyer, content="one")
+        await create(room=self.room, sender=self.seller, content="two")
+        await create(room=self.room, sender=self.buyer, content="three")
+        communicator = self.communicator(self.buyer, last_id=first.id)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())["content"], "two")
+        self.assertEqual((await communicator.receive_json_from())["content"], "three")
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_posted_message_is_pushed(self):
+        communicator = self.communicator(self.seller)
+        await communicator.connect()
+        await sync_to_async(self.client.force_login)(self.buyer)
+        await sync_to_async(self.client.post)(
+            reverse("chat_room", kwargs={"room_id": self.room.id}), {"content": "hello"},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+        )
+        data = await communicator.receive_json_from()
+        self.assertEqual((data["content"], data["sender_id"]), ("hello", self.buyer.id))
+        self.assertIn("id", data)
+        await communicator.disconnect()
+
+    async def test_websocket_sender_is_scope_user(self):
+        communicator = self.communicator(self.buyer)
+        await communicator.connect()
+        await communicator.send_json_to({"message": "hi", "sender_id": self.seller.id})
+        data = await communicator.receive_json_from()
+        self.assertEqual(data["sender_id"], self.buyer.id)
+        await communicator.disconnect()
+
+    async def test_read_receipt_updates_cursor_and_notifies_room(self):
+        message = await database_sync_to_async(Message.objects.create)(
+            room=self.room, sender=self.buyer, content="hi"
+        )
+        buyer, seller = await self.connect_both()
+        await seller.send_json_to({"type": "read", "last_id": message.id})
+        self.assertEqual(
+            await buyer.receive_json_from(), {"type": "read", "user_id": self.seller.id, "last_id": message.id}
+        )
+        cursor = await database_sync_to_async(ReadCursor.objects.get)(room=self.room, user=self.seller)
+        self.assertEqual((cursor.last_read_id, cursor.unread_count), (message.id, 0))
+
+        # receipt ซ้ำไม่ถูกส่งต่ออีก ค่าที่เกิน bigint ก็ไม่ทำให้ consumer ล้ม
+        await seller.receive_json_from()
+        await seller.send_json_to({"type": "read", "last_id": message.id})
+        await seller.send_json_to({"type": "read", "last_id": 10 ** 30})
+        self.assertTrue(await buyer.receive_nothing())
+        await buyer.disconnect()
+        await seller.disconnect()
+
+    async def test_presence_offline_on_disconnect(self):
+        buyer, seller = await self.connect_both()
+        await seller.disconnect()
+        self.assertEqual(
+            await buyer.receive_json_from(), {"type": "presence", "user_id": self.seller.id, "online": False}
+        )
+        await buyer.disconnect()
+
+    async def test_presence_expires_without_refresh(self):
+        # ผู้ขายไม่ประกาศซ้ำ (เช่น process ของผู้ขายตาย) -> ผู้ซื้อเห็นว่าออฟไลน์เมื่อครบ TTL
+        with mock.patch("chat.consumers.PRESENCE_TTL", 0.2), mock.patch("chat.consumers.PRESENCE_REFRESH", 60):
+            buyer, seller = await self.connect_both()
+            self.assertEqual(
+                await buyer.receive_json_from(timeout=2),
+                {"type": "presence", "user_id": self.seller.id, "online": False},
+            )
+            await seller.disconnect()
+            await buyer.disconnect()
+
+    async def test_presence_refresh_keeps_peer_online(self):
+        with mock.patch("chat.consumers.PRESENCE_TTL", 0.3), mock.patch("chat.consumers.PRESENCE_REFRESH", 0.1):
+            buyer, seller = await self.connect_both()
+            # ต่ออายุเงียบๆ ไม่มี frame ถึง client
+            self.assertTrue(await buyer.receive_nothing(timeout=0.6))
+            await seller.disconnect()
+            await buyer.disconnect()
+
+    async def test_typing_is_coalesced_and_expires(self):
+        with mock.patch("chat.consumers.TYPING_TTL", 0.3):
+            buyer, seller = await self.connect_both()
+            for _ in range(10):
+                await seller.send_json_to({"type": "typing"})
+            self.assertEqual(
+                await buyer.receive_json_from(), {"type": "typing", "user_id": self.seller.id, "typing": True}
+            )
+            # 10 คีย์ -> typing ครั้งเดียว แล้วหายไปเองเมื่อหยุดพิมพ์
+            self.assertEqual(
+                await buyer.receive_json_from(timeout=2),
+                {"type": "typing", "user_id": self.seller.id, "typing": False},
+            )
+            self.assertTrue(await buyer.receive_nothing())
+            await seller.disconnect()
+            await buyer.disconnect()
+
+    async def test_message_resets_typing_throttle(self):
+        buyer, seller = await self.connect_both()
+        await seller.send_json_to({"type": "typing"})
+        self.assertEqual((await buyer.receive_json_from())["type"], "typing")
+        await seller.send_json_to({"message": "hi"})
+        self.assertEqual((await buyer.receive_json_from())["content"], "hi")
+        await seller.receive_json_from()
+        # ผู้รับล้างสถานะพิมพ์เมื่อได้ข้อความ และผู้ส่งเริ่มพิมพ์ข้อความใหม่ได้ทันที
+        await seller.send_json_to({"type": "typing"})
+        self.assertEqual(
+            await buyer.receive_json_from(), {"type": "typing", "user_id": self.seller.id, "typing": True}
+        )
+        await seller.disconnect()
+        await buyer.disconnect()
+
+    async def test_msgpack_subprotocol_batches_catch_up(self):
+        create = sync_to_async(Message.objects.create)
+        first = await create(room=self.room, sender=self.buyer, content="one")
+        await create(room=self.room, sender=self.seller, content="two")
+        await create(room=self.room, sender=self.buyer, content="three")
+        communicator = self.communicator(
+            self.buyer, last_id=first.id, subprotocols=[MSGPACK_SUBPROTOCOL, "chat.json.v1"]
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertEqual((connected, subprotocol), (True, MSGPACK_SUBPROTOCOL))
+        frame = await communicator.receive_from()
+        self.assertIsInstance(frame, bytes)
+        events = decode_msgpack(frame)
+        self.assertEqual([e["content"] for e in events], ["two", "three"])
+        self.assertEqual(events[0]["sender_id"], self.seller.id)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_msgpack_burst_is_one_frame(self):
+        communicator = self.communicator(self.buyer, subprotocols=[MSGPACK_SUBPROTOCOL])
+        await communicator.connect()
+        with mock.patch("chat.consumers.BATCH_WINDOW", 0.3):
+            for text in ("a", "b", "c", "d"):
+                # client ส่งเป็น msgpack ชื่อฟิลด์ย่อก็ได้
+                await communicator.send_to(bytes_data=msgpack.packb({"g": text}))
+            events = decode_msgpack(await communicator.receive_from(timeout=2))
+        self.assertEqual([e["content"] for e in events], ["a", "b", "c", "d"])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_json_subprotocol_keeps_text_frames(self):
+        communicator = self.communicator(self.buyer, subprotocols=["chat.json.v1"])
+        connected, subprotocol = await communicator.connect()
+        self.assertEqual(subprotocol, "chat.json.v1")
+        await communicator.send_json_to({"message": "สวัสดี"})
+        self.assertEqual((await communicator.receive_json_from())["content"], "สวัสดี")
+        await communicator.disconnect()
+
+    async def test_malformed_frame_is_ignored(self):
+        communicator = self.communicator(self.buyer)
+        await communicator.connect()
+        await communicator.send_to(text_data="{not json")
+        await communicator.send_to(bytes_data=b"\xc1")
+        # การเชื่อมต่อยังอยู่: frame ถัดไปใช้งานได้ตามปกติ
+        await communicator.send_json_to({"message": "ยังอยู่"})
+        self.assertEqual((await communicator.receive_json_from())["content"], "ยังอยู่")
+        await communicator.disconnect()
+
+    async def test_broadcast_after_write_with_real_id(self):
+        communicator = self.communicator(self.buyer)
+        await communicator.connect()
+        await communicator.send_json_to({"message": "first"})
+        first = await communicator.receive_json_from()
+        # ข้อความจาก view ระหว่างนั้นได้ id ต่อจากข้อความที่ส่งไปแล้ว (catch-up ด้วย id > last_id ไม่ข้ามข้อความ)
+        posted = await database_sync_to_async(Message.objects.create)(room=self.room, sender=self.seller, content="view")
+        await communicator.send_json_to({"message": "second"})
+        second = await communicator.receive_json_from()
+        self.assertLess(first["id"], posted.id)
+        self.assertLess(posted.id, second["id"])
+        # ข้อความที่ client ได้รับอยู่ใน DB แล้ว
+        saved = await database_sync_to_async(Message.objects.get)(id=second["id"])
+        self.assertEqual((saved.content, saved.sender_id), ("second", self.buyer.id))
+        await communicator.disconnect()
+
+    async def test_sender_avatar_follows_profile_change(self):
+        communicator = self.communicator(self.buyer)
+        await communicator.connect()
+        await communicator.send_json_to({"message": "before"})
+        self.assertEqual((await communicator.receive_json_from())["sender_avatar"], "/media/default.jpg")
+
+        def change_avatar():
+            profile = User.objects.get(id=self.buyer.id).profile
+            profile.avatar = "avatars/new.jpg"
+            profile.save()
+
+        # การเชื่อมต่อจำรูปไว้ แต่ล้างเมื่อโปรไฟล์เปลี่ยน (หลัง commit)
+        await database_sync_to_async(change_avatar)()
+        await communicator.send_json_to({"message": "after"})
+        self.assertEqual((await communicator.receive_json_from())["sender_avatar"], "/media/avatars/new.jpg")
+        await communicator.disconnect()
+
+    async def test_pending_messages_written_with_one_bulk_create(self):
+        buffer = MessageWriteBuffer(flush_size=3)
+        bulk_create = mock.Mock(wraps=Message.objects.bulk_create)
+        with mock.patch.object(Message.objects, "bulk_create", bulk_create):
+            # add ไม่รอการบันทึก: ข้อความที่ฝากไว้ก่อน task เริ่มทำงานรวมเป็นชุดเดียว
+            for text in ("a", "b", "c", "d"):
+                buffer.add(Message(room=self.room, sender=self.buyer, content=text))
+            self.assertEqual(len(buffer), 4)
+            await buffer.flush()
+        # ไม่เกิน flush_size ต่อ INSERT
+        self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list], [3, 1])
+        self.assertEqual(len(buffer), 0)
+        contents = await database_sync_to_async(
+            lambda: list(Message.objects.order_by("id").values_list("content", flat=True))
+        )()
+        self.assertEqual(contents, ["a", "b", "c", "d"])
+
+    def test_flush_sync_on_shutdown(self):
+        buffer = MessageWriteBuffer()
+        buffer._pending.append(Message(room=self.room, sender=self.buyer, content="bye"))
+        buffer.flush_sync()
+        self.assertEqual(len(buffer), 0)
+        self.assertTrue(Message.objects.filter(content="bye").exists())
+
+    def test_failed_batch_saves_remaining_messages(self):
+        ghost = ChatRoom(id=10**9, product=self.product, buyer=self.buyer, seller=self.seller)
+        buffer = MessageWriteBuffer()
+        buffer._pending.extend([
+            Message(room=self.room, sender=self.buyer, content="kept"),
+            Message(room=ghost, sender=self.buyer, content="lost"),
+        ])
+        with self.assertLogs("chat.buffer", "ERROR"):
+            buffer.flush_sync()
+        self.assertEqual(list(Message.objects.values_list("content", flat=True)), ["kept"])
+
+    async def test_batch_retried_after_write_error(self):
+        buffer = MessageWriteBuffer(flush_size=2)
+        real_write = MessageWriteBuffer._write
+        calls = []
+
+        def flaky_write(batch):
+            # ครั้งแรกล้มเหลว (DB หลุด) ครั้งต่อไปบันทึกได้ตามปกติ
+            calls.append(len(batch))
+            if len(calls) == 1:
+                raise OperationalError("server closed the connection")
+            return real_write(batch)
+
+        with mock.patch.object(MessageWriteBuffer, "_write", staticmethod(flaky_write)), \
+                mock.patch("chat.buffer.RETRY_DELAY", 0), self.assertLogs("chat.buffer", "ERROR"):
+            for text in ("a", "b", "c"):
+                buffer.add(Message(room=self.room, sender=self.buyer, content=text))
+            await buffer.flush()
+        # ชุดที่ล้มเหลวกลับไปหน้าคิว: ลำดับเดิม ไม่มีข้อความหาย
+        self.assertEqual(calls, [2, 2, 1])
+        self.assertEqual(len(buffer), 0)
+        contents = await database_sync_to_async(
+            lambda: list(Message.objects.order_by("id").values_list("content", flat=True))
+        )()
+        self.assertEqual(contents, ["a", "b", "c"])
+
+    async def push(self, count, event_type="chat_message"):
+        for i in range(count):
+            if event_type == "presence":
+                event = presence_event(self.seller.id, i % 2 == 0)  # ออนไลน์/ออฟไลน์สลับกัน: ทุก event ส่งถึง client
+            else:
+                event = {"type": "chat_message", "message_data": {"id": i + 1, "content": f"m{i}"}}
+            await get_channel_layer().group_send(room_group_name(self.room.id), event)
+
+    async def test_slow_client_is_disconnected(self):
+        communicator = self.communicator(self.buyer, subprotocols=["chat.json.v1"])
+        await communicator.connect()
+        closed_slow = gauges.counters["closed_slow"]
+        with mock.patch("chat.consumers.OUTBOX_LIMIT", 4):
+            await self.push(6)
+            frames = [await communicator.receive_json_from() for _ in range(4)]
+            # ค้างครึ่งทาง (2) แล้วขอ pong, client ไม่ตอบ -> ครบ 4 แล้วตัดการเชื่อมต่อ
+            self.assertEqual([f.get("type") for f in frames], [None, None, "ping", None])
+            self.assertEqual(frames[2]["seq"], 3)
+            self.assertEqual(await communicator.receive_output(), {"type": "websocket.close", "code": 4008})
+        self.assertEqual(gauges.counters["closed_slow"], closed_slow + 1)
+        await communicator.disconnect(code=4008)
+
+    async def test_pong_keeps_fast_client_connected(self):
+        communicator = self.communicator(self.buyer, subprotocols=["chat.json.v1"])
+        await communicator.connect()
+        with mock.patch("chat.consumers.OUTBOX_LIMIT", 4):
+            await self.push(10)
+            contents = []
+            while len(contents) < 10:
+                frame = await communicator.receive_json_from()
+                if frame.get("type") == "ping":
+                    await communicator.send_json_to({"type": "pong", "seq": frame["seq"]})
+                else:
+                    contents.append(frame["content"])
+        self.assertEqual(contents, [f"m{i}" for i in range(10)])
+        await communicator.disconnect()
+
+    async def test_full_queue_drops_presence_events(self):
+        communicator = self.communicator(self.buyer, subprotocols=["chat.json.v1"])
+        await communicator.connect()
+        dropped = gauges.counters["dropped_events"]
+        with mock.patch("chat.consumers.OUTBOX_LIMIT", 4):
+            await self.push(3)
+            await self.push(6, "presence")
+            frames = [await communicator.receive_json_from() for _ in range(4)]
+            self.assertTrue(await communicator.receive_nothing())
+        self.assertEqual([f.get("type") for f in frames], [None, None, "ping", None])
+        self.assertEqual(gauges.counters["dropped_events"], dropped + 6)
+        await communicator.disconnect()
+
+    async def test_legacy_client_is_unmetered(self):
+        communicator = self.communicator(self.buyer)
+        await communicator.connect()
+        dropped, closed_slow = gauges.counters["dropped_events"], gauges.counters["closed_slow"]
+        with mock.patch("chat.consumers.OUTBOX_LIMIT", 4):
+            # client เดิมไม่ตอบ pong: ไม่มี backlog ให้จำกัด ได้ครบทุก event ไม่ถูกตัด แต่นับแยกใน gauges
+            await self.push(6)
+            await self.push(2, "presence")
+            frames = [await communicator.receive_json_from() for _ in range(8)]
+            self.assertEqual(gauges.snapshot()["unmetered_connections"], 1)
+        self.assertEqual([f.get("type") for f in frames], [None] * 6 + ["presence"] * 2)
+        self.assertEqual(
+            (gauges.counters["dropped_events"], gauges.counters["closed_slow"]), (dropped, closed_slow)
+        )
+        await communicator.disconnect()
+
+    async def test_idle_connection_is_reaped(self):
+        with mock.patch("chat.consumers.HEARTBEAT_INTERVAL", 0.05), mock.patch("chat.consumers.IDLE_TIMEOUT", 0.12):
+            connections = len(gauges.consumers)
+            communicator = self.communicator(self.buyer, subprotocols=["chat.json.v1"])
+            await communicator.connect()
+            self.assertEqual(len(gauges.consumers), connections + 1)
+            self.assertEqual((await communicator.receive_json_from())["type"], "ping")
+            self.assertEqual(await communicator.receive_output(), {"type": "websocket.close", "code": 4000})
+            await communicator.disconnect(code=4000)
+        self.assertEqual(len(gauges.consumers), connections)
+
+    async def test_legacy_client_gets_no_heartbeat(self):
+        with mock.patch("chat.consumers.HEARTBEAT_INTERVAL", 0.05), mock.patch("chat.consumers.IDLE_TIMEOUT", 0.1):
+            communicator = self.communicator(self.buyer)
+            await communicator.connect()
+            self.assertTrue(await communicator.receive_nothing(timeout=0.3))
+        await communicator.disconnect()
+
+
+class LoadtestChatCommandTest(TransactionTestCase):
+    def test_smoke(self):
+        out = StringIO()
+        call_command("loadtest_chat", "--rooms", "2", "--messages", "1", "--json", "--layer", "memory", "postgres", stdout=out)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([result["layer"] for result in results], ["memory", "postgres"])
+        for result in results:
+            # 2 ห้อง x 2 client x 1 ข้อความ ถึงทั้งผู้ส่งและอีกฝ่าย
+            self.assertEqual((result["connections"], result["deliveries"], result["deliveries_missing"]), (4, 8, 0))
+            self.assertIn("p99", result["fanout_ms"])
+        # ห้อง/ผู้ใช้ชั่วคราวถูกลบเมื่อจบ
+        self.assertFalse(User.objects.filter(username__startswith="__loadtest_chat__").exists())
+
+    def test_answers_ping_past_outbox_limit(self):
+        for protocol in ("json", "msgpack"):
+            out = StringIO()
+            # client ละ 20 ข้อความที่ต้องได้รับ > OUTBOX_LIMIT: ถ้าไม่ตอบ pong จะถูกตัดและขาดข้อความ
+            with mock.patch("chat.consumers.OUTBOX_LIMIT", 8):
+                call_command(
+                    "loadtest_chat", "--rooms", "1", "--messages", "10", "--interval", "0.02",
+                    "--protocol", protocol, "--json", stdout=out,
+                )
+            result = json.loads(out.getvalue())
+            self.assertEqual((result["deliveries"], result["deliveries_missing"]), (40, 0))
+
+
+class ConnectionGaugesTest(SimpleTestCase):
+    def test_stats_sum_live_processes(self):
+        class Consumer:
+            def __init__(self, backlog, heartbeat=True):
+                self.backlog = lambda: backlog
+                self.heartbeat = heartbeat
+
+        cache.clear()
+        first, second = ConnectionGauges(), ConnectionGauges()
+        second.process += "-b"
+        consumers = [Consumer(3), Consumer(7), Consumer(1, heartbeat=False)]
+        first.connected(consumers[0])
+        first.connected(consumers[1])
+        second.connected(consumers[2])
+        first.count("closed_idle")
+        first.publish()
+        second.publish()
+        self.assertFalse(first.due())
+
+        totals, processes = chat_connection_stats()
+        self.assertEqual(len(processes), 2)
+        self.assertEqual(totals["connections"], 3)
+        self.assertEqual(totals["queued_events"], 11)
+        self.assertEqual(totals["max_queue_depth"], 7)
+        self.assertEqual(totals["unmetered_connections"], 1)
+        self.assertEqual(totals["closed_idle"], 1)
+
+        # process ที่หยุดไปแล้ว (ค่าหมดอายุ) หายไปจากผลรวม
+        cache.delete(GAUGES_KEY_PREFIX + second.process)
+        totals, processes = chat_connection_stats()
+        self.assertEqual((totals["processes"], totals["connections"]), (1, 2))
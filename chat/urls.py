@@ -6,7 +6,9 @@ urlpatterns = [
     path('start/<int:product_id>/', views.start_chat, name='start_chat'), # ลิงก์จากหน้าสินค้า
     path('room/<int:room_id>/', views.chat_room, name='chat_room'),       # หน้าห้องแชทจริง
     path('room/<int:room_id>/get_new/', views.get_new_messages, name='get_new_messages'),
+    path('room/<int:room_id>/history/', views.chat_history, name='chat_history'),  # ข้อความเก่า (เลื่อนขึ้น)
     
     path('inbox/', views.chat_list, name='chat_list'),  # หน้ารายการแชท
+    path('search/', views.chat_search, name='chat_search'),  # ค้นข้อความในทุกห้องของเรา
 
 ]
\ No newline at end of file
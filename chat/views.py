@@ -1,14 +1,27 @@
+import asyncio
 from django.http import JsonResponse
 import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import ChatRoom, Message
+from asgiref.sync import async_to_sync, sync_to_async
+from .models import ChatRoom, Message, ReadCursor
 from .forms import MessageForm
+from .images import schedule_image_processing
+from .profiles import request_profiles
+from .search import search_messages
+from .serializers import (
+    room_group_name, message_payload, messages_after, parse_last_id, message_history, message_history_after,
+    participant_avatars, read_receipt_event, FIELD_NAMES,
+)
 from products.models import Product, Notification
 
+# ระยะเวลารอสูงสุดของ long-poll (วินาที) ให้น้อยกว่า timeout ของ proxy ทั่วไป
+LONG_POLL_TIMEOUT = 25
+# ห้องแชทพร้อมสินค้าและโปรไฟล์ของทั้งสองฝ่าย (หัวห้อง + รูปผู้ส่งของทุกข้อความ)
+ROOM_RELATED = ('product', 'buyer__profile', 'buyer__chat_profile', 'seller__profile', 'seller__chat_profile')
+
 @login_required
 def start_chat(request, product_id):
     product = get_object_or_404(Product, pk=product_id)
@@ -29,9 +42,9 @@ def start_chat(request, product_id):
 
 @login_required
 def chat_room(request, room_id):
-    room = get_object_or_404(ChatRoom, id=room_id)
+    room = get_object_or_404(ChatRoom.objects.select_related(*ROOM_RELATED), id=room_id)
     
-    if request.user != room.buyer and request.user != room.seller:
+    if request.user.id not in (room.buyer_id, room.seller_id):
         return redirect('chat_list')
 
     if request.method == 'POST':
@@ -44,27 +57,26 @@ def chat_room(request, room_id):
                 room=room,
                 sender=request.user,
                 content=content,
-                image=image
+                image=image,
+                # ย่อรูปใน worker (chat.images) ไม่ให้ request ต้องรอ
+                image_ready=not image,
             )
 
-            # 2. เตรียมข้อมูลที่จะส่งเข้า WebSocket
-            message_data = {
-                'sender_id': message.sender.id,
-                'content': message.content,
-                'image_url': message.image.url if message.image else None,
-                'timestamp': message.timestamp.strftime('%H:%M'),
-                'sender_avatar': room.get_user_avatar(message.sender) # ใช้ helper ที่คุณมีใน models.py
-            }
-
-            # 3. 🔥 ส่งสัญญาณเข้า Channel Layer (Real-time Trigger)
+            # 2. 🔥 ส่งสัญญาณเข้า Channel Layer (Real-time Trigger)
+            # ทั้ง WebSocket (ChatConsumer) และ long-poll (get_new_messages) รับจากกลุ่มนี้
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
-                f'chat_{room.id}',  # ชื่อกลุ่มต้องตรงกับใน consumers.py
+                room_group_name(room.id),
                 {
                     'type': 'chat_message', # ชื่อฟังก์ชันใน consumers.py
-                    'message_data': message_data
+                    'message_data': message_payload(
+                        message, sender_avatar=participant_avatars(room, request_profiles(request))[request.user.id]
+                    )
                 }
             )
+            # ส่งงานหลัง broadcast ข้อความ เพื่อให้ event image_ready ตามหลังข้อความเสมอ
+            if image:
+                schedule_image_processing(message.id)
             
             # ตอบกลับ AJAX (Fallback)
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -72,41 +84,123 @@ def chat_room(request, room_id):
 
             return redirect('chat_room', room_id=room.id)
 
-    messages = room.messages.all().order_by('timestamp')
+    # แสดงเฉพาะข้อความล่าสุด ที่เก่ากว่านั้นโหลดผ่าน chat_history ตอนเลื่อนขึ้น
+    # เปิดห้อง = อ่านถึงข้อความล่าสุดแล้ว
+    cursors = {cursor.user_id: cursor for cursor in room.read_cursors.all()}
+    own_cursor = cursors.get(request.user.id)
+    if own_cursor and room.last_message_id and room.last_message_id > own_cursor.last_read_id:
+        if ReadCursor.mark_read(request.user.id, room.id, room.last_message_id):
+            async_to_sync(get_channel_layer().group_send)(
+                room_group_name(room.id), read_receipt_event(request.user.id, room.last_message_id)
+            )
+    other_id = room.seller_id if request.user.id == room.buyer_id else room.buyer_id
+    other_cursor = cursors.get(other_id)
+
+    # ชื่อ 'messages' ชนกับ django.contrib.messages ที่ base.html แสดงเป็น popup จึงใช้ 'chat_messages'
+    # ?around=<id> (จากผลค้นหา): หน้าที่จบที่ข้อความนั้น + หน้าถัดไป ที่ใหม่กว่านั้นโหลดตอนเลื่อนลง
+    around = parse_last_id(request.GET.get('around'))
+    profiles = request_profiles(request)
+    if around:
+        messages, has_more = message_history(room, before_id=around + 1, profiles=profiles)
+        newer, has_newer = message_history_after(room, around, profiles=profiles)
+        messages += newer
+    else:
+        messages, has_more = message_history(room, profiles=profiles)
+        has_newer = False
     return render(request, 'chat/room.html', {
         'room': room,
-        'messages': messages
+        'chat_messages': messages,
+        'has_more': has_more,
+        'has_newer': has_newer,
+        'jump_to': around,
+        'other_last_read_id': other_cursor.last_read_id if other_cursor else 0,
+        'chat_field_names': FIELD_NAMES,  # ถอดชื่อฟิลด์แบบย่อของ frame msgpack
+    })
+
+@login_required
+def chat_history(request, room_id):
+    """
+    ประวัติแชทย้อนหลังทีละหน้า: ?before=<id ของข้อความที่เก่าที่สุดที่มีอยู่>
+    หรือหน้าที่ใหม่กว่า: ?after=<id ของข้อความที่ใหม่ที่สุดที่มีอยู่> (หลังกระโดดไปยังข้อความจากผลค้นหา)
+    """
+    room = ChatRoom.objects.select_related(*ROOM_RELATED).filter(
+        Q(buyer=request.user) | Q(seller=request.user), id=room_id
+    ).first()
+    if room is None:
+        return JsonResponse({'messages': [], 'has_more': False}, status=403)
+
+    after = parse_last_id(request.GET.get('after'))
+    profiles = request_profiles(request)
+    if after:
+        messages, has_more = message_history_after(room, after, profiles=profiles)
+    else:
+        messages, has_more = message_history(
+            room, before_id=parse_last_id(request.GET.get('before')), profiles=profiles
+        )
+    return JsonResponse({
+        'messages': [message_payload(message, sender_avatar=message.sender_avatar) for message in messages],
+        'has_more': has_more,
     })
 
 @login_required
 def chat_list(request):
     # ดึงห้องแชทที่ "เรา" เป็นคนซื้อ (buyer) หรือ เป็นคนขาย (seller)
-    rooms = ChatRoom.objects.filter(
-        Q(buyer=request.user) | Q(seller=request.user)
-    ).order_by('-created_at')  # เรียงจากห้องที่สร้างล่าสุดก่อน
+    # พร้อมข้อความล่าสุด / ลำดับคิว / จำนวนที่ยังไม่อ่าน ใน query เดียว เรียงตามกิจกรรมล่าสุด
+    rooms = ChatRoom.objects.for_inbox(request.user)
     
     return render(request, 'chat/list.html', {
         'rooms': rooms  # ✅ สำคัญ: ต้องตั้งชื่อ key ว่า 'rooms' ให้ตรงกับ list.html
     })
 
 @login_required
-def get_new_messages(request, room_id):
-    last_id = request.GET.get('last_id', 0)
-    
-    new_messages = Message.objects.filter(
-        room_id=room_id, 
-        id__gt=last_id
-    ).order_by('timestamp')
-    
-    data = []
-    for msg in new_messages:
-        data.append({
-            'id': msg.id,
-            'sender_id': msg.sender.id,
-            'content': msg.content,
-            'image_url': msg.image.url if msg.image else None,
-            'timestamp': msg.timestamp.strftime('%H:%M'),
-            'sender_avatar': msg.sender_avatar_url # ใช้ Property ที่แก้ไปใน models
-        })
-        
-    return JsonResponse({'messages': data})
\ No newline at end of file
+def chat_search(request):
+    """ค้นข้อความในห้องแชทของเรา (?q=) หน้าถัดไป ?before=<id ของผลสุดท้าย> แต่ละผลลิงก์ไปยังข้อความในห้อง"""
+    query = request.GET.get('q', '').strip()
+    results, has_more = search_messages(request.user, query, before_id=parse_last_id(request.GET.get('before')))
+    return render(request, 'chat/search.html', {
+        'query': query,
+        'results': results,
+        'has_more': has_more,
+        'next_before': results[-1].id if has_more else None,
+    })
+
+@login_required
+async def get_new_messages(request, room_id):
+    """
+    Long-poll (สำรองสำหรับ browser ที่ใช้ WebSocket ไม่ได้):
+    ถ้ามีข้อความใหม่กว่า last_id ตอบทันที ไม่งั้นรอข้อความจาก channel layer ได้สูงสุด LONG_POLL_TIMEOUT วินาที
+    (รอบนกลุ่มเดียวกับ ChatConsumer โดยไม่ query ฐานข้อมูลซ้ำระหว่างรอ)
+    """
+    user = await request.auser()
+    if not await _is_participant(user, room_id):
+        return JsonResponse({'messages': []}, status=403)
+
+    channel_layer = get_channel_layer()
+    group = room_group_name(room_id)
+    channel_name = await channel_layer.new_channel()
+    # เข้ากลุ่มก่อน query เพื่อไม่ให้ข้อความที่ส่งมาระหว่างนั้นหลุดไป
+    await channel_layer.group_add(group, channel_name)
+    try:
+        last_id = parse_last_id(request.GET.get('last_id'))
+        data = await sync_to_async(messages_after)(room_id, last_id, request_profiles(request))
+        # กลุ่มมี event อื่นด้วย (presence / typing / read receipt) รอต่อจนกว่าจะได้ข้อความใหม่หรือหมดเวลา
+        deadline = asyncio.get_running_loop().time() + LONG_POLL_TIMEOUT
+        while not data:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(channel_layer.receive(channel_name), timeout)
+            except asyncio.TimeoutError:
+                break
+            if event.get('type') == 'chat_message' and event['message_data']['id'] > last_id:
+                data = [event['message_data']]
+    finally:
+        await channel_layer.group_discard(group, channel_name)
+
+    return JsonResponse({'messages': data})
+
+
+@sync_to_async
+def _is_participant(user, room_id):
+    return ChatRoom.objects.filter(Q(buyer=user) | Q(seller=user), id=room_id).exists()
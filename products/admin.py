@@ -2,16 +2,19 @@ from django.contrib import admin
 from django.contrib import messages
 from django.utils.html import format_html
 from .models import Product, Category, Report, ReportImage, VerificationRequest, Notification
+from .cache import bump_catalogue_version
 
 # --- Action Functions ---
 @admin.action(description="Mark selected products as Active (อนุมัติให้แสดง)")
 def make_active(modeladmin, request, queryset):
     queryset.update(status='active')
+    bump_catalogue_version()  # update() ไม่ส่ง signal
     messages.success(request, "Selected products have been marked as active.")
 
 @admin.action(description="Mark selected products as Pending (นำกลับไปรออนุมัติ)")
 def make_pending(modeladmin, request, queryset):
     queryset.update(status='pending')
+    bump_catalogue_version()
     messages.success(request, "Selected products have been marked as pending.")
 
 # --- Inlines ---
@@ -0,0 +1,43 @@
+import time
+
+from django.core.cache import cache
+
+# เลขเวอร์ชันของข้อมูลที่ถูก cache ไว้หลายจุด
+# cache ที่ขึ้นกับข้อมูลนั้นให้ใส่เลขนี้ใน key เมื่อข้อมูลเปลี่ยน เลขจะเพิ่มขึ้น
+# -> key เก่าหมดอายุไปเองโดยไม่ต้องลบทีละตัว
+# - catalogue: สินค้าที่กำลังขาย (facets, ผลค้นหา ฯลฯ)
+# - home_grid: การ์ดสินค้าใหม่ล่าสุดในหน้าแรก (สินค้า + ชื่อ/รูปของผู้ขาย)
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+HOME_GRID_VERSION_KEY = 'home_grid:version'
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # ใช้เวลาปัจจุบันเป็นค่าเริ่มต้น เพื่อไม่ให้ซ้ำกับเวอร์ชันเก่าถ้า key ถูก evict ไป
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return get_version(key)
+
+
+def catalogue_version():
+    return get_version(CATALOGUE_VERSION_KEY)
+
+
+def bump_catalogue_version():
+    return bump_version(CATALOGUE_VERSION_KEY)
+
+
+def home_grid_version():
+    return get_version(HOME_GRID_VERSION_KEY)
+
+
+def bump_home_grid_version():
+    return bump_version(HOME_GRID_VERSION_KEY)
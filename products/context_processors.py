@@ -1,8 +1,6 @@
-from .models import Notification
-
 def notifications(request):
     if request.user.is_authenticated:
-        # นับจำนวนแจ้งเตือนที่ยังไม่ได้อ่าน (is_read=False)
-        unread_count = Notification.objects.filter(recipient=request.user, is_read=False).count()
-        return {'unread_notification_count': unread_count}
-    return {}
\ No newline at end of file
+        # จำนวนแจ้งเตือนที่ยังไม่ได้อ่าน: ตัวนับใน UserProfile ที่ header โหลดอยู่แล้ว (ไม่ต้อง COUNT ทุกหน้า)
+        profile = getattr(request.user, 'profile', None)
+        return {'unread_notification_count': profile.unread_notifications if profile else 0}
+    return {}
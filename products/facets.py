@@ -0,0 +1,109 @@
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .cache import catalogue_version
+from .models import CONDITION_CHOICES
+
+# (key, ชื่อที่แสดง, ราคาต่ำสุด, ราคาสูงสุด [ไม่รวม])
+PRICE_BUCKETS = (
+    ('0-100', 'ต่ำกว่า ฿100', None, 100),
+    ('100-500', '฿100 - ฿500', 100, 500),
+    ('500-1000', '฿500 - ฿1,000', 500, 1000),
+    ('1000-5000', '฿1,000 - ฿5,000', 1000, 5000),
+    ('5000-', '฿5,000 ขึ้นไป', 5000, None),
+)
+FACET_CACHE_TIMEOUT = 60 * 10
+
+# ตัวเลือกการเรียงของหน้ารวมสินค้า (key ใน ?sort=, ชื่อที่แสดง, ordering)
+# ทุกแบบมี partial index (status = 'active') รองรับ ดู Product.Meta.indexes
+SORT_OPTIONS = (
+    ('newest', 'ใหม่ล่าสุด', ('-created_at', '-id')),
+    ('price_asc', 'ราคา: น้อย -> มาก', ('price', 'id')),
+    ('price_desc', 'ราคา: มาก -> น้อย', ('-price', '-id')),
+)
+SORT_ORDERING = {key: ordering for key, _, ordering in SORT_OPTIONS}
+
+
+def normalize_query(query):
+    return ' '.join((query or '').lower().split())
+
+
+def facet_cache_key(query, mode='search'):
+    digest = hashlib.sha1(normalize_query(query).encode()).hexdigest()
+    return f'facets:{mode}:v{catalogue_version()}:{digest}'
+
+
+def _parse_price(value):
+    try:
+        price = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def price_range_filter(params):
+    """
+    เงื่อนไขช่วงราคาจาก query string: ?price=<key ของ PRICE_BUCKETS> หรือ ?min_price=&max_price=
+    ค่าที่ไม่ถูกต้องจะถูกข้ามไป (คืนค่า Q() ว่าง ถ้าไม่ได้กรองราคา)
+    """
+    for key, _, low, high in PRICE_BUCKETS:
+        if params.get('price') == key:
+            return _price_filter(low, high)
+    condition = Q()
+    min_price = _parse_price(params.get('min_price'))
+    max_price = _parse_price(params.get('max_price'))
+    if min_price is not None:
+        condition &= Q(price__gte=min_price)
+    if max_price is not None:
+        condition &= Q(price__lte=max_price)
+    return condition
+
+
+def _price_filter(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+def compute_facets(queryset, category_ids):
+    """
+    นับจำนวนสินค้าแยกตามหมวดหมู่ / สภาพ / ช่วงราคา ด้วย aggregate query เดียว
+    (COUNT แบบมี FILTER -> สแกนผลลัพธ์รอบเดียว ไม่ต้อง GROUP BY ทีละมิติ)
+    """
+    aggregates = {'total': Count('id')}
+    for category_id in category_ids:
+        aggregates[f'category_{category_id}'] = Count('id', filter=Q(category_id=category_id))
+    for value, _ in CONDITION_CHOICES:
+        aggregates[f'condition_{value}'] = Count('id', filter=Q(condition=value))
+    for key, _, low, high in PRICE_BUCKETS:
+        aggregates[f'price_{key}'] = Count('id', filter=_price_filter(low, high))
+
+    row = queryset.order_by().aggregate(**aggregates)
+    return {
+        'total': row['total'],
+        'categories': {category_id: row[f'category_{category_id}'] for category_id in category_ids},
+        'conditions': {value: row[f'condition_{value}'] for value, _ in CONDITION_CHOICES},
+        'price_buckets': [
+            {'key': key, 'label': label, 'count': row[f'price_{key}']}
+            for key, label, _, _ in PRICE_BUCKETS
+        ],
+    }
+
+
+def get_facets(queryset, query, category_ids, mode='search'):
+    """
+    facets ของหน้ารวมสินค้า (ขึ้นกับคำค้นหา q เท่านั้น เพื่อให้เห็นจำนวนของหมวดอื่นด้วย)
+    cache ตามโหมดการค้นหา + คำค้นที่ normalize แล้ว + เวอร์ชันของแคตตาล็อก
+    """
+    key = facet_cache_key(query, mode)
+    facets = cache.get(key)
+    if facets is None or set(facets['categories']) != set(category_ids):
+        facets = compute_facets(queryset, category_ids)
+        cache.set(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
@@ -0,0 +1,96 @@
+import logging
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.functions import Cast
+
+# เกณฑ์เดียวกับค่าเริ่มต้นของ pg_trgm.similarity_threshold (ใช้กับ operator %)
+SIMILARITY_THRESHOLD = 0.3
+# จำนวนผลลัพธ์สูงสุดของโหมด pure-Python (ต้องอ่านชื่อสินค้าทั้งหมดมาเทียบ)
+PYTHON_FALLBACK_LIMIT = 60
+WORD_RE = re.compile(r'[^\W_]+')
+
+logger = logging.getLogger(__name__)
+
+_extension_installed = {}
+_warned_missing_extension = False
+
+
+def trigrams(text):
+    """
+    ชุด trigram แบบเดียวกับ pg_trgm: ตัวพิมพ์เล็ก แยกเป็นคำ แล้วเติมช่องว่างหน้า 2 ตัว หลัง 1 ตัว
+    เช่น "cat" -> {"  c", " ca", "cat", "at "}
+    """
+    grams = set()
+    for word in WORD_RE.findall((text or '').lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    """เหมือน similarity() ของ pg_trgm: trigram ที่ตรงกัน / trigram ทั้งหมดของสองข้อความ"""
+    left, right = trigrams(a), trigrams(b)
+    if not left or not right:
+        return 0.0
+    shared = len(left & right)
+    return shared / (len(left) + len(right) - shared)
+
+
+def has_trigram_extension():
+    """ตรวจว่าฐานข้อมูลติดตั้ง pg_trgm แล้วหรือยัง (ตรวจครั้งเดียวต่อ process)"""
+    if connection.vendor != 'postgresql':
+        return False
+    if connection.alias not in _extension_installed:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _extension_installed[connection.alias] = cursor.fetchone() is not None
+    return _extension_installed[connection.alias]
+
+
+def fuzzy_search_available():
+    """
+    ใช้ค้นหาแบบใกล้เคียงได้หรือไม่: มี pg_trgm หรือเปิด FUZZY_SEARCH_PYTHON_FALLBACK (ชุดทดสอบ)
+    ไม่มีทั้งสองอย่าง -> ข้ามไป (แจ้งใน log ครั้งเดียวต่อ process) แทนการอ่านชื่อสินค้าทั้งหมดทุกครั้งที่ค้นไม่เจอ
+    """
+    global _warned_missing_extension
+    if has_trigram_extension() or settings.FUZZY_SEARCH_PYTHON_FALLBACK:
+        return True
+    if not _warned_missing_extension:
+        _warned_missing_extension = True
+        logger.warning("ไม่มี extension pg_trgm ในฐานข้อมูล ปิดการค้นหาแบบใกล้เคียง (ดู migration 0019)")
+    return False
+
+
+def fuzzy_search(queryset, text):
+    """
+    ค้นหาสินค้าที่ชื่อใกล้เคียงกับคำค้น (พิมพ์ผิดได้) เรียงตามความคล้าย
+    - มี pg_trgm: ใช้ operator % (ผ่าน GIN index product_name_trgm) + similarity()
+    - ไม่มี: คำนวณ trigram ใน Python แล้วกรองด้วย id (เฉพาะเมื่อเปิด FUZZY_SEARCH_PYTHON_FALLBACK)
+    ผู้เรียกตรวจ fuzzy_search_available() ก่อน
+    """
+    if has_trigram_extension():
+        # similarity() คืนค่า real; cast เป็น double ให้เทียบกับค่าใน cursor ได้พอดี (เหมือน rank)
+        return queryset.filter(name__trigram_similar=text).annotate(
+            similarity=Cast(TrigramSimilarity('name', text), output_field=FloatField())
+        ).order_by('-similarity', '-created_at', '-id')
+    if not settings.FUZZY_SEARCH_PYTHON_FALLBACK:
+        return queryset.none()
+
+    scores = []
+    for pk, name in queryset.values_list('pk', 'name').iterator():
+        score = similarity(text, name)
+        if score >= SIMILARITY_THRESHOLD:
+            scores.append((score, pk))
+    scores = sorted(scores, reverse=True)[:PYTHON_FALLBACK_LIMIT]
+    if not scores:
+        return queryset.none()
+    return queryset.filter(pk__in=[pk for _, pk in scores]).annotate(
+        similarity=Case(
+            *[When(pk=pk, then=Value(score)) for score, pk in scores],
+            output_field=FloatField(),
+        )
+    ).order_by('-similarity', '-created_at', '-id')
@@ -0,0 +1,30 @@
+from django.db.models import Q
+
+from .models import Product
+
+# การ์ด "สินค้ามาใหม่ล่าสุด" ในหน้าแรก (cache เป็น fragment ใน home.html)
+HOME_GRID_SIZE = 8
+# การ์ดแสดงเวลาแบบ timesince จึงไม่ควร cache นานเกินไป แม้เวอร์ชันจะยังไม่เปลี่ยน
+HOME_GRID_TIMEOUT = 60
+
+
+def latest_products():
+    return Product.objects.filter(status='active').for_cards().order_by('-created_at', '-id')[:HOME_GRID_SIZE]
+
+
+def product_in_grid(product):
+    """
+    สินค้านี้อยู่ (หรือควรอยู่) ในตาราง HOME_GRID_SIZE ชิ้นล่าสุดหรือไม่
+    = มีสินค้า active ที่ใหม่กว่าไม่ถึง HOME_GRID_SIZE ชิ้น (index product_active_recent)
+    """
+    newer = Product.objects.filter(status='active').filter(
+        Q(created_at__gt=product.created_at) | Q(created_at=product.created_at, id__gt=product.pk)
+    ).exclude(pk=product.pk)
+    return newer[:HOME_GRID_SIZE].count() < HOME_GRID_SIZE
+
+
+def seller_in_grid(user_id):
+    seller_ids = Product.objects.filter(status='active').order_by(
+        '-created_at', '-id'
+    ).values_list('seller_id', flat=True)[:HOME_GRID_SIZE]
+    return user_id in set(seller_ids)
@@ -0,0 +1,70 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from products.models import Category, Product
+from products.related import related_products
+
+
+class Command(BaseCommand):
+    help = "วัดความเร็วการดึงสินค้าใกล้เคียง (ORDER BY random() เทียบกับ sample_key) บนข้อมูลจำลอง แล้ว rollback ทิ้ง"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-category', type=int, nargs='+', default=[10000, 100000])
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stderr.write("ต้องใช้ PostgreSQL")
+            return
+
+        self.stdout.write(f"{'products':>10}{'random() p50':>15}{'sample_key p50':>17}{'random() p95':>15}{'sample_key p95':>17}")
+        for rows in options['per_category']:
+            with transaction.atomic():
+                product = self._populate(rows)
+                legacy = Product.objects.filter(
+                    category=product.category, status='active'
+                ).exclude(id=product.id).order_by('?')[:4]
+                legacy_ms = self._time(lambda: list(legacy.all()), options['repeat'])
+                keyed_ms = self._time(lambda: related_products(product), options['repeat'])
+                self.stdout.write(
+                    f"{rows:>10,}{self._pct(legacy_ms, 50):>15.2f}{self._pct(keyed_ms, 50):>17.2f}"
+                    f"{self._pct(legacy_ms, 95):>15.2f}{self._pct(keyed_ms, 95):>17.2f}"
+                )
+                transaction.set_rollback(True)
+
+    def _populate(self, rows):
+        seller, _ = User.objects.get_or_create(username='__bench_related__')
+        category = Category.objects.create(name='__bench_related__')
+        batch = []
+        for i in range(rows):
+            batch.append(Product(
+                name=f'Item {i}', description='bench', price=Decimal(random.randint(10, 20000)),
+                seller=seller, category=category, status='active',
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+        return Product.objects.filter(category=category).first()
+
+    def _time(self, fetch, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fetch()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    @staticmethod
+    def _pct(values, pct):
+        if len(values) < 2:
+            return values[0]
+        return statistics.quantiles(values, n=100)[pct - 1]
@@ -0,0 +1,79 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from products.models import Product
+from products.search import build_document, search_products
+
+THAI_WORDS = ['หนังสือ', 'เรียน', 'โต๊ะ', 'เก้าอี้', 'พัดลม', 'รองเท้า', 'เสื้อ', 'กระเป๋า', 'มือสอง', 'สภาพดี', 'ราคาถูก', 'หอพัก']
+EN_WORDS = ['iphone', 'ipad', 'macbook', 'calculator', 'nike', 'adidas', 'lamp', 'desk', 'chair', 'python', 'guitar', 'monitor']
+QUERIES = ['iphone', 'หนังสือ', 'โต๊ะ', 'nike รองเท้า', 'เก้าอี้ หอพัก', 'zzzzqqq']
+
+
+class Command(BaseCommand):
+    help = "วัดความเร็วการค้นหาสินค้า (icontains เทียบกับ full-text search) บนข้อมูลจำลอง แล้ว rollback ทิ้ง"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stderr.write("ต้องใช้ PostgreSQL")
+            return
+
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self._populate(rng, options['rows'])
+            self.stdout.write(f"{'query':<16}{'icontains p50':>16}{'fts p50':>12}{'icontains p95':>16}{'fts p95':>12}{'hits':>8}")
+            base = Product.objects.filter(status='active')
+            for query in QUERIES:
+                legacy = base.filter(Q(name__icontains=query) | Q(description__icontains=query)).order_by('-created_at')[:60]
+                fts = search_products(base, query)[:60]
+                legacy_ms = self._time(legacy, options['repeat'])
+                fts_ms = self._time(fts, options['repeat'])
+                hits = search_products(base, query).count()
+                self.stdout.write(
+                    f"{query:<16}{self._pct(legacy_ms, 50):>16.2f}{self._pct(fts_ms, 50):>12.2f}"
+                    f"{self._pct(legacy_ms, 95):>16.2f}{self._pct(fts_ms, 95):>12.2f}{hits:>8}"
+                )
+            transaction.set_rollback(True)
+
+    def _populate(self, rng, rows):
+        seller, _ = User.objects.get_or_create(username='__bench_search__')
+        batch = []
+        for i in range(rows):
+            name = ' '.join(rng.sample(THAI_WORDS, 2) + rng.sample(EN_WORDS, 1))
+            description = ' '.join(rng.choices(THAI_WORDS + EN_WORDS, k=12))
+            batch.append(Product(
+                name=name, description=description, price=Decimal(rng.randint(10, 20000)),
+                seller=seller, status='active', search_vector=build_document(name, description),
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+        self.stdout.write(f"สร้างสินค้าจำลอง {rows:,} รายการ")
+
+    def _time(self, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(queryset.values_list('pk', flat=True))
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    @staticmethod
+    def _pct(values, pct):
+        if len(values) < 2:
+            return values[0]
+        return statistics.quantiles(values, n=100)[pct - 1]
@@ -0,0 +1,122 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from products.models import Category, Product
+
+# index ที่เพิ่มสำหรับ query ของ products.views (ดู Product.Meta.indexes)
+QUERY_INDEXES = (
+    'product_active_recent',
+    'product_active_cat_recent',
+    'product_active_price',
+    'product_active_cat_price',
+    'product_seller_recent',
+    'product_pending_recent',
+)
+
+
+def query_shapes(category, seller):
+    """query หลักของหน้าต่างๆ ใน products.views (ขนาดหน้า 24 + 1 แถวสำหรับตรวจหน้าถัดไป)"""
+    active = Product.objects.filter(status='active')
+    return [
+        ('home', active.order_by('-created_at', '-id')[:8]),
+        ('product_list_all', active.order_by('-created_at', '-id')[:25]),
+        ('product_list_all ?category', active.filter(category=category).order_by('-created_at', '-id')[:25]),
+        ('product_list_all ?price=500-1000&sort=price_asc',
+         active.filter(price__gte=500, price__lt=1000).order_by('price', 'id')[:25]),
+        ('product_list_all ?sort=price_desc', active.order_by('-price', '-id')[:25]),
+        ('product_list_all ?category&sort=price_asc', active.filter(category=category).order_by('price', 'id')[:25]),
+        ('seller_profile', active.filter(seller=seller).order_by('-created_at', '-id')[:25]),
+        ('my_listings', Product.objects.filter(seller=seller).order_by('-created_at', '-id')[:25]),
+        ('admin_dashboard pending', Product.objects.filter(status='pending').order_by('-created_at')),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "แสดง EXPLAIN ของ query สินค้าหลักๆ ก่อนและหลังเพิ่ม index บนข้อมูลจำลอง "
+        "ในฐานข้อมูลชั่วคราว <NAME>_explain ที่สร้างและลบทิ้งในคำสั่งนี้ (ไม่แตะตารางจริง) "
+        "ผู้ใช้ฐานข้อมูลต้องมีสิทธิ์ CREATEDB ถ้าไม่มีจะทำในฐานข้อมูลปัจจุบันภายใน transaction ที่ rollback ทิ้ง "
+        "(ระหว่างนั้น products_product ถูก lock ห้ามรันกับฐานข้อมูลที่ใช้งานอยู่)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000)
+        parser.add_argument('--analyze', action='store_true', help="ใช้ EXPLAIN ANALYZE (รัน query จริง)")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stderr.write("ต้องใช้ PostgreSQL")
+            return
+
+        # DROP INDEX ถือ ACCESS EXCLUSIVE lock ของตารางจนจบ transaction (ทุก EXPLAIN) และข้อมูลจำลองมีหลายหมื่นแถว
+        # จึงทำในฐานข้อมูลแยกที่ migrate ใหม่ ไม่ใช่ products_product ของฐานข้อมูลที่ใช้งานอยู่
+        if not self._can_create_database():
+            self.stderr.write(self.style.WARNING(
+                "ผู้ใช้ฐานข้อมูลไม่มีสิทธิ์ CREATEDB: ทำในฐานข้อมูลปัจจุบันแล้ว rollback ทิ้ง "
+                "(products_product ถูก lock จนจบคำสั่ง)"
+            ))
+            self._explain(options)
+            return
+
+        settings_dict = connection.settings_dict
+        original_name = settings_dict['NAME']
+        settings_dict.setdefault('TEST', {})['NAME'] = f'{original_name}_explain'
+        self.stdout.write(f"สร้างฐานข้อมูลชั่วคราว {settings_dict['TEST']['NAME']} ...")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._explain(options)
+        finally:
+            connection.creation.destroy_test_db(original_name, verbosity=0)
+
+    @staticmethod
+    def _can_create_database():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rolcreatedb OR rolsuper FROM pg_roles WHERE rolname = current_user')
+            return cursor.fetchone()[0]
+
+    def _explain(self, options):
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        with transaction.atomic():
+            category, seller = self._populate(options['rows'])
+            shapes = query_shapes(category, seller)
+
+            after = [queryset.explain(**explain_options) for _, queryset in shapes]
+            with connection.cursor() as cursor:
+                for name in QUERY_INDEXES:
+                    cursor.execute(f'DROP INDEX IF EXISTS {connection.ops.quote_name(name)}')
+            before = [queryset.explain(**explain_options) for _, queryset in shapes]
+
+            for (label, _), old_plan, new_plan in zip(shapes, before, after):
+                self.stdout.write(self.style.MIGRATE_HEADING(f'== {label}'))
+                self.stdout.write('-- ก่อน (ไม่มี index)')
+                self.stdout.write(old_plan)
+                self.stdout.write('-- หลัง')
+                self.stdout.write(new_plan)
+                self.stdout.write('')
+            transaction.set_rollback(True)
+
+    def _populate(self, rows):
+        rng = random.Random(42)
+        seller, _ = User.objects.get_or_create(username='__explain_products__')
+        sellers = [seller] + [
+            User.objects.create(username=f'__explain_products_{i}__') for i in range(50)
+        ]
+        categories = [Category.objects.create(name=f'__explain_{i}__') for i in range(10)]
+        batch = []
+        for i in range(rows):
+            batch.append(Product(
+                name=f'Item {i}', description='explain', price=Decimal(rng.randint(10, 20000)),
+                seller=rng.choice(sellers), category=rng.choice(categories),
+                status=rng.choices(['active', 'sold', 'pending'], weights=[80, 18, 2])[0],
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+        return categories[0], seller
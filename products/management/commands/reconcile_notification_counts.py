@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from products.models import Notification, UserProfile
+
+
+def unread_notifications():
+    """จำนวนแจ้งเตือนที่ยังไม่อ่านจริงของเจ้าของโปรไฟล์ (subquery ต่อแถวของ UserProfile)"""
+    unread = Notification.objects.filter(recipient=OuterRef('user_id'), is_read=False).order_by().values(
+        'recipient'
+    ).annotate(count=Count('id')).values('count')
+    return Coalesce(Subquery(unread, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = (
+        "ตรวจตัวนับแจ้งเตือนที่ยังไม่อ่าน (UserProfile.unread_notifications) เทียบกับตาราง Notification "
+        "และแก้ค่าที่คลาดเคลื่อน (--dry-run = แสดงอย่างเดียว)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="แสดงผู้ใช้ที่ค่าไม่ตรงโดยไม่แก้ไข")
+
+    def handle(self, *args, **options):
+        drifted = list(
+            UserProfile.objects.annotate(actual=unread_notifications())
+            .exclude(unread_notifications=F('actual'))
+            .order_by('user_id').values_list('user_id', 'user__username', 'unread_notifications', 'actual')
+        )
+        for user_id, username, stored, actual in drifted:
+            self.stdout.write(f"{username} (id={user_id}): {stored:,} -> {actual:,}")
+
+        if drifted and not options['dry_run']:
+            # นับใหม่ใน UPDATE เลย ไม่ใช้ค่าที่อ่านไว้ด้านบน (อาจมีแจ้งเตือนใหม่เข้ามาระหว่างนั้น)
+            UserProfile.objects.filter(user_id__in=[row[0] for row in drifted]).update(
+                unread_notifications=unread_notifications()
+            )
+        action = "พบ" if options['dry_run'] else "แก้ไข"
+        self.stdout.write(f"{action}ตัวนับที่คลาดเคลื่อน {len(drifted):,} โปรไฟล์")
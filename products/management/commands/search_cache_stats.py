@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from products.search_cache import reset_search_cache_stats, search_cache_stats
+
+
+class Command(BaseCommand):
+    help = "แสดงสถิติ hit/miss ของ cache ผลค้นหาสินค้า (products/search_cache.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="ล้างตัวนับหลังแสดงผล")
+
+    def handle(self, *args, **options):
+        stats = search_cache_stats()
+        for name, value in stats.items():
+            if name == 'hit_ratio':
+                self.stdout.write(f"{name:<10}{value:>10.1%}")
+            else:
+                self.stdout.write(f"{name:<10}{value:>10,}")
+        if options['reset']:
+            reset_search_cache_stats()
+            self.stdout.write("ล้างตัวนับแล้ว")
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:34
+
+import re
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+# แถวต่อ 1 UPDATE
+BATCH_SIZE = 1000
+
+# ตัดคำแบบเดียวกับ products.search ณ ตอนสร้าง migration นี้ (คัดลอกมา: migration ต้องไม่ขึ้นกับโค้ดที่เปลี่ยนภายหลัง)
+THAI_RUN_RE = re.compile(r'[\u0E00-\u0E7F]+')
+TOKEN_RE = re.compile(r'[\u0E00-\u0E7F]+|[^\W_\u0E00-\u0E7F]+')
+MAX_POSITION = 16383
+MAX_POSITIONS_PER_LEXEME = 256
+
+
+def tokenize(text):
+    groups = []
+    for run in TOKEN_RE.findall((text or '').lower()):
+        if THAI_RUN_RE.fullmatch(run) and len(run) > 1:
+            groups.append([run[i:i + 2] for i in range(len(run) - 1)])
+        else:
+            groups.append([run])
+    return groups
+
+
+def build_document(name, description):
+    # = products.search.build_document: ชื่อน้ำหนัก A รายละเอียดน้ำหนัก B
+    positions = {}
+    position = 0
+    for text, weight in ((name, 'A'), (description, 'B')):
+        for group in tokenize(text):
+            for token in group:
+                position += 1
+                slots = positions.setdefault(token, [])
+                if position <= MAX_POSITION and len(slots) < MAX_POSITIONS_PER_LEXEME:
+                    slots.append(f'{position}{weight}')
+            position += 1
+        position += 1
+    return ' '.join(
+        f"'{token}':{','.join(slots)}" if slots else f"'{token}'"
+        for token, slots in positions.items()
+    )
+
+
+def populate_search_vector(apps, schema_editor):
+    """ไล่สินค้าตาม id ทีละ BATCH_SIZE แล้วเขียน search_vector ของทั้งชุดด้วย UPDATE ... FROM (VALUES ...) เดียว"""
+    Product = apps.get_model('products', 'Product')
+    table = schema_editor.quote_name(Product._meta.db_table)
+    last_pk = 0
+    while True:
+        rows = list(
+            Product.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'name', 'description')[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} AS t SET search_vector = v.document::tsvector "
+                f"FROM (VALUES {', '.join(['(%s, %s)'] * len(rows))}) AS v(id, document) "
+                f"WHERE t.id = v.id",
+                [param for pk, name, description in rows for param in (pk, build_document(name, description))],
+            )
+        last_pk = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_chatroom_message_notification_verificationrequest'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_gin'),
+        ),
+        migrations.RunPython(populate_search_vector, migrations.RunPython.noop),
+    ]
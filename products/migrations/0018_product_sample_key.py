@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:56
+
+import products.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+def randomize_sample_key(apps, schema_editor):
+    # AddField ใส่ค่า default ค่าเดียวให้ทุกแถว จึงต้องสุ่มใหม่: random() ของ PostgreSQL คำนวณแยกทุกแถวใน UPDATE เดียว
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(sample_key=models.Func(function='random', output_field=models.FloatField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_product_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sample_key',
+            field=models.FloatField(default=products.models.random_sample_key, editable=False),
+        ),
+        migrations.RunPython(randomize_sample_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['category', 'sample_key'], name='product_related_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    # pg_trgm เป็น extension เสริม: ถ้าเซิร์ฟเวอร์ไม่มีให้ติดตั้ง ให้ข้ามไป (ปิด fuzzy search ยกเว้นเปิด FUZZY_SEARCH_PYTHON_FALLBACK ดู products.fuzzy)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS product_name_trgm ON products_product "
+        "USING gin (name gin_trgm_ops) WHERE status = 'active'"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS product_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_product_sample_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
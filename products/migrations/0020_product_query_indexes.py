@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_product_name_trigram_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['-created_at', '-id'], name='product_active_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['category', '-created_at', '-id'], name='product_active_cat_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['price', 'id'], name='product_active_price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['category', 'price', 'id'], name='product_active_cat_price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['seller', '-created_at', '-id'], name='product_seller_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-created_at'], name='product_pending_recent'),
+        ),
+    ]
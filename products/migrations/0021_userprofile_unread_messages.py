@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_product_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='unread_messages',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
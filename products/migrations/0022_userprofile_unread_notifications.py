@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:22
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_unread_notifications(apps, schema_editor):
+    Notification = apps.get_model('products', 'Notification')
+    UserProfile = apps.get_model('products', 'UserProfile')
+    unread = Notification.objects.filter(recipient=OuterRef('user_id'), is_read=False).order_by().values(
+        'recipient'
+    ).annotate(count=Count('id')).values('count')
+    UserProfile.objects.update(
+        unread_notifications=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0021_userprofile_unread_messages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_unread_notifications, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,13 @@
-from django.db import models
+import random
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 class Category(models.Model):
@@ -41,6 +47,25 @@ STATUS_CHOICES = (
 # ----------------------------------------------------
 
 
+def random_sample_key():
+    return random.random()
+
+
+class ProductQuerySet(models.QuerySet):
+    # คอลัมน์ที่การ์ดสินค้า / แถวในรายการสินค้าใช้ (partials/product_card.html, my_listings, wishlist,
+    # seller_profile) และ page_json; ถ้า template ใช้ฟิลด์เพิ่ม ต้องเพิ่มที่นี่ด้วย ไม่งั้นจะ query ทีละแถว
+    CARD_FIELDS = (
+        'id', 'name', 'description', 'image', 'price', 'condition', 'status', 'created_at',
+        'seller__id', 'seller__username',
+        'seller__profile__id', 'seller__profile__avatar', 'seller__profile__display_name',
+        'category__id', 'category__name', 'category__icon',
+    )
+
+    def for_cards(self):
+        """ดึงสินค้าพร้อมผู้ขาย/โปรไฟล์/หมวดหมู่ใน query เดียว เฉพาะคอลัมน์ที่การ์ดใช้"""
+        return self.select_related('seller__profile', 'category').only(*self.CARD_FIELDS)
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200, verbose_name="ชื่อสินค้า")
     image = models.ImageField(upload_to='product_images/', null=True, blank=True, verbose_name="รูปภาพสินค้า")
@@ -53,10 +78,51 @@ class Product(models.Model):
     favorites = models.ManyToManyField(User, related_name='favorite_products', blank=True, verbose_name="ผู้ที่กดถูกใจ")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # ดัชนีค้นหา (ชื่อ = น้ำหนัก A, รายละเอียด = น้ำหนัก B) อัปเดตโดย signal ใน products/signals.py
+    search_vector = SearchVectorField(null=True, editable=False)
+    # ลำดับสุ่มที่คำนวณไว้ล่วงหน้า สำหรับ "สินค้าใกล้เคียง" (products/related.py) แทน ORDER BY random()
+    sample_key = models.FloatField(default=random_sample_key, editable=False)
     # meeting_point = models.CharField(max_length=100, blank=True, null=True, verbose_name="จุดนัดรับ")
     # view_count = models.PositiveIntegerField(default=0, verbose_name="จำนวนคนดู")
     # is_reserved = models.BooleanField(default=False, verbose_name="ติดจอง")
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_gin'),
+            models.Index(
+                fields=['category', 'sample_key'], name='product_related_idx',
+                condition=models.Q(status='active'),
+            ),
+            # หน้าแรก / สินค้าทั้งหมด (เรียงใหม่สุด)
+            models.Index(
+                fields=['-created_at', '-id'], name='product_active_recent',
+                condition=models.Q(status='active'),
+            ),
+            # สินค้าทั้งหมด กรองหมวดหมู่
+            models.Index(
+                fields=['category', '-created_at', '-id'], name='product_active_cat_recent',
+                condition=models.Q(status='active'),
+            ),
+            # สินค้าทั้งหมด กรอง/เรียงตามราคา (สแกนย้อนกลับได้สำหรับราคามาก -> น้อย)
+            models.Index(
+                fields=['price', 'id'], name='product_active_price',
+                condition=models.Q(status='active'),
+            ),
+            models.Index(
+                fields=['category', 'price', 'id'], name='product_active_cat_price',
+                condition=models.Q(status='active'),
+            ),
+            # ร้านค้าของผู้ขาย / สินค้าของฉัน
+            models.Index(fields=['seller', '-created_at', '-id'], name='product_seller_recent'),
+            # หน้า admin dashboard (สินค้ารออนุมัติ)
+            models.Index(
+                fields=['-created_at'], name='product_pending_recent',
+                condition=models.Q(status='pending'),
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -67,9 +133,33 @@ class UserProfile(models.Model):
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
     bio = models.TextField(blank=True, null=True)
+    # จำนวนข้อความแชทที่ยังไม่อ่านรวมทุกห้อง (badge ใน header) ดูแลโดย chat.models.ReadCursor
+    unread_messages = models.PositiveIntegerField(default=0, editable=False)
+    # จำนวนแจ้งเตือนที่ยังไม่อ่าน (badge ใน header) ดูแลโดย Notification.save / notifications_view
+    # ค่าคลาดเคลื่อนแก้ได้ด้วยคำสั่ง reconcile_notification_counts
+    unread_notifications = models.PositiveIntegerField(default=0, editable=False)
+
+    # ตัวนับที่อัปเดตด้วย UPDATE ... F() เท่านั้น
+    COUNTER_FIELDS = ('unread_messages', 'unread_notifications')
 
     def __str__(self):
         return self.user.username
+
+    @classmethod
+    def adjust_unread_notifications(cls, user_id, delta):
+        if delta:
+            cls.objects.filter(user_id=user_id).update(
+                unread_notifications=Greatest(F('unread_notifications') + delta, 0)
+            )
+
+    def save(self, *args, **kwargs):
+        # save() ปกติ (เช่นฟอร์มแก้ไขโปรไฟล์) ไม่เขียนตัวนับทับ เพราะค่าใน instance อาจเก่าแล้ว
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
     
 class Review(models.Model):
     reviewer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews_given')
@@ -185,6 +275,29 @@ class Notification(models.Model):
     class Meta:
         ordering = ['-created_at']
 
+    def save(self, *args, **kwargs):
+        # แจ้งเตือนใหม่: เพิ่มตัวนับของผู้รับใน transaction เดียวกัน (header ไม่ต้อง COUNT ทุกหน้า)
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not self.is_read:
+                UserProfile.adjust_unread_notifications(self.recipient_id, 1)
+
+    @classmethod
+    def mark_all_read(cls, user):
+        """อ่านแจ้งเตือนทั้งหมดของ user แล้ว ลดตัวนับตามจำนวนที่เปลี่ยนจริง (แจ้งเตือนที่เข้ามาพร้อมกันยังนับอยู่)"""
+        with transaction.atomic():
+            marked = cls.objects.filter(recipient=user, is_read=False).update(is_read=True)
+            UserProfile.adjust_unread_notifications(user.id, -marked)
+        return marked
+
+
+@receiver(post_delete, sender=Notification)
+def remove_unread_notification(sender, instance, **kwargs):
+    if not instance.is_read:
+        UserProfile.adjust_unread_notifications(instance.recipient_id, -1)
+
 # --- Signals สำหรับสร้างแจ้งเตือนอัตโนมัติ ---
 @receiver(post_save, sender=Product)
 def notify_product_status(sender, instance, created, **kwargs):
@@ -0,0 +1,186 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.urls import reverse
+
+PER_PAGE = 24
+CURSOR_PARAM = 'cursor'
+
+
+def _encode_value(value):
+    # isoformat() เก็บ microsecond ครบ (DjangoJSONEncoder ตัดเหลือ millisecond ซึ่งทำให้ cursor เพี้ยน)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """แปลง token กลับเป็น list ของค่า หรือ None ถ้า token ไม่ถูกต้อง"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def get_ordering(queryset):
+    """
+    คืนค่า ordering ของ queryset ในรูป [(ชื่อฟิลด์, descending)] โดยต่อท้ายด้วย id เสมอ
+    เพื่อให้ลำดับไม่ซ้ำกัน (จำเป็นสำหรับ keyset pagination)
+    """
+    ordering = []
+    for item in queryset.query.order_by or ('-created_at',):
+        if not isinstance(item, str) or '__' in item or item == '?':
+            raise ValueError(f"keyset pagination ไม่รองรับการเรียงแบบ {item!r}")
+        descending = item.startswith('-')
+        name = item.lstrip('-')
+        ordering.append(('id' if name == 'pk' else name, descending))
+    if ordering[-1][0] != 'id':
+        ordering.append(('id', ordering[-1][1]))
+    return ordering
+
+
+def keyset_filter(ordering, values):
+    """
+    สร้างเงื่อนไข "อยู่หลัง cursor" เช่น ordering (-created_at, -id):
+    created_at < v0 OR (created_at = v0 AND id < v1)
+    """
+    condition = Q()
+    for i, (name, descending) in enumerate(ordering):
+        lookup = 'lt' if descending else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[i]})
+        for j in range(i):
+            step &= Q(**{ordering[j][0]: values[j]})
+        condition |= step
+    return condition
+
+
+class KeysetPage:
+    """หน้าหนึ่งของผลลัพธ์ ใช้ใน template ได้เหมือน list (for/if/length)"""
+
+    def __init__(self, object_list, next_cursor, request=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.request = request
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def next_url(self):
+        """query string ของหน้าถัดไป (คงตัวกรองเดิม เช่น q, category ไว้)"""
+        if not self.has_next or self.request is None:
+            return None
+        params = self.request.GET.copy()
+        params[CURSOR_PARAM] = self.next_cursor
+        return f'?{params.urlencode()}'
+
+
+def paginate_keyset(request, queryset, per_page=PER_PAGE):
+    """
+    แบ่งหน้าแบบ cursor ตามลำดับของ queryset (เช่น -created_at, -id)
+    ทุกหน้าใช้ index seek + LIMIT เดียวกัน ไม่ว่าจะเลื่อนลึกแค่ไหน (ไม่มี OFFSET)
+    """
+    ordering = get_ordering(queryset)
+    queryset = queryset.order_by(*[('-' if desc else '') + name for name, desc in ordering])
+
+    values = decode_cursor(request.GET.get(CURSOR_PARAM), len(ordering))
+    if values is not None:
+        try:
+            queryset = queryset.filter(keyset_filter(ordering, values))
+        except (ValidationError, ValueError, TypeError):
+            # cursor ถูกแก้ไขมา -> เริ่มหน้าแรกใหม่
+            pass
+
+    rows = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([getattr(rows[-1], name) for name, _ in ordering])
+    return KeysetPage(rows, next_cursor, request)
+
+
+def paginate_ids(request, ids, queryset, per_page=PER_PAGE):
+    """
+    แบ่งหน้าจาก list ของ id ที่เรียงไว้แล้ว (เช่นผลค้นหาที่ cache ไว้)
+    cursor = [ตำแหน่งถัดไป, id สุดท้ายของหน้าก่อน] ถ้า list เปลี่ยนไปแล้ว จะหาต่อจาก id นั้นแทน
+    """
+    start = 0
+    values = decode_cursor(request.GET.get(CURSOR_PARAM), 2)
+    if values is not None:
+        position, last_id = values
+        if isinstance(position, int) and 0 < position <= len(ids) and ids[position - 1] == last_id:
+            start = position
+        elif last_id in ids:
+            start = ids.index(last_id) + 1
+
+    page_ids = ids[start:start + per_page]
+    rows = queryset.in_bulk(page_ids)
+    next_cursor = None
+    if start + per_page < len(ids):
+        next_cursor = encode_cursor([start + per_page, page_ids[-1]])
+    # สินค้าที่ไม่อยู่ใน queryset แล้ว (เช่นขายไประหว่างที่ cache ยังไม่หมดอายุ) จะหายไปจากหน้า
+    return KeysetPage([rows[pk] for pk in page_ids if pk in rows], next_cursor, request)
+
+
+def first_page_count(request, queryset):
+    """
+    จำนวนผลลัพธ์ทั้งหมด นับเฉพาะหน้าแรก (None เมื่อเปิดผ่าน cursor)
+    COUNT ต้องสแกนทั้งชุด หน้าถัดไปจึงไม่นับซ้ำ ต้นทุนต่อหน้าคงที่ไม่ว่าจะเลื่อนลึกแค่ไหน
+    """
+    if request.GET.get(CURSOR_PARAM):
+        return None
+    return queryset.count()
+
+
+def wants_json(request):
+    return request.GET.get('format') == 'json'
+
+
+def page_json(page):
+    """ผลลัพธ์แบบ JSON สำหรับ infinite scroll"""
+    return {
+        'results': [
+            {
+                'id': product.id,
+                'name': product.name,
+                'price': str(product.price),
+                'condition': product.condition,
+                'status': product.status,
+                'image_url': product.image.url if product.image else None,
+                'url': reverse('product_detail', args=[product.pk]),
+                'seller_id': product.seller_id,
+                'created_at': product.created_at.isoformat(),
+            }
+            for product in page
+        ],
+        'next_cursor': page.next_cursor,
+        'next_url': page.next_url,
+    }
@@ -0,0 +1,23 @@
+import random
+
+from .models import Product
+
+RELATED_LIMIT = 4
+
+
+def related_products(product, limit=RELATED_LIMIT):
+    """
+    สุ่มสินค้าในหมวดเดียวกันโดยไม่ใช้ ORDER BY random() (ซึ่งต้อง sort สินค้าทั้งหมวดทุกครั้ง)
+    สินค้าแต่ละชิ้นมี sample_key สุ่มไว้ตั้งแต่สร้าง -> สุ่มจุดเริ่ม แล้วอ่านต่อจาก index
+    (category, sample_key) WHERE status = 'active' ไม่เกิน limit แถว (วนกลับไปต้นถ้าไม่พอ)
+    สินค้าที่อนุมัติ/ขายแล้วจะเข้า/ออกจาก partial index เองเมื่อ status เปลี่ยน
+    """
+    candidates = Product.objects.filter(
+        category_id=product.category_id, status='active'
+    ).exclude(pk=product.pk).for_cards().order_by('sample_key')
+
+    pivot = random.random()
+    items = list(candidates.filter(sample_key__gte=pivot)[:limit])
+    if len(items) < limit:
+        items += candidates.filter(sample_key__lt=pivot)[:limit - len(items)]
+    return items
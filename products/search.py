@@ -0,0 +1,120 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Cast
+
+# ภาษาไทยไม่มีช่องว่างระหว่างคำ จึงตัดเป็น bigram ของตัวอักษรแทนการตัดคำ
+THAI_RUN_RE = re.compile(r'[\u0E00-\u0E7F]+')
+TOKEN_RE = re.compile(r'[\u0E00-\u0E7F]+|[^\W_\u0E00-\u0E7F]+')
+
+# ข้อจำกัดของ tsvector ใน PostgreSQL
+MAX_POSITION = 16383
+MAX_POSITIONS_PER_LEXEME = 256
+
+
+def _thai_bigrams(run):
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def tokenize(text):
+    """
+    แยกข้อความเป็นกลุ่มของ token (คืนค่าเป็น list ของ list)
+    - ภาษาไทย: 1 ช่วงตัวอักษร -> bigram ต่อเนื่องกัน เช่น "หนังสือ" -> หน, นั, ัง, ...
+    - ภาษาอื่น: 1 คำ -> 1 token (ตัวพิมพ์เล็ก)
+    """
+    groups = []
+    for run in TOKEN_RE.findall((text or '').lower()):
+        if THAI_RUN_RE.fullmatch(run):
+            groups.append(_thai_bigrams(run))
+        else:
+            groups.append([run])
+    return groups
+
+
+def build_document(name, description):
+    """
+    สร้าง tsvector (ในรูป literal string) จากชื่อ (น้ำหนัก A) และรายละเอียด (น้ำหนัก B)
+    ใส่ตำแหน่งของ token ไว้ด้วย เพื่อให้ค้นหาภาษาไทยแบบติดกัน (<->) ได้
+    """
+    positions = {}
+    position = 0
+    for text, weight in ((name, 'A'), (description, 'B')):
+        for group in tokenize(text):
+            for token in group:
+                position += 1
+                slots = positions.setdefault(token, [])
+                if position <= MAX_POSITION and len(slots) < MAX_POSITIONS_PER_LEXEME:
+                    slots.append(f'{position}{weight}')
+            # เว้นตำแหน่งระหว่างคำ เพื่อไม่ให้ bigram ข้ามคำกันเอง
+            position += 1
+        position += 1
+    return ' '.join(
+        f"'{token}':{','.join(slots)}" if slots else f"'{token}'"
+        for token, slots in positions.items()
+    )
+
+
+def build_lexemes(texts):
+    """
+    tsvector (literal string) ที่มีแต่ lexeme ไม่มีตำแหน่ง จากข้อความหลายชิ้นรวมกัน
+    ใช้เป็นตัวกรองคร่าวๆ ของกลุ่มข้อความ (ต้องค้นด้วย build_query(..., phrase=False))
+    """
+    lexemes = dict.fromkeys(token for text in texts for group in tokenize(text) for token in group)
+    return ' '.join(f"'{token}'" for token in lexemes)
+
+
+def build_query(text, phrase=True):
+    """
+    แปลงคำค้นหาเป็น tsquery (literal string) หรือ None ถ้าไม่มี token ที่ใช้ได้
+    - คำภาษาไทย: bigram ต้องอยู่ติดกัน ('หน' <-> 'นั' <-> ...)
+      phrase=False: แค่ต้องมีครบทุก bigram (สำหรับ tsvector ที่ไม่มีตำแหน่ง ซึ่ง <-> ไม่ match เลย)
+    - คำภาษาอื่น: ค้นแบบขึ้นต้นด้วย ('iphone':*)
+    """
+    joiner = ' <-> ' if phrase else ' & '
+    parts = []
+    for group in tokenize(text):
+        if len(group) == 1:
+            parts.append(f"'{group[0]}':*")
+        else:
+            parts.append('(' + joiner.join(f"'{token}'" for token in group) + ')')
+    if not parts:
+        return None
+    return ' & '.join(parts)
+
+
+class LexemeQuery(SearchQuery):
+    """tsquery ที่สร้างจาก lexeme ตรงๆ (ไม่ผ่าน parser ของ PostgreSQL ซึ่งตัดคำไทยไม่เป็น)"""
+    template = '%(expressions)s::tsquery'
+
+
+def document_expression(name, description):
+    return Cast(Value(build_document(name, description)), output_field=SearchVectorField())
+
+
+def update_search_vector(product):
+    """อัปเดต search_vector ของสินค้า 1 ชิ้น (ใช้ update เพื่อไม่ให้ signal post_save ทำงานซ้ำ)"""
+    if connection.vendor != 'postgresql':
+        return
+    type(product).objects.filter(pk=product.pk).update(
+        search_vector=document_expression(product.name, product.description)
+    )
+
+
+def search_products(queryset, text):
+    """
+    กรองและเรียงสินค้าตามความเกี่ยวข้องด้วย full-text search (GIN index)
+    ถ้าฐานข้อมูลไม่ใช่ PostgreSQL หรือคำค้นไม่มีตัวอักษร จะใช้ icontains แบบเดิม
+    """
+    tsquery = build_query(text)
+    if connection.vendor != 'postgresql' or tsquery is None:
+        return queryset.filter(Q(name__icontains=text) | Q(description__icontains=text))
+
+    query = LexemeQuery(tsquery)
+    # ts_rank คืนค่า real; cast เป็น double เพื่อให้ค่าใน cursor ของ keyset pagination เทียบเท่ากันได้พอดี
+    return queryset.filter(search_vector=query).annotate(
+        rank=Cast(SearchRank(F('search_vector'), query), output_field=FloatField())
+    ).order_by('-rank', '-created_at', '-id')
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+
+from .cache import catalogue_version
+from .facets import normalize_query
+
+# ผลค้นหาที่ cache ไว้เป็น list ของ id ตามลำดับ (คำยอดนิยมอย่าง "iphone", "หนังสือ" ไม่ต้อง query ซ้ำ)
+# - สดอยู่ SEARCH_CACHE_TIMEOUT วินาที และต้องเป็นเวอร์ชันแคตตาล็อกปัจจุบัน
+# - หลังจากนั้นเก็บไว้อีก SEARCH_CACHE_STALE_TIMEOUT เพื่อตอบแทนระหว่างที่ worker หนึ่งคำนวณใหม่
+SEARCH_CACHE_TIMEOUT = 60 * 5
+SEARCH_CACHE_STALE_TIMEOUT = 60 * 30
+# ผลลัพธ์ที่ยาวกว่านี้ไม่ cache (ใช้ keyset pagination กับ DB ตามปกติ)
+MAX_CACHED_RESULTS = 2000
+LOCK_TIMEOUT = 10
+# ถ้ายังไม่มีค่าเก่าให้ตอบ รอ worker ที่ถือ lock ได้สูงสุด LOCK_WAIT_STEPS x LOCK_WAIT_INTERVAL วินาที
+LOCK_WAIT_STEPS = 20
+LOCK_WAIT_INTERVAL = 0.05
+
+STATS_KEY_PREFIX = 'search_cache:stats:'
+# hit = ค่าสด, stale = ตอบด้วยค่าเก่าระหว่างคำนวณใหม่, miss = ต้องคำนวณเอง,
+# wait = รอ worker อื่นคำนวณเสร็จ, skip = ผลลัพธ์ยาวเกินกว่าจะ cache
+STATS = ('hit', 'stale', 'miss', 'wait', 'skip')
+TOO_MANY = 'too_many'
+
+
+def search_cache_key(query, *params):
+    """key จากคำค้นที่ normalize แล้ว + ตัวกรอง/การเรียง (ไม่รวมเวอร์ชัน ซึ่งเก็บไว้ในค่าแทน)"""
+    raw = json.dumps([normalize_query(query), *[p or '' for p in params]], ensure_ascii=False)
+    return 'search:' + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _count(stat):
+    key = STATS_KEY_PREFIX + stat
+    try:
+        cache.incr(key)
+    except ValueError:
+        # key ยังไม่มี (หรือถูก evict): add กันไม่ให้ทับค่าที่ worker อื่นเพิ่งสร้าง
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def search_cache_stats():
+    values = cache.get_many([STATS_KEY_PREFIX + stat for stat in STATS])
+    stats = {stat: values.get(STATS_KEY_PREFIX + stat, 0) for stat in STATS}
+    lookups = stats['hit'] + stats['stale'] + stats['miss'] + stats['wait']
+    stats['hit_ratio'] = (stats['hit'] + stats['stale']) / lookups if lookups else 0.0
+    return stats
+
+
+def reset_search_cache_stats():
+    cache.delete_many([STATS_KEY_PREFIX + stat for stat in STATS])
+
+
+def _is_fresh(entry, version):
+    return entry is not None and entry['version'] == version and entry['expires'] > time.time()
+
+
+def _compute(key, version, compute):
+    ids = list(compute()[:MAX_CACHED_RESULTS + 1])
+    if len(ids) > MAX_CACHED_RESULTS:
+        ids = TOO_MANY
+    cache.set(key, {
+        'version': version,
+        'expires': time.time() + SEARCH_CACHE_TIMEOUT,
+        'ids': ids,
+    }, SEARCH_CACHE_TIMEOUT + SEARCH_CACHE_STALE_TIMEOUT)
+    return ids
+
+
+def _result(ids, stat):
+    _count('skip' if ids == TOO_MANY else stat)
+    return None if ids == TOO_MANY else ids
+
+
+def cached_result_ids(key, compute):
+    """
+    คืนค่า list ของ id ตามลำดับผลค้นหา หรือ None ถ้าผลลัพธ์ยาวเกิน MAX_CACHED_RESULTS
+    compute() ต้องคืนค่า queryset ของ id (values_list) ที่เรียงแล้ว
+
+    กันการคำนวณซ้ำพร้อมกัน (stampede): มีแค่ worker ที่ได้ lock เท่านั้นที่คำนวณใหม่
+    worker อื่นตอบด้วยค่าเก่า (ถ้ามี) หรือรอสักครู่ให้ค่าใหม่เสร็จ
+    """
+    version = catalogue_version()
+    entry = cache.get(key)
+    if _is_fresh(entry, version):
+        return _result(entry['ids'], 'hit')
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            return _result(_compute(key, version, compute), 'miss')
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        # ค่าเก่าอาจมีสินค้าที่ขายไปแล้ว แต่หน้าเว็บดึงสินค้าด้วย status='active' อีกชั้นอยู่แล้ว
+        return _result(entry['ids'], 'stale')
+
+    for _ in range(LOCK_WAIT_STEPS):
+        time.sleep(LOCK_WAIT_INTERVAL)
+        entry = cache.get(key)
+        if _is_fresh(entry, version):
+            return _result(entry['ids'], 'wait')
+    return _result(_compute(key, version, compute), 'miss')
@@ -1,8 +1,13 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
 from django.contrib.auth.models import User
 from django.dispatch import receiver
 from allauth.account.signals import user_signed_up
-from .models import UserProfile
+from .models import UserProfile, Product
+from .search import update_search_vector
+from .suggestions import suggestion_index
+from .cache import bump_catalogue_version, bump_home_grid_version
+from .home_grid import product_in_grid, seller_in_grid
 
 # 1. เมื่อสมัครผ่าน Social Login (Google)
 @receiver(user_signed_up)
@@ -34,4 +39,60 @@ def save_user_profile(sender, instance, created, **kwargs):
         full_name = instance.get_full_name().strip()
         if full_name:
             profile.display_name = full_name
-            profile.save()
\ No newline at end of file
+            profile.save()
+
+# 3. เมื่อมีการบันทึกสินค้า -> อัปเดตดัชนีค้นหา (search_vector)
+@receiver(post_save, sender=Product)
+def refresh_product_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'name', 'description'} & set(update_fields):
+        return
+    update_search_vector(instance)
+
+
+# 4. อัปเดตดัชนี autocomplete (suggestion_index) ของ process นี้
+@receiver(post_save, sender=Product)
+def refresh_suggestion_index(sender, instance, **kwargs):
+    if instance.status == 'active':
+        suggestion_index.add(instance.pk, instance.name)
+    else:
+        suggestion_index.remove(instance.pk)
+
+@receiver(post_delete, sender=Product)
+def remove_from_suggestion_index(sender, instance, **kwargs):
+    suggestion_index.remove(instance.pk)
+
+
+# 5. เวอร์ชันของแคตตาล็อก (ใช้ใน key ของ cache facets / ผลค้นหา)
+# เปลี่ยนเมื่อสินค้าเข้าหรือออกจากสถานะ active หรือสินค้าที่ active ถูกแก้ไข
+@receiver(post_init, sender=Product)
+def remember_product_status(sender, instance, **kwargs):
+    instance._original_status = instance.status
+
+def bump_catalogue_after_commit(home_grid):
+    # เปลี่ยนเวอร์ชันหลัง commit เท่านั้น: ถ้าเปลี่ยนระหว่าง transaction ผู้อ่านคนอื่นอาจเติม cache
+    # ของเวอร์ชันใหม่ด้วยข้อมูลก่อน commit แล้วค้างอยู่อย่างนั้นจนกว่าจะมีการแก้ไขครั้งถัดไป
+    def bump():
+        bump_catalogue_version()
+        if home_grid:
+            bump_home_grid_version()
+    transaction.on_commit(bump)
+
+@receiver(post_save, sender=Product)
+def bump_catalogue_on_save(sender, instance, **kwargs):
+    if 'active' in (instance.status, instance._original_status):
+        bump_catalogue_after_commit(product_in_grid(instance))
+    instance._original_status = instance.status
+
+@receiver(post_delete, sender=Product)
+def bump_catalogue_on_delete(sender, instance, **kwargs):
+    if instance._original_status == 'active':
+        bump_catalogue_after_commit(product_in_grid(instance))
+
+
+# 6. ชื่อ/รูปของผู้ขายแสดงอยู่บนการ์ดในหน้าแรก
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def bump_home_grid_on_profile_change(sender, instance, **kwargs):
+    if seller_in_grid(instance.user_id):
+        # หลัง commit เหมือนเวอร์ชันของแคตตาล็อก (ดูข้อ 5)
+        transaction.on_commit(bump_home_grid_version)
@@ -0,0 +1,158 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+# งบหน่วยความจำของดัชนี (ต่อ 1 process):
+# 1 entry = tuple (คำนำหน้าตัวพิมพ์เล็ก, product id) ประมาณ 150-200 bytes
+# ค่าเริ่มต้น 200,000 entries ~ 35 MB; ถ้าสินค้าเยอะเกินงบ ดัชนีจะไม่ถูกสร้าง และใช้ DB แทน
+DEFAULT_MAX_ENTRIES = 200_000
+# สร้างดัชนีใหม่เป็นระยะ เพื่อรับการเปลี่ยนแปลงที่เกิดใน process อื่น (วินาที)
+DEFAULT_MAX_AGE = 300
+
+
+def prefix_keys(name):
+    """คืนค่า key สำหรับทุกตำแหน่งต้นคำ เช่น "Laptop Lenovo" -> "laptop lenovo", "lenovo" """
+    words = (name or '').lower().split()
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class PrefixIndex:
+    """
+    ดัชนี prefix แบบ sorted array สำหรับ autocomplete (อยู่ในหน่วยความจำของแต่ละ process)
+    - ค้นหาด้วย bisect: O(log n + k)
+    - อัปเดตทีละสินค้าผ่าน signal (add/remove)
+    - ถ้ายังไม่ได้สร้าง (cold) lookup() จะคืนค่า None เพื่อให้ผู้เรียกไปใช้ DB
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_age=DEFAULT_MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = []
+        self._names = {}
+        self._pending = None
+        self._lock = threading.Lock()
+        self.built_at = None
+
+    @property
+    def is_warm(self):
+        return self.built_at is not None
+
+    @property
+    def is_stale(self):
+        return self.is_warm and time.monotonic() - self.built_at > self.max_age
+
+    def __len__(self):
+        return len(self._entries)
+
+    def build(self, rows):
+        """สร้างดัชนีใหม่จาก (id, name) ของสินค้าที่ active; คืนค่า False ถ้าเกินงบหน่วยความจำ"""
+        with self._lock:
+            self._pending = []
+
+        entries, names = [], {}
+        for pk, name in rows:
+            names[pk] = name
+            entries.extend((key, pk) for key in prefix_keys(name))
+            if len(entries) > self.max_entries:
+                with self._lock:
+                    self._pending = None
+                    self._clear_locked()
+                return False
+        entries.sort()
+
+        with self._lock:
+            self._entries, self._names = entries, names
+            # การเปลี่ยนแปลงที่เข้ามาระหว่างสร้างดัชนี
+            for op, pk, name in self._pending:
+                self._apply(op, pk, name)
+            self._pending = None
+            self.built_at = time.monotonic()
+        return True
+
+    def add(self, pk, name):
+        self._update('add', pk, name)
+
+    def remove(self, pk):
+        self._update('remove', pk, None)
+
+    def _update(self, op, pk, name):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((op, pk, name))
+            if self.is_warm:
+                self._apply(op, pk, name)
+                if len(self._entries) > self.max_entries:
+                    self._clear_locked()
+
+    def _apply(self, op, pk, name):
+        old_name = self._names.pop(pk, None)
+        if old_name is not None:
+            for key in prefix_keys(old_name):
+                i = bisect_left(self._entries, (key, pk))
+                if i < len(self._entries) and self._entries[i] == (key, pk):
+                    del self._entries[i]
+        if op == 'add':
+            self._names[pk] = name
+            for key in prefix_keys(name):
+                insort(self._entries, (key, pk))
+
+    def lookup(self, term, limit=5):
+        """คืนค่า [{'id', 'name'}] ที่ชื่อมีคำขึ้นต้นด้วย term หรือ None ถ้าดัชนียัง cold"""
+        prefix = ' '.join((term or '').lower().split())
+        with self._lock:
+            if not self.is_warm:
+                return None
+            results, seen = [], set()
+            i = bisect_left(self._entries, (prefix,))
+            while i < len(self._entries) and len(results) < limit:
+                key, pk = self._entries[i]
+                if not key.startswith(prefix):
+                    break
+                if pk not in seen:
+                    seen.add(pk)
+                    results.append({'id': pk, 'name': self._names[pk]})
+                i += 1
+            return results
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def _clear_locked(self):
+        self._entries, self._names = [], {}
+        self.built_at = None
+
+
+suggestion_index = PrefixIndex(
+    max_entries=getattr(settings, 'SEARCH_SUGGESTIONS_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+    max_age=getattr(settings, 'SEARCH_SUGGESTIONS_MAX_AGE', DEFAULT_MAX_AGE),
+)
+_warming = threading.Lock()
+
+
+def warm_index():
+    """โหลดชื่อสินค้าที่ active ทั้งหมดเข้า suggestion_index (เรียกตอน process เริ่มทำงาน)"""
+    from .models import Product
+
+    if not _warming.acquire(blocking=False):
+        return
+    try:
+        rows = Product.objects.filter(status='active').values_list('id', 'name').iterator(chunk_size=2000)
+        suggestion_index.build(rows)
+    finally:
+        _warming.release()
+
+
+def _warm_in_thread():
+    from django.db import connection
+
+    try:
+        warm_index()
+    finally:
+        connection.close()
+
+
+def warm_index_in_background():
+    threading.Thread(target=_warm_in_thread, name='suggestion-index-warm', daemon=True).start()
@@ -1,5 +1,5 @@
 from decimal import Decimal
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.urls import reverse
@@ -124,6 +124,25 @@ class NotificationModelTest(TestCase):
         )
         self.assertFalse(notif.is_read)
 
+    def test_unread_counter(self):
+        user = User.objects.create_user(username="notifuser", password="pass123")
+        first = Notification.objects.create(recipient=user, title="A", message="M")
+        Notification.objects.create(recipient=user, title="B", message="M")
+        Notification.objects.create(recipient=user, title="C", message="M", is_read=True)
+        first.title = "A2"
+        first.save()
+        self.assertEqual(UserProfile.objects.get(user=user).unread_notifications, 2)
+        # แก้โปรไฟล์ด้วย instance เก่าไม่เขียนตัวนับทับ
+        profile = UserProfile.objects.get(user=user)
+        Notification.objects.create(recipient=user, title="D", message="M")
+        profile.bio = "hi"
+        profile.save()
+        self.assertEqual(UserProfile.objects.get(user=user).unread_notifications, 3)
+        first.delete()
+        self.assertEqual(UserProfile.objects.get(user=user).unread_notifications, 2)
+        self.assertEqual(Notification.mark_all_read(user), 2)
+        self.assertEqual(UserProfile.objects.get(user=user).unread_notifications, 0)
+
     def test_product_approve_creates_notification(self):
         seller = User.objects.create_user(username="seller", password="pass123")
         product = Product.objects.create(
@@ -281,6 +300,141 @@ class HomeViewTest(SocialAppMixin, TestCase):
         self.assertEqual(products.first().name, "Active")
 
 
+class CardQueryBudgetTest(SocialAppMixin, TestCase):
+    """จำนวน query ของหน้าที่แสดงการ์ดสินค้าต้องไม่ขึ้นกับจำนวนสินค้า (N+1)"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.cat = Category.objects.create(name="Books")
+        self.buyer = User.objects.create_user(username="buyer", password="p")
+        self.sellers = [User.objects.create_user(username=f"seller{i}", password="p") for i in range(5)]
+        for i in range(20):
+            product = Product.objects.create(
+                name=f"Item {i}", description="d", price=100 + i, category=self.cat if i % 2 else None,
+                seller=self.sellers[i % 5], status="active",
+            )
+            product.favorites.add(self.buyer)
+        self.seller = self.sellers[0]
+
+    def assertPageQueries(self, num, url, user=None):
+        if user:
+            self.client.force_login(user)
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_home(self):
+        self.assertPageQueries(1, reverse("home"))
+        self.assertPageQueries(0, reverse("home"))
+
+    def test_product_list_all(self):
+        # หมวดหมู่ + facets + สินค้า (จำนวนทั้งหมดใช้ยอดรวมของ facets)
+        self.assertPageQueries(3, reverse("product_list"))
+
+    def test_product_list_all_search(self):
+        self.assertPageQueries(4, reverse("product_list") + "?q=item&category=%d" % self.cat.id)
+
+    def test_product_detail_related(self):
+        from unittest import mock
+        product = Product.objects.filter(category=self.cat).first()
+        # สินค้า + favorites + สินค้าใกล้เคียง (pivot = 0 -> ไม่ต้องวนกลับ)
+        with mock.patch("products.related.random.random", return_value=0.0):
+            response = self.assertPageQueries(3, reverse("product_detail", kwargs={"pk": product.pk}))
+        self.assertEqual(len(response.context["related_products"]), 4)
+
+    def test_wishlist(self):
+        # session + user + สินค้า + count + โปรไฟล์ใน navbar (ตัวนับแจ้งเตือนอยู่ในโปรไฟล์)
+        self.assertPageQueries(5, reverse("wishlist"), user=self.buyer)
+
+    def test_seller_profile(self):
+        self.assertPageQueries(7, reverse("seller_profile", kwargs={"seller_id": self.seller.pk}))
+
+    def test_my_listings(self):
+        self.assertPageQueries(5, reverse("my_listings"), user=self.seller)
+
+
+class HomeGridCacheTest(SocialAppMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.seller = User.objects.create_user(username="s", password="p")
+        self.old = Product.objects.create(
+            name="Old Item", description="d", price=100, seller=self.seller, status="active"
+        )
+        self.products = [
+            Product.objects.create(
+                name=f"New Item {i}", description="d", price=100, seller=self.seller, status="active"
+            )
+            for i in range(8)
+        ]
+
+    def product_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("home"))
+        return response, [q["sql"] for q in queries if "products_product" in q["sql"]]
+
+    def grid_version(self):
+        from .cache import home_grid_version
+        return home_grid_version()
+
+    def test_second_hit_runs_no_product_queries(self):
+        _, queries = self.product_queries()
+        self.assertEqual(len(queries), 1)
+        response, queries = self.product_queries()
+        self.assertEqual(queries, [])
+        self.assertContains(response, "New Item 7")
+        self.client.login(username="s", password="p")
+        self.product_queries()
+        self.assertEqual(self.product_queries()[1], [])
+
+    def test_new_product_invalidates(self):
+        self.product_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Fresh Item", description="d", price=1, seller=self.seller, status="active")
+        self.assertContains(self.client.get(reverse("home")), "Fresh Item")
+
+    def test_edit_outside_grid_keeps_cache(self):
+        version = self.grid_version()
+        self.old.price = 999
+        self.old.save()
+        self.assertEqual(self.grid_version(), version)
+        Product.objects.create(name="Hidden", description="d", price=1, seller=self.seller, status="pending")
+        self.assertEqual(self.grid_version(), version)
+
+    def test_edit_and_sale_inside_grid_invalidate(self):
+        version = self.grid_version()
+        self.products[0].name = "Renamed Item"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        self.assertNotEqual(self.grid_version(), version)
+        self.product_queries()
+        self.products[-1].status = "sold"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[-1].save()
+        response = self.client.get(reverse("home"))
+        self.assertNotContains(response, "New Item 7")
+        self.assertContains(response, "Old Item")
+
+    def test_seller_profile_change_invalidates(self):
+        self.product_queries()
+        profile = self.seller.profile
+        profile.display_name = "Shop Owner"
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        self.assertContains(self.client.get(reverse("home")), "Shop Owner")
+
+    def test_unrelated_profile_change_keeps_cache(self):
+        version = self.grid_version()
+        other = User.objects.create_user(username="o", password="p")
+        other.profile.display_name = "Someone"
+        other.profile.save()
+        self.assertEqual(self.grid_version(), version)
+
+
 class ProductListViewTest(SocialAppMixin, TestCase):
     def setUp(self):
         self.seller = User.objects.create_user(username="s", password="p")
@@ -304,18 +458,450 @@ class ProductListViewTest(SocialAppMixin, TestCase):
 
     def test_only_active_shown(self):
         response = self.client.get(reverse("product_list"))
-        self.assertEqual(response.context["products"].count(), 2)
+        self.assertEqual(len(response.context["products"]), 2)
+        self.assertEqual(response.context["product_count"], 2)
 
     def test_search_filter(self):
         response = self.client.get(reverse("product_list"), {"q": "Django"})
         products = response.context["products"]
-        self.assertEqual(products.count(), 1)
-        self.assertEqual(products.first().name, "Django Book")
+        self.assertEqual(len(products), 1)
+        self.assertEqual(products[0].name, "Django Book")
 
     def test_category_filter(self):
         response = self.client.get(reverse("product_list"), {"category": self.cat.id})
         products = response.context["products"]
-        self.assertEqual(products.count(), 1)
+        self.assertEqual(len(products), 1)
+
+
+class KeysetPaginationTest(SocialAppMixin, TestCase):
+    def setUp(self):
+        from .pagination import PER_PAGE
+        from .search import build_document
+        self.per_page = PER_PAGE
+        self.seller = User.objects.create_user(username="s", password="p")
+        Product.objects.bulk_create([
+            Product(
+                name=f"Item {i}", description="d" * (i % 3 + 1), price=i, seller=self.seller,
+                status="active", search_vector=build_document(f"Item {i}", "d"),
+            )
+            for i in range(PER_PAGE * 2 + 3)
+        ])
+        # created_at ซ้ำกันได้ -> id ต้องเป็นตัวตัดสินลำดับ
+        Product.objects.update(created_at=Product.objects.first().created_at)
+
+    def collect(self, url, params=None):
+        seen, params = [], dict(params or {})
+        for _ in range(10):
+            response = self.client.get(url, params)
+            page = response.context["page"]
+            seen.extend(p.id for p in page)
+            if not page.has_next:
+                return seen
+            params["cursor"] = page.next_cursor
+        self.fail("pagination did not terminate")
+
+    def test_walks_all_pages_without_duplicates(self):
+        ids = self.collect(reverse("product_list"))
+        self.assertEqual(len(ids), self.per_page * 2 + 3)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_page_size_constant(self):
+        response = self.client.get(reverse("product_list"))
+        self.assertEqual(len(response.context["products"]), self.per_page)
+        self.assertEqual(response.context["product_count"], self.per_page * 2 + 3)
+
+    def test_later_pages_skip_count(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.client.force_login(self.seller)
+        pages = (
+            (reverse("product_list"), {"min_price": "0"}, "product_count"),
+            (reverse("my_listings"), {}, "product_count"),
+            (reverse("seller_profile", kwargs={"seller_id": self.seller.pk}), {}, "selling_count"),
+        )
+        for url, params, count in pages:
+            first = self.client.get(url, params)
+            self.assertIsNotNone(first.context[count])
+            with CaptureQueriesContext(connection) as queries:
+                second = self.client.get(url, {**params, "cursor": first.context["page"].next_cursor})
+            self.assertIsNone(second.context[count])
+            self.assertFalse([q for q in queries if "COUNT(*)" in q["sql"] and "products_product" in q["sql"]])
+
+    def test_next_url_keeps_filters(self):
+        response = self.client.get(reverse("product_list"), {"q": "item"})
+        next_url = response.context["page"].next_url
+        self.assertIn("q=item", next_url)
+        self.assertIn("cursor=", next_url)
+        self.assertEqual(len(self.collect(reverse("product_list"), {"q": "item"})), self.per_page * 2 + 3)
+
+    def test_json_mode(self):
+        data = self.client.get(reverse("product_list"), {"format": "json"}).json()
+        self.assertEqual(len(data["results"]), self.per_page)
+        self.assertIsNotNone(data["next_cursor"])
+        more = self.client.get(reverse("product_list"), {"format": "json", "cursor": data["next_cursor"]}).json()
+        self.assertFalse({r["id"] for r in data["results"]} & {r["id"] for r in more["results"]})
+
+    def test_tampered_cursor_restarts(self):
+        response = self.client.get(reverse("product_list"), {"cursor": "bm90LWpzb24"})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("product_list"), {"cursor": "WyJ4IiwieSJd"})
+        self.assertEqual(len(response.context["products"]), self.per_page)
+
+    def test_seller_profile_and_my_listings_paginated(self):
+        ids = self.collect(reverse("seller_profile", kwargs={"seller_id": self.seller.pk}))
+        self.assertEqual(len(ids), self.per_page * 2 + 3)
+        self.client.login(username="s", password="p")
+        self.assertEqual(len(self.collect(reverse("my_listings"))), self.per_page * 2 + 3)
+
+    def test_wishlist_paginated(self):
+        buyer = User.objects.create_user(username="b", password="p")
+        for product in Product.objects.all():
+            product.favorites.add(buyer)
+        self.client.login(username="b", password="p")
+        self.assertEqual(len(self.collect(reverse("wishlist"))), self.per_page * 2 + 3)
+
+
+class ProductSearchTest(SocialAppMixin, TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="s", password="p")
+        self.book = Product.objects.create(
+            name="หนังสือเรียนแคลคูลัส", description="สภาพดี ไม่มีรอยขีดเขียน", price=300,
+            seller=self.seller, status="active",
+        )
+        self.desk = Product.objects.create(
+            name="โต๊ะพับ", description="แถมหนังสือการ์ตูน 2 เล่ม", price=450,
+            seller=self.seller, status="active",
+        )
+        self.phone = Product.objects.create(
+            name="iPhone13 Pro", description="Battery 90%", price=15000,
+            seller=self.seller, status="active",
+        )
+
+    def search(self, q):
+        response = self.client.get(reverse("product_list"), {"q": q})
+        return list(response.context["products"])
+
+    def test_tokenize_thai_bigrams(self):
+        from .search import tokenize
+        self.assertEqual(tokenize("โต๊ะ iPad"), [["โต", "ต๊", "๊ะ"], ["ipad"]])
+
+    def test_search_vector_maintained_on_save(self):
+        self.desk.name = "เก้าอี้พับ"
+        self.desk.save()
+        self.assertEqual(self.search("เก้าอี้"), [self.desk])
+        self.assertEqual(self.search("โต๊ะ"), [])
+
+    def test_migration_backfill_matches_live_index(self):
+        from importlib import import_module
+        from unittest import mock
+        from django.apps import apps
+        from django.db import connection
+        backfill = import_module("products.migrations.0017_product_search_vector")
+        expected = dict(Product.objects.values_list("id", "search_vector"))
+        Product.objects.update(search_vector=None)
+
+        with mock.patch.object(backfill, "BATCH_SIZE", 2), connection.schema_editor() as schema_editor:
+            backfill.populate_search_vector(apps, schema_editor)
+        self.assertEqual(dict(Product.objects.values_list("id", "search_vector")), expected)
+
+    def test_thai_substring_match(self):
+        self.assertEqual(self.search("แคลคูลัส"), [self.book])
+
+    def test_thai_bigrams_must_be_adjacent(self):
+        # "หนังลัส" มี bigram ครบ แต่ไม่ได้อยู่ติดกันในชื่อสินค้า
+        self.assertEqual(self.search("หนังลัส"), [])
+
+    def test_name_ranked_above_description(self):
+        self.assertEqual(self.search("หนังสือ"), [self.book, self.desk])
+
+    def test_latin_prefix_case_insensitive(self):
+        self.assertEqual(self.search("iphone"), [self.phone])
+
+    def test_search_with_category(self):
+        cat = Category.objects.create(name="Books")
+        self.book.category = cat
+        self.book.save()
+        response = self.client.get(reverse("product_list"), {"q": "หนังสือ", "category": cat.id})
+        self.assertEqual(list(response.context["products"]), [self.book])
+
+
+class PriceFilterSortTest(SocialAppMixin, TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="s", password="p")
+        self.cat = Category.objects.create(name="Books")
+        for price in (50, 300, 700, 700, 2500, 9000):
+            Product.objects.create(
+                name=f"Item {price}", description="d", price=price,
+                seller=self.seller, status="active", category=self.cat,
+            )
+        Product.objects.create(
+            name="Pending", description="d", price=700, seller=self.seller, status="pending",
+        )
+
+    def prices(self, **params):
+        response = self.client.get(reverse("product_list"), params)
+        return [int(p.price) for p in response.context["products"]]
+
+    def test_price_bucket(self):
+        self.assertEqual(sorted(self.prices(price="500-1000")), [700, 700])
+        self.assertEqual(self.prices(price="5000-"), [9000])
+
+    def test_min_max_price(self):
+        self.assertEqual(sorted(self.prices(min_price="300", max_price="2500")), [300, 700, 700, 2500])
+        self.assertEqual(len(self.prices(min_price="abc", max_price="NaN")), 6)
+
+    def test_sort_by_price(self):
+        self.assertEqual(self.prices(sort="price_asc"), [50, 300, 700, 700, 2500, 9000])
+        self.assertEqual(self.prices(sort="price_desc"), [9000, 2500, 700, 700, 300, 50])
+
+    def test_price_sort_paginates(self):
+        from .pagination import paginate_keyset
+        queryset = Product.objects.filter(status="active").order_by("price", "id")
+        request = RequestFactory().get("/")
+        seen = []
+        for _ in range(10):
+            page = paginate_keyset(request, queryset, per_page=4)
+            seen.extend(int(p.price) for p in page)
+            if not page.has_next:
+                break
+            request = RequestFactory().get("/", {"cursor": page.next_cursor})
+        self.assertEqual(seen, [50, 300, 700, 700, 2500, 9000])
+
+    def test_query_shapes_use_indexes(self):
+        from django.db import connection
+        from .management.commands.explain_products import query_shapes
+        with connection.cursor() as cursor:
+            # ตารางในชุดทดสอบเล็กมาก: ปิดทางเลือกอื่นเพื่อดูว่า index ใช้กับ query ได้จริง
+            cursor.execute("ANALYZE products_product")
+            for setting in ("enable_seqscan", "enable_bitmapscan", "enable_sort"):
+                cursor.execute(f"SET LOCAL {setting} = off")
+        plans = {label: queryset.explain() for label, queryset in query_shapes(self.cat, self.seller)}
+        self.assertIn("product_active_recent", plans["home"])
+        self.assertIn("product_active_recent", plans["product_list_all"])
+        self.assertIn("product_active_price", plans["product_list_all ?sort=price_desc"])
+        self.assertIn("product_seller_recent", plans["my_listings"])
+        self.assertIn("product_pending_recent", plans["admin_dashboard pending"])
+        # ทุก query อ่านตามลำดับของ index ได้เลย ไม่ต้อง sort
+        for label, plan in plans.items():
+            self.assertNotIn("Sort", plan, label)
+
+    def test_explain_without_createdb_rolls_back(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from django.db import connection
+        from .management.commands.explain_products import Command, QUERY_INDEXES
+        out, err = StringIO(), StringIO()
+        with mock.patch.object(Command, "_can_create_database", return_value=False):
+            call_command("explain_products", rows=50, stdout=out, stderr=err)
+        self.assertIn("CREATEDB", err.getvalue())
+        self.assertIn("== home", out.getvalue())
+        # ข้อมูลจำลองและ index ที่ลบไประหว่าง EXPLAIN กลับมาเหมือนเดิม
+        self.assertFalse(Product.objects.filter(description="explain").exists())
+        indexes = connection.introspection.get_constraints(connection.cursor(), "products_product")
+        self.assertTrue(set(QUERY_INDEXES) <= indexes.keys())
+
+
+class SearchResultCacheTest(SocialAppMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.seller = User.objects.create_user(username="s", password="p")
+        self.products = [
+            Product.objects.create(
+                name=f"iPhone {i}", description="d", price=1000 + i, seller=self.seller, status="active",
+            )
+            for i in range(5)
+        ]
+
+    def stats(self):
+        from .search_cache import search_cache_stats
+        return search_cache_stats()
+
+    def test_repeat_query_hits_cache(self):
+        first = self.client.get(reverse("product_list"), {"q": "iphone"})
+        with self.assertNumQueries(2):
+            # หมวดหมู่ + ดึงสินค้าตาม id (ผลค้นหาและ facets มาจาก cache)
+            second = self.client.get(reverse("product_list"), {"q": "  IPHONE "})
+        self.assertEqual(list(first.context["products"]), list(second.context["products"]))
+        self.assertEqual(second.context["product_count"], 5)
+        self.assertEqual((self.stats()["miss"], self.stats()["hit"]), (1, 1))
+
+    def test_key_includes_filters_and_sort(self):
+        from .search_cache import search_cache_key
+        self.assertEqual(search_cache_key("iPhone  13", "search", None), search_cache_key("iphone 13", "search", ""))
+        self.assertNotEqual(search_cache_key("iphone", "search", "1"), search_cache_key("iphone", "search", "2"))
+        response = self.client.get(reverse("product_list"), {"q": "iphone", "sort": "price_desc"})
+        self.assertEqual(response.context["products"][0], self.products[-1])
+
+    def test_status_change_invalidates(self):
+        self.client.get(reverse("product_list"), {"q": "iphone"})
+        self.products[0].status = "sold"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        response = self.client.get(reverse("product_list"), {"q": "iphone"})
+        self.assertNotIn(self.products[0], list(response.context["products"]))
+        self.assertEqual(self.stats()["miss"], 2)
+
+    def test_stale_entry_served_while_other_worker_recomputes(self):
+        from django.core.cache import cache
+        from .cache import bump_catalogue_version
+        from .search_cache import cached_result_ids
+        cached_result_ids("k", lambda: [1, 2])
+        bump_catalogue_version()
+        cache.add("k:lock", 1)
+        self.assertEqual(cached_result_ids("k", lambda: self.fail("should not recompute")), [1, 2])
+        self.assertEqual(self.stats()["stale"], 1)
+
+    def test_waits_for_lock_holder_without_stale_entry(self):
+        from unittest import mock
+        from django.core.cache import cache
+        from . import search_cache
+        cache.add("k:lock", 1)
+        with mock.patch.object(search_cache, "LOCK_WAIT_STEPS", 2), \
+                mock.patch.object(search_cache, "LOCK_WAIT_INTERVAL", 0):
+            self.assertEqual(search_cache.cached_result_ids("k", lambda: [3]), [3])
+
+    def test_long_results_not_cached(self):
+        from unittest import mock
+        from . import search_cache
+        with mock.patch.object(search_cache, "MAX_CACHED_RESULTS", 2):
+            self.assertIsNone(search_cache.cached_result_ids("k", lambda: [1, 2, 3]))
+            response = self.client.get(reverse("product_list"), {"q": "iphone"})
+        self.assertEqual(len(response.context["products"]), 5)
+        self.assertEqual(self.stats()["skip"], 2)
+
+    def test_paginate_ids_cursor_survives_list_change(self):
+        from .pagination import paginate_ids
+        queryset = Product.objects.filter(status="active")
+        ids = [p.id for p in self.products]
+        page = paginate_ids(RequestFactory().get("/"), ids, queryset, per_page=2)
+        self.assertEqual([p.id for p in page], ids[:2])
+        request = RequestFactory().get("/", {"cursor": page.next_cursor})
+        # สินค้าแรกหายไปจาก list (เช่นขายแล้ว) -> หาต่อจาก id สุดท้ายของหน้าก่อน ไม่ข้ามหรือซ้ำ
+        page = paginate_ids(request, ids[1:], queryset, per_page=2)
+        self.assertEqual([p.id for p in page], ids[2:4])
+
+
+# ฐานข้อมูลทดสอบไม่มี pg_trgm -> ใช้ trigram แบบ Python
+@override_settings(FUZZY_SEARCH_PYTHON_FALLBACK=True)
+class FuzzySearchTest(SocialAppMixin, TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="s", password="p")
+        self.calc = Product.objects.create(
+            name="Casio Calculator fx-991", description="d", price=500,
+            seller=self.seller, status="active",
+        )
+        self.phone = Product.objects.create(
+            name="iPhone 13 Pro", description="d", price=15000,
+            seller=self.seller, status="active",
+        )
+        Product.objects.create(
+            name="Calculator Pending", description="d", price=100,
+            seller=self.seller, status="pending",
+        )
+
+    def test_trigrams_match_pg_trgm(self):
+        from .fuzzy import trigrams
+        self.assertEqual(trigrams("Cat"), {"  c", " ca", "cat", "at "})
+        self.assertEqual(trigrams("a-b"), {"  a", " a ", "  b", " b "})
+
+    def test_similarity(self):
+        from .fuzzy import similarity
+        self.assertEqual(similarity("word", "word"), 1.0)
+        self.assertEqual(similarity("word", ""), 0.0)
+        self.assertGreater(similarity("ipone 13", "iPhone 13 Pro"), similarity("ipone 13", "Casio Calculator"))
+
+    def test_exact_match_not_fuzzy(self):
+        response = self.client.get(reverse("product_list"), {"q": "calculator"})
+        self.assertFalse(response.context["fuzzy"])
+        self.assertEqual(list(response.context["products"]), [self.calc])
+
+    def test_misspelling_falls_back_to_fuzzy(self):
+        response = self.client.get(reverse("product_list"), {"q": "calculater"})
+        self.assertTrue(response.context["fuzzy"])
+        self.assertEqual(list(response.context["products"]), [self.calc])
+        self.assertEqual(response.context["facets"]["total"], 1)
+        self.assertContains(response, "ชื่อใกล้เคียง")
+
+    def test_no_close_match(self):
+        response = self.client.get(reverse("product_list"), {"q": "zzzzqqq"})
+        self.assertTrue(response.context["fuzzy"])
+        self.assertEqual(len(response.context["products"]), 0)
+
+    def test_skipped_without_extension_or_fallback(self):
+        from unittest import mock
+        with override_settings(FUZZY_SEARCH_PYTHON_FALLBACK=False), \
+                mock.patch("products.fuzzy.has_trigram_extension", return_value=False):
+            response = self.client.get(reverse("product_list"), {"q": "calculater"})
+        self.assertFalse(response.context["fuzzy"])
+        self.assertEqual(len(response.context["products"]), 0)
+
+    def test_fuzzy_results_paginate(self):
+        from .fuzzy import fuzzy_search
+        from .pagination import paginate_keyset
+        request = RequestFactory().get("/", {"q": "ipone 13"})
+        page = paginate_keyset(request, fuzzy_search(Product.objects.filter(status="active"), "ipone 13"), per_page=1)
+        self.assertEqual(list(page), [self.phone])
+
+
+class ProductFacetTest(SocialAppMixin, TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="s", password="p")
+        self.books = Category.objects.create(name="Books")
+        self.phones = Category.objects.create(name="Phones")
+        Product.objects.create(
+            name="Django Book", description="d", price=50, condition="used",
+            seller=self.seller, status="active", category=self.books,
+        )
+        Product.objects.create(
+            name="Python Book", description="d", price=700, condition="new",
+            seller=self.seller, status="active", category=self.books,
+        )
+        self.phone = Product.objects.create(
+            name="Phone", description="d", price=8000, condition="used",
+            seller=self.seller, status="active", category=self.phones,
+        )
+
+    def facets(self, **params):
+        return self.client.get(reverse("product_list"), params).context["facets"]
+
+    def test_counts(self):
+        facets = self.facets()
+        self.assertEqual(facets["total"], 3)
+        self.assertEqual(facets["categories"], {self.books.id: 2, self.phones.id: 1})
+        self.assertEqual(facets["conditions"], {"new": 1, "used": 2})
+        self.assertEqual([b["count"] for b in facets["price_buckets"]], [1, 0, 1, 0, 1])
+
+    def test_counts_follow_query_not_category(self):
+        facets = self.facets(q="book", category=self.phones.id)
+        self.assertEqual(facets["total"], 2)
+        self.assertEqual(facets["categories"][self.phones.id], 0)
+
+    def test_single_query_then_cached(self):
+        from .facets import compute_facets
+        categories = [self.books.id, self.phones.id]
+        with self.assertNumQueries(1):
+            compute_facets(Product.objects.filter(status="active"), categories)
+        from .facets import get_facets
+        get_facets(Product.objects.filter(status="active"), "x", categories)
+        with self.assertNumQueries(0):
+            get_facets(Product.objects.filter(status="active"), "  X ", categories)
+
+    def test_status_change_invalidates(self):
+        self.assertEqual(self.facets()["total"], 3)
+        self.phone.status = "sold"
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.phone.save()
+        # ยังไม่ commit -> เวอร์ชันยังไม่เปลี่ยน (ไม่มีใครเติม cache ของเวอร์ชันใหม่ด้วยข้อมูลก่อน commit)
+        self.assertEqual(self.facets()["total"], 3)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.facets()["total"], 2)
+
+    def test_condition_filter(self):
+        response = self.client.get(reverse("product_list"), {"condition": "new"})
+        self.assertEqual([p.name for p in response.context["products"]], ["Python Book"])
 
 
 class ProductDetailViewTest(SocialAppMixin, TestCase):
@@ -348,6 +934,67 @@ class ProductDetailViewTest(SocialAppMixin, TestCase):
         self.assertEqual(response.status_code, 404)
 
 
+class RelatedProductsTest(SocialAppMixin, TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="s", password="p")
+        self.cat = Category.objects.create(name="Books")
+        self.other = Category.objects.create(name="Phones")
+        self.products = [
+            Product.objects.create(
+                name=f"Book {i}", description="d", price=100,
+                seller=self.seller, status="active", category=self.cat,
+            )
+            for i in range(6)
+        ]
+        Product.objects.create(
+            name="Pending Book", description="d", price=100,
+            seller=self.seller, status="pending", category=self.cat,
+        )
+        Product.objects.create(
+            name="Phone", description="d", price=100,
+            seller=self.seller, status="active", category=self.other,
+        )
+
+    def test_same_category_active_only(self):
+        from .related import related_products
+        product = self.products[0]
+        for _ in range(10):
+            related = related_products(product)
+            self.assertEqual(len(related), 4)
+            self.assertEqual(len(set(related)), 4)
+            self.assertNotIn(product, related)
+            for item in related:
+                self.assertEqual((item.category_id, item.status), (self.cat.id, "active"))
+
+    def test_wraps_around_small_category(self):
+        from .related import related_products
+        for _ in range(10):
+            self.assertEqual(len(related_products(self.products[0], limit=10)), 5)
+
+    def test_sold_product_leaves_pool(self):
+        from .related import related_products
+        for product in self.products[1:]:
+            product.status = "sold"
+            product.save()
+        self.assertEqual(related_products(self.products[0]), [])
+
+    def test_migration_randomizes_sample_key(self):
+        from importlib import import_module
+        from django.apps import apps
+        from django.db import connection
+        migration = import_module("products.migrations.0018_product_sample_key")
+        Product.objects.update(sample_key=0.5)
+        with connection.schema_editor() as schema_editor:
+            migration.randomize_sample_key(apps, schema_editor)
+        keys = list(Product.objects.values_list("sample_key", flat=True))
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertTrue(all(0 <= key < 1 for key in keys))
+
+    def test_detail_page_uses_related(self):
+        response = self.client.get(reverse("product_detail", kwargs={"pk": self.products[0].pk}))
+        self.assertEqual(len(response.context["related_products"]), 4)
+
+
 class SearchSuggestionsViewTest(SocialAppMixin, TestCase):
     def setUp(self):
         seller = User.objects.create_user(username="s", password="p")
@@ -381,6 +1028,59 @@ class SearchSuggestionsViewTest(SocialAppMixin, TestCase):
         self.assertEqual(response.json(), [])
 
 
+class SuggestionIndexTest(SocialAppMixin, TestCase):
+    def setUp(self):
+        from .suggestions import suggestion_index, warm_index
+        self.index = suggestion_index
+        self.seller = User.objects.create_user(username="s", password="p")
+        self.laptop = Product.objects.create(
+            name="Laptop Lenovo", description="d", price=100,
+            seller=self.seller, status="active",
+        )
+        Product.objects.create(
+            name="Lamp", description="d", price=50,
+            seller=self.seller, status="pending",
+        )
+        warm_index()
+        self.addCleanup(self.index.clear)
+
+    def suggest(self, term):
+        return self.client.get(reverse("search_suggestions"), {"term": term}).json()
+
+    def test_warm_index_answers_without_db(self):
+        with self.assertNumQueries(0):
+            data = self.suggest("LENOVO")
+        self.assertEqual(data, [{"id": self.laptop.id, "name": "Laptop Lenovo"}])
+
+    def test_inactive_products_not_indexed(self):
+        self.assertEqual(self.suggest("lamp"), [])
+
+    def test_incremental_update_on_save_and_delete(self):
+        self.laptop.name = "Laptop Asus"
+        self.laptop.save()
+        self.assertEqual(self.suggest("lenovo"), [])
+        self.assertEqual(self.suggest("asus")[0]["name"], "Laptop Asus")
+        self.laptop.delete()
+        self.assertEqual(self.suggest("laptop"), [])
+
+    def test_status_change_removes_from_index(self):
+        self.laptop.status = "sold"
+        self.laptop.save()
+        self.assertEqual(self.suggest("laptop"), [])
+
+    def test_cold_index_falls_back_to_db(self):
+        self.index.clear()
+        with self.assertNumQueries(1):
+            data = self.suggest("Lenovo")
+        self.assertEqual(data[0]["name"], "Laptop Lenovo")
+
+    def test_over_budget_stays_cold(self):
+        from .suggestions import PrefixIndex
+        index = PrefixIndex(max_entries=2)
+        self.assertFalse(index.build([(1, "a b"), (2, "c d")]))
+        self.assertIsNone(index.lookup("a"))
+
+
 class RegisterViewTest(SocialAppMixin, TestCase):
     def test_register_page_returns_200(self):
         response = self.client.get(reverse("register"))
@@ -482,3 +1182,26 @@ class NotificationContextProcessorTest(SocialAppMixin, TestCase):
         self.client.login(username="u", password="p")
         response = self.client.get(reverse("home"))
         self.assertEqual(response.context["unread_notification_count"], 1)
+
+    def test_count_comes_from_profile_counter(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        user = User.objects.create_user(username="u", password="p")
+        Notification.objects.create(recipient=user, title="T", message="M")
+        self.client.login(username="u", password="p")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["unread_notification_count"], 1)
+        self.assertFalse([q for q in queries if 'FROM "products_notification"' in q["sql"]])
+
+    def test_notifications_page_resets_count(self):
+        user = User.objects.create_user(username="u", password="p")
+        for i in range(3):
+            Notification.objects.create(recipient=user, title=f"T{i}", message="M")
+        self.client.login(username="u", password="p")
+        response = self.client.get(reverse("notifications"))
+        self.assertEqual(response.context["unread_notification_count"], 0)
+        self.assertEqual(UserProfile.objects.get(user=user).unread_notifications, 0)
+        Notification.objects.create(recipient=user, title="T", message="M")
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["unread_notification_count"], 1)
@@ -5,47 +5,118 @@ from django.contrib.auth import login
 from django.contrib import admin
 from django.contrib import messages
 from django.http import JsonResponse
-from django.db.models import Avg, Q
+from django.db.models import Avg
 from .forms import ProductForm, CustomUserCreationForm, ProfileForm, ReviewForm, UBURegisterForm, UserUpdateForm, ProfileUpdateForm, VerificationForm
-from .models import Product, Category, UserProfile, Review, Report, ReportImage, VerificationRequest, Notification
+from .models import Product, Category, UserProfile, Review, Report, ReportImage, VerificationRequest, Notification, CONDITION_CHOICES
+from .search import search_products
+from .fuzzy import fuzzy_search, fuzzy_search_available
+from .suggestions import suggestion_index, warm_index_in_background
+from .pagination import paginate_keyset, paginate_ids, first_page_count, wants_json, page_json
+from .search_cache import search_cache_key, cached_result_ids, search_cache_stats
+from .facets import get_facets, price_range_filter, SORT_OPTIONS, SORT_ORDERING
+from .related import related_products as get_related_products
+from .cache import home_grid_version
+from .home_grid import latest_products, HOME_GRID_TIMEOUT
 
 # General Views
 
 def home(request):
-    latest_products = Product.objects.filter(status='active').order_by('-created_at')[:8]
+    # queryset ถูก query จริงเฉพาะตอน fragment cache ใน home.html หมดอายุ/เวอร์ชันเปลี่ยน
     context = {
-        'products': latest_products
+        'products': latest_products(),
+        'home_grid_version': home_grid_version(),
+        'home_grid_timeout': HOME_GRID_TIMEOUT,
     }
     return render(request, 'home.html', context)
 
 def product_list_all(request):
-    products = Product.objects.filter(status='active').order_by('-created_at')
-    categories = Category.objects.all()
+    products = Product.objects.filter(status='active').for_cards().order_by('-created_at', '-id')
+    categories = list(Category.objects.all())
     
-    # 1. รับค่าคำค้นหา
+    # 1. รับค่าคำค้นหา (full-text search เรียงตามความเกี่ยวข้อง)
     query = request.GET.get('q')
+    active_products = products
     if query:
-        products = products.filter(
-            Q(name__icontains=query) | Q(description__icontains=query)
-        )
+        products = search_products(products, query)
+
+    # จำนวนสินค้าในแต่ละหมวด/สภาพ/ช่วงราคา (ตามคำค้นหา แต่ก่อนกรองหมวดหมู่)
+    category_ids = [c.id for c in categories]
+    facets = get_facets(products, query, category_ids)
+
+    # ไม่พบเลย (มักพิมพ์ผิด) -> ค้นแบบใกล้เคียงด้วย trigram แทน
+    fuzzy = bool(query) and facets['total'] == 0 and fuzzy_search_available()
+    if fuzzy:
+        products = fuzzy_search(active_products, query)
+        facets = get_facets(products, query, category_ids, mode='fuzzy')
+    for category in categories:
+        category.facet_count = facets['categories'][category.id]
     
     # 2. กรองหมวดหมู่
     selected_category_id = request.GET.get('category')
     if selected_category_id:
         products = products.filter(category_id=selected_category_id)
+
+    # 3. กรองสภาพสินค้า
+    selected_condition = request.GET.get('condition')
+    if selected_condition:
+        products = products.filter(condition=selected_condition)
+
+    # 4. กรองช่วงราคา
+    price_filter = price_range_filter(request.GET)
+    products = products.filter(price_filter)
+
+    # 5. การเรียง (ค่าเริ่มต้น: ตามความเกี่ยวข้องถ้ามีคำค้นหา ไม่งั้นใหม่ล่าสุด)
+    selected_sort = request.GET.get('sort')
+    if selected_sort in SORT_ORDERING:
+        products = products.order_by(*SORT_ORDERING[selected_sort])
         
+    # ผลค้นหาของคำยอดนิยมใช้ list ของ id ที่ cache ไว้ (ผลยาวเกินไปใช้ keyset กับ DB ตามเดิม)
+    page, product_count = None, None
+    if query:
+        cache_key = search_cache_key(
+            query, 'fuzzy' if fuzzy else 'search', selected_category_id, selected_condition,
+            request.GET.get('price'), request.GET.get('min_price'), request.GET.get('max_price'), selected_sort,
+        )
+        result_ids = cached_result_ids(cache_key, lambda: products.values_list('id', flat=True))
+        if result_ids is not None:
+            page = paginate_ids(request, result_ids, active_products)
+            product_count = len(result_ids)
+    if page is None:
+        page = paginate_keyset(request, products)
+    if wants_json(request):
+        return JsonResponse(page_json(page))
+    if product_count is None:
+        # ไม่ได้กรองเพิ่มจากชุดที่คำนวณ facets -> ใช้ยอดรวมของ facets (cache ไว้แล้ว) แทน COUNT
+        if selected_category_id or selected_condition or price_filter:
+            product_count = first_page_count(request, products)
+        else:
+            product_count = facets['total']
+
     context = {
-        'products': products,
+        'products': page,
+        'page': page,
+        'product_count': product_count,
         'categories': categories,
+        'facets': facets,
+        'condition_choices': [
+            (value, label, facets['conditions'][value]) for value, label in CONDITION_CHOICES
+        ],
         'selected_category_id': int(selected_category_id) if selected_category_id else None,
+        'selected_condition': selected_condition,
+        'selected_price': request.GET.get('price'),
+        'sort_options': [(key, label) for key, label, _ in SORT_OPTIONS],
+        'selected_sort': selected_sort,
         'search_query': query,
+        'fuzzy': fuzzy,
     }
     return render(request, 'products/product_list.html', context)
 
 # (ลบ function product_list ที่ซ้ำซ้อนออก ใช้ product_list_all แทน หรือปรับ URL ให้ตรงกัน)
 
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
+    product = get_object_or_404(
+        Product.objects.select_related('seller__profile', 'category').prefetch_related('favorites'), pk=pk
+    )
 
     # แก้ไข: ให้ Admin ดูสินค้า Pending ได้ด้วย (เพื่อกดอนุมัติ)
     # ถ้าไม่ใช่ Active, ไม่ใช่คนขาย, และ "ไม่ใช่ Admin" -> เด้งกลับ
@@ -57,10 +128,7 @@ def product_detail(request, pk):
     #     product.save()
 
     # สินค้าใกล้เคียง
-    related_products = Product.objects.filter(
-        category=product.category, 
-        status='active'
-    ).exclude(id=product.id).order_by('?')[:4] 
+    related_products = get_related_products(product)
 
     context = {
         'product': product,
@@ -72,8 +140,13 @@ def search_suggestions(request):
     query = request.GET.get('term', '')
     results = []
     if query:
-        products = Product.objects.filter(name__icontains=query, status='active')[:5]
-        results = [{'id': p.id, 'name': p.name} for p in products]
+        # ใช้ดัชนีในหน่วยความจำก่อน ถ้ายังไม่พร้อม (cold) ค่อย query DB
+        results = suggestion_index.lookup(query)
+        if results is None:
+            products = Product.objects.filter(name__icontains=query, status='active')[:5]
+            results = [{'id': p.id, 'name': p.name} for p in products]
+        elif suggestion_index.is_stale:
+            warm_index_in_background()
     return JsonResponse(results, safe=False)
 
 def register(request):
@@ -92,8 +165,15 @@ def register(request):
 
 @login_required
 def my_listings(request):
-    products = Product.objects.filter(seller=request.user).order_by('-created_at')
-    return render(request, 'products/my_listings.html', {'products': products})
+    products = Product.objects.filter(seller=request.user).for_cards().order_by('-created_at', '-id')
+    page = paginate_keyset(request, products)
+    if wants_json(request):
+        return JsonResponse(page_json(page))
+    return render(request, 'products/my_listings.html', {
+        'products': page,
+        'page': page,
+        'product_count': first_page_count(request, products),
+    })
 
 @login_required
 def product_create(request): 
@@ -202,13 +282,18 @@ def edit_profile(request):
 # (ลบ seller_profile อันเก่าออก ใช้ version นี้ที่สมบูรณ์กว่า)
 def seller_profile(request, seller_id):
     seller = get_object_or_404(User, pk=seller_id)
-    selling_products = Product.objects.filter(seller=seller, status='active').order_by('-created_at')
+    selling_products = Product.objects.filter(seller=seller, status='active').for_cards().order_by('-created_at', '-id')
+    page = paginate_keyset(request, selling_products)
+    if wants_json(request):
+        return JsonResponse(page_json(page))
     reviews = Review.objects.filter(seller=seller).order_by('-created_at')
     avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
 
     context = {
         'seller': seller,
-        'selling_products': selling_products,
+        'selling_products': page,
+        'page': page,
+        'selling_count': first_page_count(request, selling_products),
         'reviews': reviews,
         'review_count': reviews.count(),
         'avg_rating': round(avg_rating, 1),
@@ -260,8 +345,15 @@ def toggle_favorite(request, product_id):
 
 @login_required
 def wishlist(request):
-    products = request.user.favorite_products.filter(status='active').order_by('-created_at')
-    return render(request, 'products/wishlist.html', {'products': products})
+    products = request.user.favorite_products.filter(status='active').for_cards().order_by('-created_at', '-id')
+    page = paginate_keyset(request, products)
+    if wants_json(request):
+        return JsonResponse(page_json(page))
+    return render(request, 'products/wishlist.html', {
+        'products': page,
+        'page': page,
+        'product_count': first_page_count(request, products),
+    })
 
 # Reports (System with Images)
 
@@ -345,6 +437,7 @@ def admin_dashboard(request):
         'total_products': Product.objects.count(),
         'total_users': User.objects.count(),
         'pending_count': pending_products.count(),
+        'search_cache_stats': search_cache_stats(),
     }
     return render(request, 'admin_dashboard.html', context)
 
@@ -468,6 +561,6 @@ def notifications_view(request):
     notifs = Notification.objects.filter(recipient=request.user).order_by('-created_at')
     
     # เมื่อกดเข้ามาหน้านี้ ถือว่า "อ่านแล้ว" ทั้งหมด (ล้างเลขแจ้งเตือน)
-    notifs.filter(is_read=False).update(is_read=True)
+    Notification.mark_all_read(request.user)
     
     return render(request, 'products/notifications.html', {'notifications': notifs})
\ No newline at end of file
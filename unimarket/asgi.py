@@ -17,6 +17,7 @@ django.setup()
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import chat.routing
+from products.suggestions import warm_index_in_background
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
@@ -26,3 +27,6 @@ application = ProtocolTypeRouter({
         )
     ),
 })
+
+# สร้างดัชนี autocomplete ตอน worker เริ่มทำงาน (ระหว่างนี้ search_suggestions จะใช้ DB)
+warm_index_in_background()
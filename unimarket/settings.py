@@ -178,7 +178,7 @@ SOCIALACCOUNT_AUTO_SIGNUP = True
 SOCIALACCOUNT_ADAPTER = 'products.adapter.MySocialAccountAdapter'
 
 # =========================================================
-# 7. Channels (Redis for Production / InMemory for Dev)
+# 7. Channels (Redis for Production / PostgreSQL LISTEN/NOTIFY / InMemory for Dev)
 # =========================================================
 
 # ถ้าอยู่ใน Production (มี Redis) ให้ใช้ Redis
@@ -192,6 +192,13 @@ if os.environ.get("REDIS_HOST"):
             },
         },
     }
+elif os.environ.get("CHANNEL_LAYER") == "postgres":
+    # ไม่มี Redis แต่รันหลาย worker: ส่ง event ข้าม process ผ่าน LISTEN/NOTIFY ของ PostgreSQL
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "chat.layers.PostgresChannelLayer",
+        },
+    }
 else:
     # ถ้า Local ใช้แบบ InMemory (Dev Only)
     CHANNEL_LAYERS = {
@@ -200,6 +207,31 @@ else:
         }
     }
 
+# Cache (facets / เวอร์ชันแคตตาล็อก) ต้องแชร์กันทุก worker จึงใช้ Redis ถ้ามี
+if os.environ.get("REDIS_HOST"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": f"redis://{os.environ.get('REDIS_HOST')}:6379/1",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+
+
+# ดัชนี autocomplete ในหน่วยความจำ (products/suggestions.py)
+# 1 entry ~ 170 bytes -> 200,000 entries ~ 35 MB ต่อ worker; เกินงบจะกลับไปใช้ DB
+SEARCH_SUGGESTIONS_MAX_ENTRIES = 200_000
+SEARCH_SUGGESTIONS_MAX_AGE = 300  # วินาที: สร้างใหม่เพื่อรับการแก้ไขจาก worker อื่น
+
+# ค้นหาแบบใกล้เคียง (products/fuzzy.py) ต้องมี pg_trgm ถ้าไม่มีจะข้ามไป
+# True = คำนวณ trigram ใน Python แทน (อ่านชื่อสินค้าทั้งหมดทุกครั้ง) เปิดเฉพาะในชุดทดสอบ
+FUZZY_SEARCH_PYTHON_FALLBACK = False
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -15,4 +15,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'unimarket.settings')
 
 application = get_wsgi_application()
 
+# สร้างดัชนี autocomplete ตอน worker เริ่มทำงาน (ระหว่างนี้ search_suggestions จะใช้ DB)
+from products.suggestions import warm_index_in_background
+warm_index_in_background()
+
 app = application
\ No newline at end of file